@@ -1,16 +1,99 @@
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from flask import request, current_app
 from datetime import datetime, timezone, timedelta
-from pymongo import ASCENDING
 from pymongo.errors import PyMongoError
 from package import db
+from package.config.redis import redis_client
+from package.config.security import SecurityConfig
+import hashlib
+import jwt
+import math
+import threading
+import time
+import uuid
+
+# Sliding-window failure log: trims entries older than the window, records this
+# failure and caps the set, so each key holds at most `cap` members.
+# KEYS: one sorted set per counter (username, ip); ARGV: now_ms, window_ms, cap, member
+RECORD_FAILURE_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[1] - ARGV[2])
+    redis.call('ZADD', key, ARGV[1], ARGV[4])
+    redis.call('ZREMRANGEBYRANK', key, 0, -(tonumber(ARGV[3]) + 1))
+    redis.call('PEXPIRE', key, ARGV[2])
+end
+return 1
+"""
+
+# After a successful login: drops the username's window and that user's failures
+# from the IP window, so others behind the same IP aren't locked out by them.
+# Members end in ":<username tag>"; the IP window holds at most `cap` members.
+# KEYS: username window, IP window; ARGV: ":" .. username tag
+CLEAR_FAILURES_SCRIPT = """
+redis.call('DEL', KEYS[1])
+for _, member in ipairs(redis.call('ZRANGE', KEYS[2], 0, -1)) do
+    if string.sub(member, -#ARGV[1]) == ARGV[1] then
+        redis.call('ZREM', KEYS[2], member)
+    end
+end
+return 1
+"""
+
+# Refresh-token rotation as one compare-and-swap on the family's current jti.
+# KEYS: family key; ARGV: presented jti, new jti, ttl_seconds
+# Returns 1 when rotated, 0 when the family is unknown (expired or logged out) and
+# -1 when a superseded token was replayed, in which case the whole family is revoked.
+ROTATE_REFRESH_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return 0
+end
+if current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+redis.call('DEL', KEYS[1])
+return -1
+"""
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings. Membership answers are "definitely not"
+    or "maybe", so a miss can be trusted and a hit has to be confirmed elsewhere.
+    """
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing (Kirsch-Mitzenmacher) from a single 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
 
 class AuthManager:
     """Manages authentication security, failed login attempts, and token blocking."""
     
     MAX_LOGIN_ATTEMPTS = 5
     LOCKOUT_MINUTES = 15
-    TOKEN_EXPIRY_DAYS = 1
+    FAILED_LOGIN_KEY_PREFIX = 'failed_logins'
+    REFRESH_FAMILY_KEY_PREFIX = 'refresh_family'
+
+    _background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='auth-cleanup')
 
     class FailedLogin:
         """Handles failed login attempt records."""
@@ -33,86 +116,294 @@ class AuthManager:
                 return False
 
     class BlockedToken:
-        """Handles blocked token records."""
-        def __init__(self, token: str):
-            self.token = token
+        """
+        Revoked refresh tokens, keyed by their jti.
+
+        Redis holds one key per revoked jti that expires with the token itself, and
+        MongoDB keeps a durable copy. Each worker keeps a Bloom filter of revoked jtis,
+        seeded from MongoDB and kept current over pub/sub, so the common "not revoked"
+        answer needs no network hop. While the filter can't be trusted (no subscription
+        yet, listener died) every check goes to Redis, and to MongoDB if Redis is down.
+
+        A Bloom filter can't forget, so it is rebuilt from the unexpired revocations in
+        the background every REBUILD_SECONDS, or sooner once it holds more entries than
+        it was sized for. The old filter keeps answering until the new one is seeded.
+
+        A revocation that couldn't be written to Redis or broadcast is queued on the
+        worker that made it and replayed from is_blocked, at most every
+        REPLAY_SECONDS, until Redis takes it; other workers' filters would
+        otherwise keep answering "not revoked" for it until their next rebuild.
+        """
+        KEY_PREFIX = 'revoked_token'
+        CHANNEL = 'revoked_tokens'
+        FILTER_CAPACITY = 100_000
+        REBUILD_SECONDS = 6 * 3600
+        REPLAY_SECONDS = 5
+
+        _filter = None
+        _filter_ready = False
+        _built_at = 0.0
+        # Filter being seeded by a rebuild; receives new revocations alongside _filter
+        _pending = None
+        _listener = None
+        _lock = threading.Lock()
+        # jti -> expires_at of revocations not yet in Redis, and when to retry them
+        _unpublished = {}
+        _replay_at = 0.0
+
+        def __init__(self, jti: str, expires_at: datetime):
+            self.jti = jti
+            self.expires_at = expires_at
             self.created_at = datetime.now(timezone.utc)
 
         def create(self) -> bool:
-            """Create a new blocked token record."""
+            """Record the revocation durably, then in Redis and in every worker's filter."""
             try:
-                db.BlockedTokens.insert_one({
-                    'token': self.token,
-                    'created_at': self.created_at
-                })
-                return True
+                db.BlockedTokens.update_one(
+                    {'jti': self.jti},
+                    {'$setOnInsert': {'expires_at': self.expires_at, 'created_at': self.created_at}},
+                    upsert=True
+                )
             except PyMongoError as e:
                 current_app.logger.error(f"Failed to block token: {str(e)}")
                 return False
 
-        @staticmethod
-        def is_blocked(token: str) -> bool:
-            """Check if a token is blocked."""
+            cls = type(self)
+            cls._add(self.jti)
+            try:
+                cls._publish({self.jti: self.expires_at})
+            except Exception as e:
+                current_app.logger.warning(f"Failed to publish token revocation, will retry: {str(e)}")
+                cls._unpublished[self.jti] = self.expires_at
+                cls._replay_at = time.monotonic() + cls.REPLAY_SECONDS
+            return True
+
+        @classmethod
+        def _publish(cls, revocations: dict):
+            """Write revocations (jti -> expires_at) to Redis and broadcast them to every worker."""
+            now = datetime.now(timezone.utc)
+            pipe = redis_client.pipeline(transaction=False)
+            for jti, expires_at in revocations.items():
+                pipe.set(f"{cls.KEY_PREFIX}:{jti}", 1, ex=max(1, int((expires_at - now).total_seconds())))
+                pipe.publish(cls.CHANNEL, jti)
+            pipe.execute()
+
+        @classmethod
+        def _replay(cls):
+            """Retry the revocations this worker couldn't publish."""
+            if time.monotonic() < cls._replay_at:
+                return
+            cls._replay_at = time.monotonic() + cls.REPLAY_SECONDS
+            revocations = dict(cls._unpublished)
             try:
-                return db.BlockedTokens.find_one({'token': token}) is not None
+                cls._publish(revocations)
+            except Exception:
+                return
+            for jti in revocations:
+                cls._unpublished.pop(jti, None)
+            current_app.logger.info(f"Published {len(revocations)} delayed token revocations")
+
+        @classmethod
+        def is_blocked(cls, jti: str) -> bool:
+            """Check if the token with this jti has been revoked."""
+            if not jti:
+                return True
+            if cls._unpublished:
+                cls._replay()
+            if cls._ensure_filter() and jti not in cls._filter:
+                return False
+            try:
+                return bool(redis_client.exists(f"{cls.KEY_PREFIX}:{jti}"))
+            except Exception as e:
+                current_app.logger.warning(f"Redis revocation check failed, using MongoDB: {str(e)}")
+            try:
+                return db.BlockedTokens.find_one({'jti': jti}, {'_id': 1}) is not None
             except PyMongoError as e:
                 current_app.logger.error(f"Failed to check blocked token: {str(e)}")
                 return True  # Fail secure - assume token is blocked if we can't check
 
+        @classmethod
+        def _add(cls, jti):
+            for bloom in (cls._filter, cls._pending):
+                if bloom is not None:
+                    bloom.add(jti)
+
+        @classmethod
+        def _on_revoked(cls, message):
+            if message.get('data'):
+                cls._add(message['data'])
+
+        @classmethod
+        def _on_listener_error(cls, error, pubsub, thread):
+            # Revocations from other workers may now be missed: stop trusting the
+            # filter until it has been rebuilt behind a fresh subscription
+            cls._filter_ready = False
+            cls._filter = None
+            thread.stop()
+
+        @classmethod
+        def _new_filter(cls) -> BloomFilter:
+            live = db.BlockedTokens.count_documents({'expires_at': {'$gt': datetime.now(timezone.utc)}})
+            return BloomFilter(capacity=max(cls.FILTER_CAPACITY, 2 * live))
+
+        @classmethod
+        def _ensure_filter(cls) -> bool:
+            if cls._filter_ready:
+                bloom = cls._filter
+                if bloom is not None and (bloom.count > bloom.capacity or time.monotonic() - cls._built_at > cls.REBUILD_SECONDS):
+                    cls._rebuild_later()
+                return True
+            if not cls._lock.acquire(blocking=False):
+                return False  # another thread is rebuilding; go to Redis meanwhile
+            try:
+                if cls._listener is not None:
+                    cls._listener.stop()
+                    cls._listener = None
+                # Subscribe before reading MongoDB so nothing revoked in between is lost
+                cls._filter = cls._new_filter()
+                cls._built_at = time.monotonic()
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{cls.CHANNEL: cls._on_revoked})
+                cls._listener = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True, exception_handler=cls._on_listener_error
+                )
+                cls._seed(cls._filter)
+                cls._filter_ready = True
+            except Exception as e:
+                current_app.logger.warning(f"Token revocation filter unavailable: {str(e)}")
+                cls._filter = None
+            finally:
+                cls._lock.release()
+            return cls._filter_ready
+
+        @classmethod
+        def _rebuild_later(cls):
+            """Replace the filter with a freshly seeded one on the background thread."""
+            if not cls._lock.acquire(blocking=False):
+                return  # already being built or rebuilt
+            app = current_app._get_current_object()
+
+            def rebuild():
+                try:
+                    with app.app_context():
+                        cls._pending = cls._new_filter()
+                        cls._seed(cls._pending)
+                        cls._filter, cls._built_at = cls._pending, time.monotonic()
+                except Exception as e:
+                    app.logger.warning(f"Failed to rebuild token revocation filter: {str(e)}")
+                finally:
+                    cls._pending = None
+                    cls._lock.release()
+
+            try:
+                AuthManager._background.submit(rebuild)
+            except Exception:
+                cls._lock.release()
+                raise
+
+        @classmethod
+        def _seed(cls, bloom: BloomFilter):
+            """
+            Load every unexpired revocation from MongoDB into the filter and make sure
+            Redis has it too. Records written before revocation was keyed by jti only
+            carry the token string; their jti is read back out of it and stored.
+            """
+            now = datetime.now(timezone.utc)
+            legacy_cutoff = now - SecurityConfig.JWT_REFRESH_TOKEN_EXPIRES
+            pipe = redis_client.pipeline(transaction=False)
+            for doc in db.BlockedTokens.find(
+                {'$or': [
+                    {'expires_at': {'$gt': now}},
+                    {'jti': {'$exists': False}, 'created_at': {'$gt': legacy_cutoff}}
+                ]},
+                {'jti': 1, 'token': 1, 'expires_at': 1}
+            ):
+                jti, expires_at = doc.get('jti'), doc.get('expires_at')
+                if not jti:
+                    try:
+                        claims = jwt.decode(doc['token'], options={'verify_signature': False})
+                        jti = claims['jti']
+                        expires_at = datetime.fromtimestamp(claims['exp'], tz=timezone.utc)
+                    except (jwt.InvalidTokenError, KeyError):
+                        continue
+                    db.BlockedTokens.update_one(
+                        {'_id': doc['_id']},
+                        {'$set': {'jti': jti, 'expires_at': expires_at}, '$unset': {'token': ''}}
+                    )
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                ttl = int((expires_at - now).total_seconds())
+                if ttl <= 0:
+                    continue
+                bloom.add(jti)
+                pipe.set(f"{cls.KEY_PREFIX}:{jti}", 1, ex=ttl, nx=True)
+            pipe.execute()
+
     @classmethod
-    def initialize_db(cls) -> bool:
-        """Initialize database indexes for security collections."""
-        try:
-            # Failed Logins indexes
-            db.FailedLogins.create_index([("username", ASCENDING)])
-            db.FailedLogins.create_index([("ip_address", ASCENDING)])
-            db.FailedLogins.create_index([
-                ("username", ASCENDING),
-                ("timestamp", ASCENDING)
-            ])
-            db.FailedLogins.create_index([
-                ("ip_address", ASCENDING),
-                ("timestamp", ASCENDING)
-            ])
-            
-            # Blocked Tokens indexes
-            db.BlockedTokens.create_index(
-                [("token", ASCENDING)], 
-                unique=True
-            )
-            db.BlockedTokens.create_index(
-                [("created_at", ASCENDING)],
-                expireAfterSeconds=cls.TOKEN_EXPIRY_DAYS * 86400
-            )
-            
-            return True
-        except PyMongoError as e:
-            current_app.logger.error(f"Failed to initialize database indexes: {str(e)}")
-            return False
+    def _failure_keys(cls, username: str, ip_address: str) -> list:
+        return [
+            f"{cls.FAILED_LOGIN_KEY_PREFIX}:user:{username}",
+            f"{cls.FAILED_LOGIN_KEY_PREFIX}:ip:{ip_address}"
+        ]
+
+    @staticmethod
+    def _failure_tag(username: str) -> str:
+        """Marks a user's members in the IP window without storing the username."""
+        return hashlib.sha256(username.encode()).hexdigest()[:16]
 
     @classmethod
-    def check_brute_force(cls, username: str, ip_address: str) -> bool:
+    def failed_attempts(cls, username: str, ip_address: str) -> int:
         """
-        Check if too many failed login attempts have occurred.
-        Returns True if attempts exceed maximum allowed.
+        Number of failed logins in the lockout window, for the username or the IP
+        (whichever is higher). Counts come from Redis sliding windows; MongoDB is
+        only used if Redis is unreachable.
         """
+        now_ms = int(time.time() * 1000)
+        window_start = now_ms - cls.LOCKOUT_MINUTES * 60 * 1000
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in cls._failure_keys(username, ip_address):
+                pipe.zcount(key, window_start, '+inf')
+            return max(int(count) for count in pipe.execute())
+        except Exception as e:
+            current_app.logger.warning(f"Redis brute force check failed, using MongoDB: {str(e)}")
+
         try:
             cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=cls.LOCKOUT_MINUTES)
-            failed_attempts = db.FailedLogins.count_documents({
+            return db.FailedLogins.count_documents({
                 "$or": [
                     {"username": username},
                     {"ip_address": ip_address}
                 ],
                 "timestamp": {"$gte": cutoff_time}
             })
-            return failed_attempts >= cls.MAX_LOGIN_ATTEMPTS
         except PyMongoError as e:
             current_app.logger.error(f"Failed to check brute force attempts: {str(e)}")
-            return True  # Fail secure - assume too many attempts if we can't check
+            return cls.MAX_LOGIN_ATTEMPTS  # Fail secure - assume too many attempts if we can't check
+
+    @classmethod
+    def check_brute_force(cls, username: str, ip_address: str) -> bool:
+        """
+        Check if too many failed login attempts have occurred.
+        Returns True if attempts for the username or the IP exceed maximum allowed.
+        """
+        return cls.failed_attempts(username, ip_address) >= cls.MAX_LOGIN_ATTEMPTS
 
     @classmethod
     def record_failed_attempt(cls, username: str, ip_address: str) -> bool:
         """Record a failed login attempt."""
+        now_ms = int(time.time() * 1000)
+        try:
+            # Registered per call so it runs on the current client; redis-py only
+            # hashes the source here and loads it into Redis on the first NOSCRIPT
+            redis_client.register_script(RECORD_FAILURE_SCRIPT)(
+                keys=cls._failure_keys(username, ip_address),
+                args=[now_ms, cls.LOCKOUT_MINUTES * 60 * 1000, cls.MAX_LOGIN_ATTEMPTS, f"{now_ms}:{uuid.uuid4().hex[:8]}:{cls._failure_tag(username)}"]
+            )
+            return True
+        except Exception as e:
+            current_app.logger.warning(f"Redis failed-login record failed, using MongoDB: {str(e)}")
+
         try:
             failed_login = cls.FailedLogin(username, ip_address)
             return failed_login.create()
@@ -121,8 +412,16 @@ class AuthManager:
             return False
 
     @classmethod
-    def clear_failed_attempts(cls, username: str) -> bool:
-        """Clear all failed attempts for a username."""
+    def clear_failed_attempts(cls, username: str, ip_address: str) -> bool:
+        """Clear all failed attempts for a username, including its share of the IP's window."""
+        try:
+            redis_client.register_script(CLEAR_FAILURES_SCRIPT)(
+                keys=cls._failure_keys(username, ip_address), args=[f":{cls._failure_tag(username)}"]
+            )
+            return True
+        except Exception as e:
+            current_app.logger.warning(f"Redis failed-login clear failed, using MongoDB: {str(e)}")
+
         try:
             db.FailedLogins.delete_many({"username": username})
             return True
@@ -131,11 +430,81 @@ class AuthManager:
             return False
 
     @classmethod
-    def block_token(cls, token: str) -> bool:
-        """Block a refresh token."""
+    def clear_failed_attempts_later(cls, username: str, ip_address: str):
+        """Clear failed attempts on a background thread so the caller doesn't wait on it."""
+        app = current_app._get_current_object()
+
+        def clear():
+            with app.app_context():
+                cls.clear_failed_attempts(username, ip_address)
+
+        cls._background.submit(clear)
+
+    @classmethod
+    def block_token(cls, payload: dict) -> bool:
+        """Block a refresh token, given its decoded payload, until it would have expired anyway."""
         try:
-            blocked_token = cls.BlockedToken(token)
+            expires_at = datetime.fromtimestamp(payload['exp'], tz=timezone.utc)
+            blocked_token = cls.BlockedToken(payload['jti'], expires_at)
             return blocked_token.create()
         except Exception as e:
             current_app.logger.error(f"Failed to block token: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    # Refresh-token families: every refresh token issued from one login shares a
+    # family id, and Redis holds the jti of the only token in the family that may
+    # still be used. These return None when Redis can't answer, so callers can fall
+    # back to the MongoDB blocklist.
+
+    @classmethod
+    def _family_key(cls, family_id: str) -> str:
+        return f"{cls.REFRESH_FAMILY_KEY_PREFIX}:{family_id}"
+
+    @classmethod
+    def start_token_family(cls, family_id: str, jti: str) -> bool:
+        """Register a new family whose current token is `jti`."""
+        try:
+            ttl = int(SecurityConfig.JWT_REFRESH_TOKEN_EXPIRES.total_seconds())
+            return bool(redis_client.set(cls._family_key(family_id), jti, ex=ttl))
+        except Exception as e:
+            current_app.logger.warning(f"Failed to start refresh token family: {str(e)}")
+            return False
+
+    @classmethod
+    def rotate_token_family(cls, family_id: str, jti: str, new_jti: str):
+        """
+        Swap the family's current token from `jti` to `new_jti`.
+        Returns 1 if rotated, 0 if the family no longer exists, -1 if `jti` was
+        already superseded (reuse: the family is revoked), None if Redis failed.
+        """
+        try:
+            ttl = int(SecurityConfig.JWT_REFRESH_TOKEN_EXPIRES.total_seconds())
+            result = redis_client.register_script(ROTATE_REFRESH_SCRIPT)(
+                keys=[cls._family_key(family_id)], args=[jti, new_jti, ttl]
+            )
+        except Exception as e:
+            current_app.logger.warning(f"Refresh token rotation failed, using MongoDB: {str(e)}")
+            return None
+        if result == -1:
+            current_app.logger.warning(f"Refresh token reuse detected, revoked family {family_id}")
+        return result
+
+    @classmethod
+    def is_current_token(cls, family_id: str, jti: str):
+        """True if `jti` is the family's current token, None if Redis failed."""
+        try:
+            current = redis_client.get(cls._family_key(family_id))
+        except Exception as e:
+            current_app.logger.warning(f"Refresh token family check failed, using MongoDB: {str(e)}")
+            return None
+        return current == jti
+
+    @classmethod
+    def end_token_family(cls, family_id: str) -> bool:
+        """Revoke every token in the family."""
+        try:
+            redis_client.delete(cls._family_key(family_id))
+            return True
+        except Exception as e:
+            current_app.logger.warning(f"Failed to end refresh token family: {str(e)}")
+            return False
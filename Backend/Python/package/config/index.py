@@ -54,6 +54,44 @@ def initialize_all_indexes(db):
             [("user_id", ASCENDING), ("workspace_id", ASCENDING)], unique=True, background=True
         )
 
+        # --- Permission Collections ---
+        # Nested permission documents are always fetched by user
+        db.user_permissions.create_index([("userId", ASCENDING)], background=True)
+        # Flattened grants: point lookups per (user, scope), member listings per scope,
+        # and removing a user from an organisation with all of its workspaces
+        db.permission_grants.create_index(
+            [("userId", ASCENDING), ("scope_type", ASCENDING), ("scope_id", ASCENDING)], unique=True, background=True
+        )
+        db.permission_grants.create_index([("scope_type", ASCENDING), ("scope_id", ASCENDING)], background=True)
+        db.permission_grants.create_index([("userId", ASCENDING), ("organizationId", ASCENDING)], background=True)
+
+        # --- Activity ---
+        # Day buckets (User_Activity): the bucket upsert, a user's recent activity and
+        # rebuilding their recently accessed entities, and retention
+        db.User_Activity.create_index([("user_id", ASCENDING), ("day", DESCENDING)], background=True)
+        db.User_Activity.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0, background=True)
+        # Workspace and organisation feeds (Activity_Feed): the keyset sort follows the
+        # scope, and the fields a page returns without metadata follow that
+        # (User_Activity.FEED_FIELDS), so those pages are covered by the index
+        for scope in ("workspace_id", "organisation_id"):
+            db.Activity_Feed.create_index(
+                [(scope, ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING),
+                 ("user_id", ASCENDING), ("action", ASCENDING), ("entity_type", ASCENDING), ("entity_id", ASCENDING)],
+                partialFilterExpression={scope: {"$exists": True}}, background=True
+            )
+        db.Activity_Feed.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0, background=True)
+
+        # --- Security Collections ---
+        # Fallback failed-login records are only counted inside the 15 minute lockout window
+        # (AuthManager.LOCKOUT_MINUTES), so let MongoDB expire them after that
+        db.FailedLogins.create_index([("username", ASCENDING), ("timestamp", ASCENDING)], background=True)
+        db.FailedLogins.create_index([("ip_address", ASCENDING), ("timestamp", ASCENDING)], background=True)
+        db.FailedLogins.create_index([("timestamp", ASCENDING)], expireAfterSeconds=15 * 60, background=True)
+        # Revoked refresh tokens: looked up by jti, dropped once the token would have expired.
+        # Sparse because records from before jti keying only have the token string.
+        db.BlockedTokens.create_index([("jti", ASCENDING)], unique=True, sparse=True, background=True)
+        db.BlockedTokens.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0, background=True)
+
         logging.info("Database indexes initialized successfully.")
     except Exception as e:
         logging.error(f"Error initializing indexes: {str(e)}")
@@ -1,7 +1,17 @@
 from package import db
-from bson import ObjectId
+from package.config.redis import redis_client
+from package.config.security import SecurityConfig
+from package.config.slug import SlugResolver
+from bson import ObjectId, json_util
 from datetime import datetime
 from enum import Enum
+from functools import wraps
+from flask import g, has_app_context
+from pymongo import UpdateOne
+import inspect
+import os
+import sys
+import time
 
 class Roles(Enum):
     ADMIN = 'Admin'
@@ -65,8 +75,405 @@ WORKSPACE_PERMISSIONS = {
     ]
 }
 
+def _compile_permission_bits(*role_tables):
+    """Intern every permission name to a bit position, in definition order."""
+    bits = {}
+    for table in role_tables:
+        for permissions in table.values():
+            for permission in permissions:
+                bits.setdefault(sys.intern(permission), 1 << len(bits))
+    return bits
+
+PERMISSION_BITS = _compile_permission_bits(ORGANIZATION_PERMISSIONS, WORKSPACE_PERMISSIONS)
+
+# No role holds this bit, so unknown permission names are never granted
+_UNKNOWN_PERMISSION_BIT = 1 << len(PERMISSION_BITS)
+
+def permission_mask(permissions):
+    """Compile a permission name, or an iterable of names, into a bitmask."""
+    if not permissions:
+        return _UNKNOWN_PERMISSION_BIT
+    if isinstance(permissions, str):
+        permissions = (permissions,)
+    mask = 0
+    for permission in permissions:
+        mask |= PERMISSION_BITS.get(permission, _UNKNOWN_PERMISSION_BIT)
+    return mask
+
+def permission_names(mask):
+    """Expand a bitmask back into permission names."""
+    return [name for name, bit in PERMISSION_BITS.items() if mask & bit]
+
+ORGANIZATION_ROLE_MASKS = {role: permission_mask(permissions) for role, permissions in ORGANIZATION_PERMISSIONS.items()}
+WORKSPACE_ROLE_MASKS = {role: permission_mask(permissions) for role, permissions in WORKSPACE_PERMISSIONS.items()}
+
+def _request_cache(name):
+    """Return a dict memoised on `g` for the current request, or None outside one."""
+    if not has_app_context():
+        return None
+    cache = g.get(name)
+    if cache is None:
+        cache = {}
+        setattr(g, name, cache)
+    return cache
+
+def _resolve_slug(collection, slug):
+    """Resolve an organisation/workspace slug to its _id."""
+    return SlugResolver.resolve(collection.name, slug)
+
+def _load_user_permissions(user_id):
+    """
+    Load the caller's user_permissions document.
+    The document is cached on `g`, so every org and workspace check made while
+    serving a request is answered from memory after the first read.
+    """
+    cache = _request_cache('_user_permissions')
+    if cache is not None and user_id in cache:
+        return cache[user_id]
+    user_perms = db.user_permissions.find_one({"userId": user_id}, {"organizations": 1})
+    if cache is not None:
+        cache[user_id] = user_perms
+    return user_perms
+
+def _forget_user_permissions(user_id):
+    """Drop a cached user_permissions document after it has been written."""
+    cache = _request_cache('_user_permissions')
+    if cache is not None:
+        cache.pop(ObjectId(user_id), None)
+
+class PermissionsUnavailable(Exception):
+    """A permission write was refused because the user's old claims couldn't be invalidated."""
+
+def _invalidates_permissions(func):
+    """
+    Invalidate the user's cached permissions around a permission write. With
+    PermissionClaims enabled the version must be bumped before the write, or the
+    write is refused: every worker would otherwise keep trusting the old claims.
+    The bump after the write discards anything cached or signed in between.
+    """
+    @wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        if PermissionCache.invalidate(user_id) is None and PermissionClaims.ENABLED:
+            raise PermissionsUnavailable(f"Can't invalidate permissions of user {user_id}")
+        try:
+            return func(user_id, *args, **kwargs)
+        finally:
+            _forget_user_permissions(user_id)
+            PermissionCache.invalidate(user_id)
+    return wrapper
+
+def _mirrors_to_grants(mirror):
+    """
+    Dual-write a successful user_permissions write onto permission_grants.
+    `mirror` is called with the wrapped call's bound arguments.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            succeeded = result[0] if isinstance(result, tuple) else result
+            if succeeded:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                mirror(**bound.arguments)
+            return result
+        return wrapper
+    return decorator
+
+class PermissionGrants:
+    """
+    Flattened permission grants: one row per (user, scope_type, scope_id, role).
+
+    Every row carries its organizationId, so removing a user from an
+    organisation drops the org grant and its workspace grants in one delete.
+    PermissionService dual-writes here while user_permissions is still the
+    source of truth; reads switch over once READ_ENABLED is set after migrate().
+    """
+
+    ORGANIZATION = 'organization'
+    WORKSPACE = 'workspace'
+    READ_ENABLED = os.getenv('PERMISSION_GRANTS_READ', 'false').lower() == 'true'
+
+    @staticmethod
+    def grant(user_id, scope_type, scope_id, role, organisation_id):
+        now = datetime.now()
+        db.permission_grants.update_one(
+            {"userId": ObjectId(user_id), "scope_type": scope_type, "scope_id": ObjectId(scope_id)},
+            {
+                "$set": {"role": role, "organizationId": ObjectId(organisation_id), "updatedAt": now},
+                "$setOnInsert": {"createdAt": now}
+            },
+            upsert=True
+        )
+
+    @staticmethod
+    def revoke(user_id, scope_type, scope_id):
+        db.permission_grants.delete_one({"userId": ObjectId(user_id), "scope_type": scope_type, "scope_id": ObjectId(scope_id)})
+
+    @staticmethod
+    def revoke_organization(user_id, org_id):
+        """Drop the organisation grant and every workspace grant under it."""
+        db.permission_grants.delete_many({"userId": ObjectId(user_id), "organizationId": ObjectId(org_id)})
+
+    @staticmethod
+    def lookup(user_id, organisation_id=None, workspace_id=None):
+        """
+        Resolve a role with one indexed query on (userId, scope_type, scope_id).
+        Returns the same shapes as PermissionService.get_user_permissions.
+        """
+        scopes = []
+        if organisation_id:
+            scopes.append({"scope_type": PermissionGrants.ORGANIZATION, "scope_id": organisation_id})
+        if workspace_id:
+            scopes.append({"scope_type": PermissionGrants.WORKSPACE, "scope_id": workspace_id})
+        if not scopes:
+            return None
+
+        grants = {
+            grant["scope_type"]: grant
+            for grant in db.permission_grants.find(
+                {"userId": user_id, "$or": scopes},
+                {"scope_type": 1, "role": 1, "organizationId": 1}
+            )
+        }
+
+        ws_grant = grants.get(PermissionGrants.WORKSPACE)
+        if organisation_id:
+            org_grant = grants.get(PermissionGrants.ORGANIZATION)
+            if not org_grant:
+                return None
+            if workspace_id and (not ws_grant or ws_grant["organizationId"] != organisation_id):
+                return None
+            return org_grant.get("role")
+
+        if ws_grant:
+            return {
+                "status": "workspace_role",
+                "role": ws_grant.get("role"),
+                "organizationId": ws_grant["organizationId"],
+            }
+        return None
+
+    @staticmethod
+    def migrate(batch_size=500):
+        """
+        Backfill permission_grants from the nested user_permissions documents.
+        Idempotent: rows are upserted on (userId, scope_type, scope_id).
+        """
+        operations = []
+        migrated = 0
+        now = datetime.now()
+
+        def upsert(user_id, scope_type, scope_id, role, organisation_id):
+            return UpdateOne(
+                {"userId": user_id, "scope_type": scope_type, "scope_id": scope_id},
+                {
+                    "$set": {"role": role, "organizationId": organisation_id, "updatedAt": now},
+                    "$setOnInsert": {"createdAt": now}
+                },
+                upsert=True
+            )
+
+        for user_perms in db.user_permissions.find({}, {"userId": 1, "organizations": 1}):
+            for org in user_perms.get("organizations", []):
+                org_id = org["organizationId"]
+                operations.append(upsert(user_perms["userId"], PermissionGrants.ORGANIZATION, org_id, org.get("role"), org_id))
+                for ws in org.get("workspaces", []):
+                    operations.append(upsert(user_perms["userId"], PermissionGrants.WORKSPACE, ws["workspaceId"], ws.get("role"), org_id))
+
+            if len(operations) >= batch_size:
+                db.permission_grants.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+                operations = []
+
+        if operations:
+            db.permission_grants.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+        return migrated
+
+    # ---- Dual-write mirrors for PermissionService ---- #
+    @staticmethod
+    def mirror_organization_invite(user_id, org_id, role):
+        PermissionGrants.grant(user_id, PermissionGrants.ORGANIZATION, org_id, role, org_id)
+
+    @staticmethod
+    def mirror_organization_removal(user_id, org_id):
+        PermissionGrants.revoke_organization(user_id, org_id)
+
+    @staticmethod
+    def mirror_workspace_invite(user_id, org_id, workspace_id, role):
+        PermissionGrants.grant(user_id, PermissionGrants.WORKSPACE, workspace_id, role, org_id)
+
+    @staticmethod
+    def mirror_workspace_removal(user_id, org_id, workspace_id):
+        PermissionGrants.revoke(user_id, PermissionGrants.WORKSPACE, workspace_id)
+
+    @staticmethod
+    def mirror_role_update(user_id, org_id, workspace_id, new_role):
+        if workspace_id:
+            PermissionGrants.grant(user_id, PermissionGrants.WORKSPACE, workspace_id, new_role, org_id)
+        else:
+            PermissionGrants.grant(user_id, PermissionGrants.ORGANIZATION, org_id, new_role, org_id)
+
+class PermissionCache:
+    """
+    Redis cache of resolved roles keyed by (user, org/workspace).
+
+    Keys embed a per-user version; a permission write bumps the version so every
+    previously cached role for that user becomes unreachable at once, and a
+    reader racing the write can only store its result under the stale version.
+
+    Versions start from the clock in microseconds whenever the key is missing
+    (first use, expiry, eviction), so a version number is never handed out twice
+    and claims signed at an old one can't match again.
+    """
+
+    TTL_SECONDS = 300
+    KEY_PREFIX = 'permissions'
+    # Outlives every access token signed at the version
+    VERSION_TTL_SECONDS = 2 * int(SecurityConfig.JWT_ACCESS_TOKEN_EXPIRES.total_seconds())
+
+    _stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'errors': 0}
+
+    @classmethod
+    def _version_key(cls, user_id):
+        return f"{cls.KEY_PREFIX}:version:{user_id}"
+
+    @classmethod
+    def version(cls, user_id):
+        """Current cache version for a user, memoised on `g` for the request."""
+        versions = _request_cache('_permission_versions')
+        if versions is not None and user_id in versions:
+            return versions[user_id]
+        key = cls._version_key(user_id)
+        version = redis_client.get(key)
+        if version is None:
+            redis_client.set(key, cls._initial_version(), ex=cls.VERSION_TTL_SECONDS, nx=True)
+            version = redis_client.get(key)
+        version = int(version)
+        if versions is not None:
+            versions[user_id] = version
+        return version
+
+    @staticmethod
+    def _initial_version():
+        return time.time_ns() // 1000
+
+    @classmethod
+    def _key(cls, user_id, scope):
+        return f"{cls.KEY_PREFIX}:{user_id}:v{cls.version(user_id)}:{scope}"
+
+    @classmethod
+    def get(cls, user_id, scope):
+        """Return (hit, value) for a cached role lookup."""
+        try:
+            raw = redis_client.get(cls._key(user_id, scope))
+            if raw is not None:
+                value = json_util.loads(raw)['value']
+                cls._stats['hits'] += 1
+                return True, value
+        except Exception:
+            cls._stats['errors'] += 1
+        cls._stats['misses'] += 1
+        return False, None
+
+    @classmethod
+    def set(cls, user_id, scope, value):
+        """Cache a role lookup, including negative (None) results."""
+        try:
+            redis_client.set(cls._key(user_id, scope), json_util.dumps({'value': value}), ex=cls.TTL_SECONDS)
+        except Exception:
+            cls._stats['errors'] += 1
+
+    @classmethod
+    def invalidate(cls, user_id):
+        """Bump the user's version so all of their cached roles are discarded."""
+        user_id = str(user_id)
+        versions = _request_cache('_permission_versions')
+        if versions is not None:
+            versions.pop(user_id, None)
+        try:
+            key = cls._version_key(user_id)
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.set(key, cls._initial_version(), ex=cls.VERSION_TTL_SECONDS, nx=True)
+            pipe.incr(key)
+            pipe.expire(key, cls.VERSION_TTL_SECONDS)
+            version = int(pipe.execute()[1])
+            cls._stats['invalidations'] += 1
+            return version
+        except Exception:
+            cls._stats['errors'] += 1
+            return None
+
+    @classmethod
+    def stats(cls):
+        """Hit/miss counters for this worker process."""
+        lookups = cls._stats['hits'] + cls._stats['misses']
+        return {**cls._stats, 'hit_ratio': round(cls._stats['hits'] / lookups, 4) if lookups else None}
+
+class PermissionClaims:
+    """
+    Compact role claims signed into access tokens (opt-in via JWT_PERMISSION_CLAIMS).
+
+    Claims carry the PermissionCache version they were built at. Read-only
+    checks (view_* permissions) trust them only while that is still the user's
+    current version in Redis; every permission write bumps the version, so role
+    changes still take effect immediately. Whenever the current version can't be
+    read the check goes to the database. Write permissions are always checked
+    server-side.
+    """
+
+    ENABLED = os.getenv('JWT_PERMISSION_CLAIMS', 'false').lower() == 'true'
+    READ_PREFIX = 'view_'
+
+    @staticmethod
+    def build(user_id):
+        """
+        Build the `perms` claim for a user: {'v': version, 'o': {org: role}, 'w': {ws: role}}.
+        Returns None if the version can't be read, as such claims could never be trusted.
+        """
+        user_id = ObjectId(user_id)
+        # Read the version first so a concurrent write can only make these claims stale
+        try:
+            version = PermissionCache.version(str(user_id))
+        except Exception:
+            return None
+        user_perms = db.user_permissions.find_one({"userId": user_id}, {"organizations": 1}) or {}
+        organisations, workspaces = {}, {}
+        for org in user_perms.get("organizations", []):
+            organisations[str(org["organizationId"])] = org.get("role")
+            for ws in org.get("workspaces", []):
+                workspaces[str(ws["workspaceId"])] = ws.get("role")
+        return {'v': version, 'o': organisations, 'w': workspaces}
+
+    @classmethod
+    def role(cls, user_id, scope, scope_id, permission):
+        """
+        Answer a read check from the request's token claims.
+        Returns (trusted, role); when not trusted the caller must query the database.
+        """
+        if not cls.ENABLED or not scope_id or not has_app_context():
+            return False, None
+        permissions = (permission,) if isinstance(permission, str) else (permission or ())
+        if not permissions or not all(p.startswith(cls.READ_PREFIX) for p in permissions):
+            return False, None
+        claims = g.get('permission_claims')
+        if not claims or str(g.get('user_id')) != str(user_id):
+            return False, None
+        try:
+            current = PermissionCache.version(str(user_id))
+        except Exception:
+            return False, None  # Fail secure - fall back to the database
+        if claims.get('v') != current:
+            return False, None
+        return True, claims.get(scope, {}).get(str(scope_id))
+
 class PermissionService:
     
+    @_invalidates_permissions
+    @_mirrors_to_grants(PermissionGrants.mirror_organization_invite)
     def invite_user_to_organization( user_id, org_id, role="member"):
         """
         Add user to organization with specified role, or update their role if they already exist.
@@ -137,6 +544,8 @@ class PermissionService:
 
         
     
+    @_invalidates_permissions
+    @_mirrors_to_grants(PermissionGrants.mirror_organization_removal)
     def remove_user_from_organization(user_id, org_id):
         """Remove user from organization and all its workspaces"""
         result = db.user_permissions.update_one({
@@ -144,6 +553,8 @@ class PermissionService:
             {"$pull": {"organizations": {"organizationId": ObjectId(org_id)}}}    )
         return result
     
+    @_invalidates_permissions
+    @_mirrors_to_grants(PermissionGrants.mirror_workspace_invite)
     def invite_user_to_workspace(user_id, org_id, workspace_id, role="viewer"):
         """Add user to specific workspace"""
         user_obj_id = ObjectId(user_id)
@@ -228,6 +639,8 @@ class PermissionService:
         
         return False, "User permissions document not found"
     
+    @_invalidates_permissions
+    @_mirrors_to_grants(PermissionGrants.mirror_workspace_removal)
     def remove_user_from_workspace(user_id, org_id, workspace_id):
         """Remove user from specific workspace"""
         result = db.user_permissions.update_one(
@@ -254,22 +667,21 @@ class PermissionService:
         - org-only (by ID or slug)
         - workspace-only (by ID or slug)
         - org + workspace (by IDs or slugs)
+        Served from the Redis PermissionCache; misses are answered from the
+        request-scoped user_permissions document, so stacked checks within one
+        request cost at most a single read.
         """
         
         # Resolve slugs to IDs
         try:
             if organisation_slug and not organisation_id:
-                org_doc = db.organisation.find_one({"slug": organisation_slug}, {"_id": 1})
-                if org_doc:
-                    organisation_id = org_doc["_id"]
-                else:
+                organisation_id = _resolve_slug(db.organisation, organisation_slug)
+                if not organisation_id:
                     return None
             
             if workspace_slug and not workspace_id:
-                ws_doc = db.Workspace.find_one({"slug": workspace_slug}, {"_id": 1})
-                if ws_doc:
-                    workspace_id = ws_doc["_id"]
-                else:
+                workspace_id = _resolve_slug(db.Workspace, workspace_slug)
+                if not workspace_id:
                     return None
         except Exception:
             return None
@@ -284,63 +696,104 @@ class PermissionService:
         except Exception:
             return None
 
-        query = {"userId": user_id}
-
-        if organisation_id and workspace_id:
-            # Explicit org + workspace
-            query["organizations"] = {
-                "$elemMatch": {
-                    "organizationId": organisation_id,
-                    "workspaces.workspaceId": workspace_id
-                }
-            }
-
-        elif organisation_id:
-            query["organizations.organizationId"] = organisation_id
+        if not organisation_id and not workspace_id:
+            return None
 
-        elif workspace_id:
-            # Workspace-only search across orgs
-            query["organizations.workspaces.workspaceId"] = workspace_id
+        scope = ':'.join(f"{kind}:{value}" for kind, value in (('org', organisation_id), ('ws', workspace_id)) if value)
+        hit, cached = PermissionCache.get(str(user_id), scope)
+        if hit:
+            return cached
 
+        if PermissionGrants.READ_ENABLED:
+            role = PermissionGrants.lookup(user_id, organisation_id, workspace_id)
         else:
+            role = PermissionService._resolve_role(user_id, organisation_id, workspace_id)
+        PermissionCache.set(str(user_id), scope, role)
+        return role
+
+    def _resolve_slug_safely(collection, slug):
+        """Slug -> _id for claim lookups; only resolved when claims are in use."""
+        if not PermissionClaims.ENABLED:
+            return None
+        try:
+            return _resolve_slug(collection, slug)
+        except Exception:
             return None
 
-        # Query user
-        user_perms = db.user_permissions.find_one(query, {"organizations": 1})
+    def _resolve_role(user_id, organisation_id=None, workspace_id=None):
+        """Resolve a role from the user's user_permissions document."""
+        user_perms = _load_user_permissions(user_id)
         if not user_perms or "organizations" not in user_perms:
             return None
 
-        # Look at all orgs in case multiple matched
         for org in user_perms.get("organizations", []):
-            # Match org first
-            if organisation_id and org["organizationId"] == ObjectId(organisation_id):
+            workspaces = org.get("workspaces", [])
+
+            # Match org first (and the workspace inside it, when both are given)
+            if organisation_id:
+                if org["organizationId"] != organisation_id:
+                    continue
+                if workspace_id and not any(ws["workspaceId"] == workspace_id for ws in workspaces):
+                    return None
                 return org.get("role")
 
             # Match by workspace only
-            if workspace_id:
-                for ws in org.get("workspaces", []):
-                    if ws["workspaceId"] == ObjectId(workspace_id):
-                        return {
-                            "status": "workspace_role",
-                            "role": ws.get("role"),
-                            "organizationId": org["organizationId"],
-                        }
+            for ws in workspaces:
+                if ws["workspaceId"] == workspace_id:
+                    return {
+                        "status": "workspace_role",
+                        "role": ws.get("role"),
+                        "organizationId": org["organizationId"],
+                    }
 
     
+    def effective_permissions(user_id):
+        """
+        The caller's whole effective permission matrix from a single read:
+        every organisation and workspace they belong to, with role and compiled mask.
+        """
+        user_id = ObjectId(user_id)
+        organisations, workspaces = {}, {}
+
+        if PermissionGrants.READ_ENABLED:
+            grants = db.permission_grants.find({"userId": user_id}, {"scope_type": 1, "scope_id": 1, "role": 1, "organizationId": 1})
+            for grant in grants:
+                if grant["scope_type"] == PermissionGrants.ORGANIZATION:
+                    organisations[str(grant["scope_id"])] = {"role": grant.get("role")}
+                else:
+                    workspaces[str(grant["scope_id"])] = {"role": grant.get("role"), "organisation_id": str(grant["organizationId"])}
+        else:
+            user_perms = _load_user_permissions(user_id) or {}
+            for org in user_perms.get("organizations", []):
+                organisations[str(org["organizationId"])] = {"role": org.get("role")}
+                for ws in org.get("workspaces", []):
+                    workspaces[str(ws["workspaceId"])] = {"role": ws.get("role"), "organisation_id": str(org["organizationId"])}
+
+        for entry in organisations.values():
+            entry["mask"] = ORGANIZATION_ROLE_MASKS.get(entry["role"], 0)
+        for entry in workspaces.values():
+            entry["mask"] = WORKSPACE_ROLE_MASKS.get(entry["role"], 0)
+        return {"organizations": organisations, "workspaces": workspaces}
+
     def has_organization_permission(user_id, org_id=None, permission=None, org_slug=None):
-        """Check if user has permission in organization"""
-        # print('Checking org permission for user_id:', user_id, 'org_id:', org_id, 'org_slug:', org_slug, 'permission:', permission)
-        user_role = PermissionService.get_user_permissions(user_id, organisation_id=org_id, organisation_slug=org_slug)
+        """Check if user has permission (or every permission in a list) in organization"""
+        scope_id = org_id or (org_slug and PermissionService._resolve_slug_safely(db.organisation, org_slug))
+        trusted, user_role = PermissionClaims.role(user_id, 'o', scope_id, permission)
+        if not trusted:
+            user_role = PermissionService.get_user_permissions(user_id, organisation_id=org_id, organisation_slug=org_slug)
         
         if not user_role:
             return False
         
-        org_permissions = ORGANIZATION_PERMISSIONS.get(user_role, [])
-        return permission in org_permissions
+        required = permission_mask(permission)
+        return ORGANIZATION_ROLE_MASKS.get(user_role, 0) & required == required
     
     def has_workspace_permission(user_id, workspace_id=None, permission=None, workspace_slug=None):
-        """Check if user has permission in workspace"""
-        user_perms = PermissionService.get_user_permissions(user_id, workspace_id=workspace_id, workspace_slug=workspace_slug)
+        """Check if user has permission (or every permission in a list) in workspace"""
+        scope_id = workspace_id or (workspace_slug and PermissionService._resolve_slug_safely(db.Workspace, workspace_slug))
+        trusted, user_perms = PermissionClaims.role(user_id, 'w', scope_id, permission)
+        if not trusted:
+            user_perms = PermissionService.get_user_permissions(user_id, workspace_id=workspace_id, workspace_slug=workspace_slug)
         if not user_perms:
             return False
         
@@ -350,9 +803,11 @@ class PermissionService:
         else:
             user_role = user_perms
         
-        workspace_permissions = WORKSPACE_PERMISSIONS.get(user_role, [])
-        return permission in workspace_permissions
+        required = permission_mask(permission)
+        return WORKSPACE_ROLE_MASKS.get(user_role, 0) & required == required
     
+    @_invalidates_permissions
+    @_mirrors_to_grants(PermissionGrants.mirror_role_update)
     def update_user_role( user_id, org_id=None, workspace_id=None, new_role=None):
         """Update user's role in organization or workspace"""
         if workspace_id:
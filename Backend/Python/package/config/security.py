@@ -17,6 +17,9 @@ class SecurityConfig:
     # Token configuration
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=30)  # Shorter lifetime for access tokens
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=7)     # Reduced from 30 days
+
+    # Operators: comma-separated user ids allowed to read /metrics and run maintenance jobs
+    OPERATOR_USER_IDS = frozenset(user_id.strip() for user_id in os.getenv('OPERATOR_USER_IDS', '').split(',') if user_id.strip())
     
     # Cookie security
     SESSION_COOKIE_SECURE = True
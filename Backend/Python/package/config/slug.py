@@ -1,4 +1,10 @@
 import re
+import time
+import threading
+from collections import OrderedDict
+from bson import ObjectId
+from package import db
+from package.config.redis import redis_client
 
 COMMON_ABBREVIATIONS = {
     'corporation': 'corp',
@@ -30,3 +36,90 @@ def slugify(text: str) -> str:
     text = re.sub(r'[^a-z0-9\s-]', '', text)
     text = re.sub(r'[\s-]+', '-', text)
     return text.strip('-')
+
+
+class SlugResolver:
+    """
+    Resolves organisation/workspace slugs to ObjectIds.
+
+    A bounded per-process LRU sits in front of Redis, which sits in front of
+    Mongo. Unknown slugs are cached too, for a shorter time, so bad links do not
+    reach the database. Entries are dropped on slug changes, creates and deletes;
+    other workers' local entries expire after LOCAL_TTL_SECONDS.
+    """
+
+    LOCAL_SIZE = 2048
+    LOCAL_TTL_SECONDS = 30
+    REDIS_TTL_SECONDS = 3600
+    NEGATIVE_TTL_SECONDS = 30
+    KEY_PREFIX = 'slug'
+
+    _local = OrderedDict()
+    _lock = threading.Lock()
+    _stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'errors': 0}
+
+    @classmethod
+    def _key(cls, collection, slug):
+        return f"{cls.KEY_PREFIX}:{collection}:{slug}"
+
+    @classmethod
+    def _remember(cls, key, value):
+        with cls._lock:
+            cls._local[key] = (value, time.monotonic() + cls.LOCAL_TTL_SECONDS)
+            cls._local.move_to_end(key)
+            while len(cls._local) > cls.LOCAL_SIZE:
+                cls._local.popitem(last=False)
+
+    @classmethod
+    def resolve(cls, collection, slug):
+        """Return the _id for `slug` in `collection`, or None if no document has it."""
+        if not slug:
+            # {'slug': None} would match any document without a slug
+            return None
+        key = cls._key(collection, slug)
+        with cls._lock:
+            entry = cls._local.get(key)
+            if entry and entry[1] > time.monotonic():
+                cls._local.move_to_end(key)
+                cls._stats['local_hits'] += 1
+                return entry[0]
+
+        try:
+            raw = redis_client.get(key)
+            if raw is not None:
+                value = ObjectId(raw) if raw else None
+                cls._stats['redis_hits'] += 1
+                cls._remember(key, value)
+                return value
+        except Exception:
+            cls._stats['errors'] += 1
+
+        cls._stats['misses'] += 1
+        doc = db[collection].find_one({'slug': slug}, {'_id': 1})
+        value = doc['_id'] if doc else None
+        cls._remember(key, value)
+        try:
+            ttl = cls.REDIS_TTL_SECONDS if value else cls.NEGATIVE_TTL_SECONDS
+            redis_client.set(key, str(value) if value else '', ex=ttl)
+        except Exception:
+            cls._stats['errors'] += 1
+        return value
+
+    @classmethod
+    def invalidate(cls, collection, *slugs):
+        """Forget cached resolutions (positive or negative) for the given slugs."""
+        keys = [cls._key(collection, slug) for slug in slugs if slug]
+        if not keys:
+            return
+        with cls._lock:
+            for key in keys:
+                cls._local.pop(key, None)
+        try:
+            redis_client.delete(*keys)
+        except Exception:
+            cls._stats['errors'] += 1
+
+    @classmethod
+    def stats(cls):
+        """Hit/miss counters for this worker process."""
+        return {**cls._stats, 'local_size': len(cls._local)}
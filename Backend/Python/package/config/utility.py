@@ -2,10 +2,15 @@
 from flask import request, jsonify, g
 from bson import ObjectId
 from datetime import datetime
+from collections import OrderedDict
 import jwt
+import hashlib
+import threading
+import time
 from functools import wraps
+from pymongo import UpdateOne
 from package.config.security import SecurityConfig
-from package.config.permission import PermissionService
+from package.config.permission import PermissionService, PermissionClaims
 
 
 def get_ip_address():
@@ -16,6 +21,40 @@ def get_ip_address():
         ip = request.remote_addr
         return ip
     
+class RequestCapture:
+    """
+    Read-only view of the current request for the activity logger, with the same
+    keys as the dict it replaces ('method', 'path', 'args', 'json', 'headers',
+    'remote_addr'). Nothing is copied or parsed until a key is read, and JSON
+    bodies larger than MAX_JSON_BYTES are never parsed for capture.
+    """
+
+    MAX_JSON_BYTES = 64 * 1024
+
+    _FIELDS = {
+        'method': lambda request: request.method,
+        'path': lambda request: request.path,
+        'args': lambda request: request.args.to_dict(),
+        'headers': lambda request: request.headers,
+        'remote_addr': lambda request: request.remote_addr,
+        'json': lambda request: (
+            request.get_json(silent=True) or {}
+            if (request.content_length or 0) <= RequestCapture.MAX_JSON_BYTES else {}
+        ),
+    }
+
+    def __init__(self, request):
+        self._request = request
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._FIELDS[key](self._request)
+        return self._values[key]
+
+    def get(self, key, default=None):
+        return self[key] if key in self._FIELDS else default
+
 def serialize_document(document):
     """
     Convert MongoDB documents with ObjectId fields into JSON-serializable dictionaries.
@@ -44,6 +83,85 @@ def serialize_document(document):
         return document.isoformat()
     return document
 
+def count_by(collection, field, ids=None):
+    """
+    Number of documents in `collection` per value of `field`, as a dict, optionally
+    only for the values in `ids`. Used to fill in and reconcile the stored counters
+    (e.g. an organisation's workspace_count) that are otherwise kept up to date by $inc.
+    """
+    pipeline = [{'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}]
+    if ids is not None:
+        pipeline.insert(0, {'$match': {field: {'$in': list(ids)}}})
+    return {group['_id']: group['count'] for group in collection.aggregate(pipeline)}
+
+def reconcile_counter(target, counter, source, field, batch_size=1000):
+    """
+    Correct `counter` on every document in `target` to the number of `source`
+    documents whose `field` references it, and return how many were corrected.
+    Each fix only applies if the counter still holds the value that was read, so
+    an $inc that lands meanwhile is never overwritten; the next run picks it up.
+    """
+    actual = count_by(source, field)
+    corrected, operations = 0, []
+    for document in target.find({}, {counter: 1}):
+        count = actual.get(document['_id'], 0)
+        if document.get(counter) != count:
+            operations.append(UpdateOne({'_id': document['_id'], counter: document.get(counter)}, {'$set': {counter: count}}))
+        if len(operations) >= batch_size:
+            corrected += target.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        corrected += target.bulk_write(operations, ordered=False).modified_count
+    return corrected
+
+class VerifiedTokenCache:
+    """
+    Per-process LRU of access-token claims that already passed signature verification,
+    keyed by a SHA-256 digest of the token. An entry is only served until the token's
+    own `exp`, so caching never extends a token's life; tokens without `exp` are not cached.
+    """
+
+    MAX_SIZE = 4096
+
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+    _stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    @classmethod
+    def decode(cls, token):
+        """Return the verified payload for `token`, raising like jwt.decode on bad tokens."""
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry:
+                if entry[1] > time.time():
+                    cls._entries.move_to_end(key)
+                    cls._stats['hits'] += 1
+                    return entry[0]
+                del cls._entries[key]
+                cls._stats['expired'] += 1
+            cls._stats['misses'] += 1
+
+        payload = jwt.decode(token, SecurityConfig.JWT_SECRET_KEY, SecurityConfig.JWT_ALGORITHM)
+        expires = payload.get('exp')
+        if isinstance(expires, (int, float)):
+            with cls._lock:
+                cls._entries[key] = (payload, expires)
+                cls._entries.move_to_end(key)
+                while len(cls._entries) > cls.MAX_SIZE:
+                    cls._entries.popitem(last=False)
+                    cls._stats['evictions'] += 1
+        return payload
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            stats = dict(cls._stats, size=len(cls._entries), max_size=cls.MAX_SIZE)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
 def auth_reqired(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -56,11 +174,13 @@ def auth_reqired(f):
             return jsonify({'error': 'Token is missing'}), 401
         
         try:
-            payload = jwt.decode(token, SecurityConfig.JWT_SECRET_KEY, SecurityConfig.JWT_ALGORITHM)
+            payload = VerifiedTokenCache.decode(token)
             g.user_id = payload.get('user_id')
             g.role = payload.get('role')
             g.name = payload.get('username')
             g.avatar = payload.get('image')
+            if PermissionClaims.ENABLED:
+                g.permission_claims = payload.get('perms')
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
@@ -137,24 +257,28 @@ def require_workspace_permission(permission):
     return decorator
 
 def require_either_permission(org_perm: str, ws_perm: str):
+    """
+    Decorator to require either an organization-level or a workspace-level permission.
+    Both checks are answered from the same request-scoped permissions snapshot,
+    and the wrapped view runs exactly once.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            errors = []
-            
+            current_user_id = g.user_id
+            data = request.get_json(silent=True) or {}
+            org_id = kwargs.get('org_id') or data.get('org_id') or data.get('organisation_id')
+            workspace_id = kwargs.get('workspace_id') or data.get('workspace_id')
+            slug = kwargs.get('slug') or data.get('slug')
+
             # Try Org Permission
-            try:
-                require_organization_permission(org_perm)(func)(*args, **kwargs)
+            if (org_id or slug) and PermissionService.has_organization_permission(current_user_id, org_id, org_perm, slug):
                 return func(*args, **kwargs)
-            except Exception as e:
-                errors.append(e)
 
-            # Try Workspace Permission
-            try:
-                require_workspace_permission(ws_perm)(func)(*args, **kwargs)
+            # Try Workspace Permission. Slugs are only unique per collection, so a slug
+            # is retried as a workspace slug even when an organisation shares it
+            if (workspace_id or slug) and PermissionService.has_workspace_permission(current_user_id, workspace_id, ws_perm, slug):
                 return func(*args, **kwargs)
-            except Exception as e:
-                errors.append(e)
 
             # If we reached here, both failed
             return jsonify({
@@ -184,4 +308,18 @@ def admin_only():
                 
             return f(*args, **kwargs)
         return decorated_function
-    return decorator
\ No newline at end of file
+    return decorator
+
+def operator_only():
+    """
+    Decorator to restrict a route to operators (SecurityConfig.OPERATOR_USER_IDS),
+    for internal counters and maintenance jobs. Use after auth_reqired.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if str(g.user_id) not in SecurityConfig.OPERATOR_USER_IDS:
+                return jsonify({'error': 'Operator access required'}), 403
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
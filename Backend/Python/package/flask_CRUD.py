@@ -12,15 +12,16 @@ from package.models.board import Board
 from package.models.organisation import Organisation
 from package.models.workspace import Workspace
 from package.models.notification import invite_notification, role_update_notification, remove_user_notification, delete_organisation_notification, update_organisation_notification
-from package.models.user_relationships import User_Workspace, User_Activity, User_Organisation
+from package.models.user_relationships import User_Workspace, User_Activity, User_Organisation, ActivityLogWriter, ViewCounters
 from package.config.security import SecurityConfig
-from package.config.utility import get_ip_address, auth_reqired, require_organization_permission, require_workspace_permission, admin_only, require_either_permission
-from package.config.permission import PermissionService
+from package.config.utility import get_ip_address, auth_reqired, require_organization_permission, require_workspace_permission, admin_only, require_either_permission, operator_only, VerifiedTokenCache, RequestCapture
+from package.config.permission import PermissionService, PermissionCache, PermissionGrants, PERMISSION_BITS, ORGANIZATION_ROLE_MASKS, WORKSPACE_ROLE_MASKS, permission_mask
 from package.config.import_issue import import_issue
-from package.middleware import check_list
+from package.middleware import check_list, PasswordHasher
 from package.config.redis import publish_event
 from pymongo.errors import PyMongoError
 from package.config.redis import redis_client
+from package.config.slug import SlugResolver
 import time
 import re
 from datetime import datetime, timezone
@@ -31,156 +32,93 @@ from datetime import datetime, timezone
 def before_request():
     """Runs before every request to log user activity."""
     g.start_time = time.time()
-    g.request_data = {
-        'method': request.method,
-        'path': request.path,
-        'args': dict(request.args),
-        'json': request.get_json(silent=True) or {},
-        'headers': dict(request.headers),
-        'remote_addr': request.remote_addr
-    }
+    g.request_data = RequestCapture(request)
     
 
+# Activity logged per endpoint (request.url_rule.endpoint). Endpoints not listed
+# here are never logged. For each rule:
+#   entity_id      - request JSON fields holding the entity, first one present wins
+#   response_key   - take the entity _id from this key of the response body instead
+#   workspace_id / organisation_id - request JSON field holding the scope
+#   update_fields  - record the request JSON, minus these fields, as metadata
+ACTIVITY_LOG_RULES = {
+    # ----------------- Board ----------------- #
+    'create_board': {'action': "Create Board", 'entity_type': "Board", 'response_key': 'board', 'workspace_id': ('workspace_id',)},
+    'update_board': {'action': "Update Board", 'entity_type': "Board", 'entity_id': ('board_id',),
+                     'update_fields': ('user_id', 'board_id', 'workspace_id'), 'workspace_id': ('workspace_id',)},
+    # Clients send the board document, which names its workspace in `workspace`
+    'delete_board': {'action': "Delete Board", 'entity_type': "Board", 'entity_id': ('board_id',),
+                     'workspace_id': ('workspace_id', 'workspace')},
+
+    # ----------------- Workspace ----------------- #
+    'create_worskapce': {'action': "Create workspace", 'entity_type': "Workspace", 'response_key': 'Workspace',
+                         'organisation_id': ('organisation_id',)},
+    'search_workspace': {'action': "View Workspace", 'entity_type': "Workspace", 'entity_id': ('workspace_id', 'slug')},
+    'update_workspace': {'action': "Update Workspace", 'entity_type': "Workspace", 'entity_id': ('workspace_id',),
+                         'update_fields': ('user_id', 'workspace_id'), 'workspace_id': ('workspace_id',)},
+    'delete_workspace': {'action': "Delete Workspace", 'entity_type': "Workspace", 'entity_id': ('workspace_id',),
+                         'workspace_id': ('workspace_id',)},
+
+    # ----------------- Organisation ----------------- #
+    'create_organisation': {'action': "Create organisation", 'entity_type': 'organisation', 'response_key': 'organisation'},
+    'search_organisation': {'action': "View Organisation", 'entity_type': "organisation",
+                            'entity_id': ('organisation_id', 'slug')},
+    'update_organisation': {'action': "Update Organisation", 'entity_type': "organisation", 'entity_id': ('organisation_id', '_id'),
+                            'update_fields': ('user_id', 'organisation_id', '_id'), 'organisation_id': ('organisation_id', '_id')},
+    'delete_organisation': {'action': "Delete Organisation", 'entity_type': "organisation", 'entity_id': ('organisation_id',),
+                            'organisation_id': ('organisation_id',)},
+}
+
 @app.after_request
 def after_request_logging(response):
     """Runs after every request to log user activity."""
-    duration = None
-    if hasattr(g, "start_time"):
-        duration = time.time() - g.start_time
-    else:
-        duration = 0
-    if 200 <= response.status_code < 300:
-        request_data = g.request_data
-        data = request_data.get('json') if request_data.get('json') else {}
-        response_data = response.get_json() if response.is_json else {}
-        
-        # ------- Initializing the data ------- #
-        user_id = getattr(g, 'user_id', None)
-        organisation_id = None
-        workspace_id = None
-        action = None
-        entity_type = None
-        entity_id = None
-        metadata = {
-            "method": request_data['method'],
-            "ip_address": request_data['remote_addr'],
-            "device_info": request_data['headers'].get('User-Agent', 'Unknown'),
-            "response_status": response.status_code,
-            "user_agent": request_data['headers'].get('User-Agent'),
-            "referrer": request_data['headers'].get('Referer'),
-            "query_params": request_data['args'],
-            "endpoint": request_data['path']
-        }
+    rule = ACTIVITY_LOG_RULES.get(request.url_rule.endpoint) if request.url_rule else None
+    if rule is None or not 200 <= response.status_code < 300:
+        return response
+    user_id = getattr(g, 'user_id', None)
+    if not user_id:
+        return response
 
+    request_data = g.request_data
+    data = request_data.get('json') if isinstance(request_data.get('json'), dict) else {}
 
-        skip_paths = ['/add/user', '/login', '/logout', 'auth/refresh', '/all', '/recent', '/boards', '/users']
-        for path in skip_paths:
-            if path in request_data['path']:  
-                return response
-            
-            
-        # ----------------- Board ----------------- #
-        if '/board' in request_data['path']:
-            if(isinstance(response_data, list)):
-                return response
-            board_data = response_data.get('board', {}) 
-            if '/add/board' in request_data['path']:
-                action = "Create Board"
-                entity_type = "Board"
-                entity_id = board_data.get('_id')
-                workspace_id = data.get('workspace_id')                
-            
-            elif '/update' in request_data['path']:
-                action = "Update Board"
-                entity_type = "Board"
-                entity_id = data.get('board_id')
-                update_fields = { key : value for key, value in data.items() if key not in ['user_id', 'board_id', 'workspace_id']}
-                metadata['update_fields'] = update_fields
-                
-            elif '/ID' in request_data['path']:
-                action = "View Boardd"
-                entity_type = "Board"
-                entity_id = data.get('board_id')
-
-            elif '/delete' in request_data['path']:
-                action = "Delete Board"
-                entity_type = "Board"
-                entity_id = data.get('board_id')
-                
-        
-        # ----------------- Workspace ----------------- #
-        elif '/workspace' in request_data['path']:
-            if (isinstance(response_data, list)):
-                return response  
-            workspace_data = response_data.get('Workspace', {}) 
-            if '/add/workspace' in request_data['path']:
-                action = "Create workspace"
-                entity_type = "Workspace"
-                entity_id = workspace_data.get('_id')
-                organisation_id = data.get('organisation_id')
-                
-            elif '/search' in request_data['path'] and data.get('workspace_id') or data.get('slug'):
-                action = "View Workspace"
-                entity_type = "Workspace"
-                entity_id = data.get('workspace_id') or data.get('slug')
-
-            elif '/update' in request_data['path']:
-                action = "Update Workspace"
-                entity_type = "Workspace"
-                entity_id = data.get('workspace_id')
-                update_fields = { key : value for key, value in data.items() if key not in ['user_id', 'workspace_id']}
-                metadata['update_fields'] = update_fields
-
-            elif '/delete' in request_data['path']:
-                action = "Delete Workspace"
-                entity_type = "Workspace"
-                entity_id = data.get('workspace_id')
-                
-                
-        # ----------------- Organisation ----------------- #
-        elif '/organisation' in request_data['path']:
-            organisation_data = response_data.get('organisation', {}) 
-            if '/add/organisation' in request_data['path']:
-                action = "Create organisation"
-                entity_type = 'organisation'
-                entity_id = organisation_data.get('_id')
-               
-            elif '/search' in request_data['path'] and data.get('organisation_id') or data.get('slug'):
-                action = "View Organisation"
-                entity_type = "organisation"
-                entity_id = data.get('organisation_id') or data.get('slug') 
-
-            elif '/update' in request_data['path']:
-                action = "Update Organisation"
-                entity_type = "organisation"
-                entity_id = data.get('organisation_id')
-                update_fields = { key : value for key, value in data.items() if key not in ['user_id', 'organisation_id']}
-                metadata['update_fields'] = update_fields
-
-            elif '/delete' in request_data['path']:
-                action = "Delete Organisation"
-                entity_type = "organisation"
-                entity_id = data.get('organisation_id')
-                
-            if not entity_id or not action:
-                app.logger.warning(f"Untracked action or missing entity: {request_data['path']}")
+    if 'response_key' in rule:
+        response_data = response.get_json(silent=True) if response.is_json else None
+        entity = response_data.get(rule['response_key']) if isinstance(response_data, dict) else None
+        entity_id = entity.get('_id') if isinstance(entity, dict) else None
+    else:
+        entity_id = next((data.get(field) for field in rule['entity_id'] if data.get(field)), None)
+    if not entity_id:
+        # Views without an id or slug are listings, not views of one entity
+        if not rule['action'].startswith('View'):
+            app.logger.warning(f"Untracked action or missing entity: {request_data['path']}")
+        return response
 
-                
-                
-        
-        # ----------------- Log User Action ----------------- #
-        if user_id and action:
-            activity = User_Activity(
-                user_id=user_id,
-                action=action,
-                entity_type= entity_type,
-                entity_id= entity_id,
-                metadata=metadata,
-                timestamp = datetime.now(timezone.utc),
-                workspace_id = workspace_id,
-                organisation_id = organisation_id
-            )
-            activity.Create_User_Activity_Log()
+    metadata = {
+        "method": request_data['method'],
+        "ip_address": request_data['remote_addr'],
+        "device_info": request_data['headers'].get('User-Agent', 'Unknown'),
+        "response_status": response.status_code,
+        "user_agent": request_data['headers'].get('User-Agent'),
+        "referrer": request_data['headers'].get('Referer'),
+        "query_params": request_data['args'],
+        "endpoint": request_data['path']
+    }
+    if 'update_fields' in rule:
+        metadata['update_fields'] = {key: value for key, value in data.items() if key not in rule['update_fields']}
+
+    # ----------------- Log User Action ----------------- #
+    activity = User_Activity(
+        user_id=user_id,
+        action=rule['action'],
+        entity_type=rule['entity_type'],
+        entity_id=entity_id,
+        metadata=metadata,
+        timestamp=datetime.now(timezone.utc),
+        workspace_id=next((data.get(field) for field in rule.get('workspace_id', ()) if data.get(field)), None),
+        organisation_id=next((data.get(field) for field in rule.get('organisation_id', ()) if data.get(field)), None)
+    )
+    activity.Create_User_Activity_Log()
     return response
 
 
@@ -214,6 +152,20 @@ def health_check():
 
     return jsonify(health_status), status_code
 
+@app.route("/metrics")
+@auth_reqired
+@operator_only()
+def metrics():
+    """Per-worker cache and queue counters."""
+    return jsonify({
+        "permission_cache": PermissionCache.stats(),
+        "slug_resolver": SlugResolver.stats(),
+        "password_hasher": PasswordHasher.stats(),
+        "verified_tokens": VerifiedTokenCache.stats(),
+        "activity_log": ActivityLogWriter.stats(),
+        "view_counters": ViewCounters.stats()
+    }), 200
+
 # ------------------- USER ------------------------------- #
 @app.route('/add/user', methods=['POST'])
 @limiter.limit("100 per second")
@@ -273,7 +225,7 @@ def create():
 @app.route('/user', methods=['GET'])
 @limiter.limit("100 per second")
 @auth_reqired
-@require_either_permission('view_user', 'view_organization')
+@require_either_permission('view_organization', 'view_workspace')
 def user():
     user = User
     users = user.user()
@@ -464,7 +416,7 @@ def search_title():
         if board_id:
             result = Board.board_ID(ID=board_id)
         elif workspace_id:
-            result = Board.board_in_workspace(workspace_identifier=workspace_id, user_id=g.user_id)
+            result = Board.board_in_workspace(workspace_identifier=workspace_id, user_id=g.user_id, counts_only=bool(data.get('counts_only')))
         elif not workspace_id and not board_id:
             return jsonify({"Error" : "Enter a Parameter to search"}), 400
         if result is not None:
@@ -657,7 +609,7 @@ def update_user_role_in_organization():
     new_role = data.get('role')
     
     try:
-        success = PermissionService.update_user_role(user_id, org_id, new_role)
+        success = PermissionService.update_user_role(user_id, org_id, new_role=new_role)
         
         if success:
             organisation_name = Organisation.search(organisation_id=org_id).get('data', {}).get('title', '')
@@ -746,6 +698,22 @@ def user_in_organisation():
     resp = User_Organisation.Users_in_Organisation(organisation_id, user_id=g.user_id)
     return jsonify(resp), 200
 
+# Activity feed of an organisation, newest first
+@app.route('/organisation/activity', methods=['POST'])
+@auth_reqired
+@require_organization_permission('view_organization')
+def organisation_activity():
+    data = request.json
+    # Same precedence as require_organization_permission, so the feed read is the one it checked
+    organisation_id = data.get('org_id') or data.get('organisation_id') or SlugResolver.resolve('organisation', data.get('slug'))
+    if not organisation_id:
+        return jsonify({'message': 'Organisation not found'}), 404
+    try:
+        feed = User_Activity.get_logs_by_organisation(organisation_id, limit=data.get('limit'), cursor=data.get('cursor'), include_metadata=bool(data.get('include_metadata')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(feed), 200
+
 
 # Update Organisation
 @app.route('/organisation/update', methods=['PATCH'])
@@ -1065,13 +1033,28 @@ def workspace_board():
         return jsonify({'error': 'Invalid or Missing JSON in request'}), 404
     workspace_id = data.get('workspace_id')
     if check_list([workspace_id]):
-        boards = Board.board_in_workspace(workspace_id, user_id=g.user_id)
+        boards = Board.board_in_workspace(workspace_id, user_id=g.user_id, counts_only=bool(data.get('counts_only')))
         if boards is not None:
             return jsonify(boards), 200
         return jsonify({'message': 'No boards found in this workspace'}), 404
     else : 
         return jsonify({'error': 'No Workspace Selected'}), 400
 
+# Activity feed of a workspace, newest first
+@app.route('/workspace/activity', methods=['POST'])
+@auth_reqired
+@require_workspace_permission('view_workspace')
+def workspace_activity():
+    data = request.json
+    workspace_id = data.get('workspace_id') or SlugResolver.resolve('Workspace', data.get('slug'))
+    if not workspace_id:
+        return jsonify({'message': 'Workspace not found'}), 404
+    try:
+        feed = User_Activity.get_logs_by_workspace(workspace_id, limit=data.get('limit'), cursor=data.get('cursor'), include_metadata=bool(data.get('include_metadata')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(feed), 200
+
 # ------------------------------- IMPORT ----------------------------------#
 @app.route('/issue/import', methods=['POST'])
 @auth_reqired
@@ -1093,6 +1076,8 @@ def import_file_from_api():
         return jsonify({'error': 'An unexpected error occurred: ' + str(e)}), 500
 
 # ------------------------------- PERMISSION ----------------------------------#
+MAX_BATCH_PERMISSION_CHECKS = 200
+
 @app.route('/permissions/check', methods=['POST'])
 @auth_reqired
 def check_permission():
@@ -1123,7 +1108,6 @@ def check_permission():
         permission,
         workspace_slug
     )
-    print(f"User {current_user_id} permission check for workspace {workspace_id or workspace_slug} and permission {permission}: {has_perm}")  
     
     if not has_perm:
         return jsonify({
@@ -1135,6 +1119,56 @@ def check_permission():
         'message': f"{permission} granted"
     }), 200
 
+@app.route('/permissions/batch', methods=['POST'])
+@auth_reqired
+def batch_permissions():
+    """
+    Answer many permission checks, or return the caller's effective matrix,
+    from a single permissions read.
+    Request body: {
+        "checks": [{"permission": "string", "workspace_id": "Id" | "slug": "slug of workspace"}]
+    }
+    Without "checks" the whole matrix is returned.
+    """
+    data = request.get_json(silent=True) or {}
+    checks = data.get('checks')
+    matrix = PermissionService.effective_permissions(g.user_id)
+
+    if not checks:
+        return jsonify(matrix), 200
+    if not isinstance(checks, list) or len(checks) > MAX_BATCH_PERMISSION_CHECKS or not all(isinstance(check, dict) for check in checks):
+        return jsonify({'error': f'checks must be a list of at most {MAX_BATCH_PERMISSION_CHECKS} items'}), 400
+
+    results = []
+    for check in checks:
+        permission = check.get('permission')
+        workspace = check.get('workspace_id') or check.get('slug')
+        workspace_id = check.get('workspace_id')
+        if not workspace_id and check.get('slug'):
+            resolved = SlugResolver.resolve('Workspace', check['slug'])
+            workspace_id = str(resolved) if resolved else None
+        mask = matrix['workspaces'].get(workspace_id, {}).get('mask', 0)
+        required = permission_mask(permission)
+        results.append({
+            'permission': permission,
+            'workspace': workspace,
+            'granted': mask & required == required
+        })
+    return jsonify({'results': results}), 200
+
+@app.route('/permissions/schema', methods=['GET'])
+@auth_reqired
+def permission_schema():
+    """
+    Compiled permission bits and role masks, so clients can decode permission
+    masks with a single AND instead of comparing name lists.
+    """
+    return jsonify({
+        'bits': PERMISSION_BITS,
+        'organization_roles': ORGANIZATION_ROLE_MASKS,
+        'workspace_roles': WORKSPACE_ROLE_MASKS
+    }), 200
+
 # ------------------------------- SCRIPTS ----------------------------------#
 @app.route('/backfill_organisation_admin', methods=['POST'])
 @auth_reqired
@@ -1155,6 +1189,36 @@ def backfill_ID():
     except Exception as e:
         return {'Error': str(e)},500
 
+@app.route('/backfill_permission_grants', methods=['POST'])
+@auth_reqired
+@operator_only()
+def backfill_permission_grants():
+    try:
+        migrated = PermissionGrants.migrate()
+        return {'message': f'{migrated} permission grants have been migrated succesfully'}, 200
+    except Exception as e:
+        return {'Error': str(e)}, 500
+
+@app.route('/backfill_activity_history', methods=['POST'])
+@auth_reqired
+@operator_only()
+def backfill_activity_history():
+    try:
+        moved = User_Activity.migrate_to_buckets()
+        return {'message': f'{moved} activity logs have been moved into day buckets succesfully'}, 200
+    except Exception as e:
+        return {'Error': str(e)}, 500
+
+@app.route('/reconcile_counters', methods=['POST'])
+@auth_reqired
+@operator_only()
+def reconcile_counters():
+    try:
+        corrected = Organisation.reconcile_counters() + Workspace.reconcile_counters()
+        return {'message': f'{corrected} stored counters have been corrected succesfully'}, 200
+    except Exception as e:
+        return {'Error': str(e)}, 500
+
 # -------------------------------------------------------------------------- #
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -1,16 +1,130 @@
 from flask_limiter.errors import RateLimitExceeded
 from flask import jsonify
+from concurrent.futures import ThreadPoolExecutor
 import bcrypt
 import traceback
 import logging
+import os
+import threading
+import time
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the password hashing pool is saturated and the caller should retry later."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a small per-worker thread pool. bcrypt releases the GIL, so hashing
+    happens in parallel up to WORKERS, and at most WORKERS + MAX_QUEUE jobs are admitted
+    at once; callers that can't get a slot within WAIT_SECONDS get PasswordHashingBusy
+    instead of piling up behind a CPU-bound queue.
+    """
+    ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+    MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 32))
+    WAIT_SECONDS = float(os.getenv('PASSWORD_HASH_WAIT_SECONDS', 0.5))
+
+    _executor = None
+    _executor_pid = None
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(WORKERS + MAX_QUEUE)
+    _stats = {"submitted": 0, "started": 0, "completed": 0, "rejected": 0, "rehashed": 0, "busy_seconds": 0.0}
+
+    @classmethod
+    def _pool(cls) -> ThreadPoolExecutor:
+        # Created lazily and per process: threads don't survive gunicorn's fork
+        if cls._executor is None or cls._executor_pid != os.getpid():
+            with cls._lock:
+                if cls._executor is None or cls._executor_pid != os.getpid():
+                    cls._executor = ThreadPoolExecutor(max_workers=cls.WORKERS, thread_name_prefix='bcrypt')
+                    cls._executor_pid = os.getpid()
+        return cls._executor
+
+    @classmethod
+    def _count(cls, name, amount=1):
+        with cls._lock:
+            cls._stats[name] += amount
+
+    @classmethod
+    def submit(cls, func, *args, wait=True):
+        """Run func on the pool. Blocks for the result unless wait is False (then returns the future)."""
+        if not cls._slots.acquire(timeout=cls.WAIT_SECONDS if wait else 0):
+            cls._count("rejected")
+            raise PasswordHashingBusy()
+
+        def run():
+            cls._count("started")
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                cls._count("busy_seconds", time.perf_counter() - started)
+                cls._count("completed")
+                cls._slots.release()
+
+        cls._count("submitted")
+        try:
+            future = cls._pool().submit(run)
+        except Exception:
+            cls._count("submitted", -1)
+            cls._slots.release()
+            raise
+        return future.result() if wait else future
+
+    @classmethod
+    def needs_rehash(cls, hashed) -> bool:
+        """True if the hash was made with a different work factor than ROUNDS."""
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        try:
+            return int(hashed.split(b'$')[2]) != cls.ROUNDS
+        except (IndexError, ValueError):
+            return False
+
+    @classmethod
+    def rehash_later(cls, password, on_hashed):
+        """
+        Re-hash at the current work factor in the background and hand the new hash to
+        on_hashed. Skipped when the pool is busy; the next login will try again.
+        """
+        def rehash():
+            on_hashed(bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(cls.ROUNDS)))
+            cls._count("rehashed")
+
+        def log_failure(future):
+            if future.exception():
+                logging.error(f"Password rehash failed: {future.exception()}")
+
+        try:
+            future = cls.submit(rehash, wait=False)
+        except PasswordHashingBusy:
+            return None
+        future.add_done_callback(log_failure)
+        return future
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls._lock:
+            stats = dict(cls._stats)
+        stats["queue_depth"] = stats["submitted"] - stats["started"]
+        stats["in_flight"] = stats["started"] - stats["completed"]
+        stats["workers"] = cls.WORKERS
+        stats["max_queue"] = cls.MAX_QUEUE
+        stats["rounds"] = cls.ROUNDS
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        return stats
+
 
 def hash_password(password):
     encoded_password = password.encode('utf-8')
-    hash_password = bcrypt.hashpw(encoded_password, bcrypt.gensalt())
+    hash_password = PasswordHasher.submit(
+        lambda: bcrypt.hashpw(encoded_password, bcrypt.gensalt(PasswordHasher.ROUNDS))
+    )
     return hash_password
 
 def check_password(password, hash_password):
-    if bcrypt.checkpw(password.encode('utf-8'), hash_password):
+    if PasswordHasher.submit(bcrypt.checkpw, password.encode('utf-8'), hash_password):
         return True
     else:
         return False
@@ -31,6 +145,15 @@ def register_error_handlers(app):
             "message": "Too many requests. Please try again later."
         }), 429
     
+    @app.errorhandler(PasswordHashingBusy)
+    def handle_password_hashing_busy(e):
+        return jsonify({
+            "success": False,
+            "error": "Service Busy",
+            "message": "Too many sign-ins in progress. Please try again shortly.",
+            "status": 503
+        }), 503, {"Retry-After": "1"}
+
     @app.errorhandler(Exception)
     def handle_exception(e):
         logging.error(traceback.format_exc())
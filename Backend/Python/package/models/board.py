@@ -3,6 +3,7 @@ import json
 from datetime import datetime , timezone
 from bson import json_util, ObjectId
 from package.config.utility import serialize_document
+from package.config.slug import SlugResolver
 from package import db
 from dotenv import load_dotenv
 import os
@@ -42,6 +43,7 @@ class Board:
             'workspace': self.workspace_id,
             'history': []
         })
+        db.Workspace.update_one({'_id': self.workspace_id}, {'$inc': {'board_count': 1}})
 
         new_board = db.Board.find_one({'_id' : result.inserted_id})
         if new_board:
@@ -100,34 +102,60 @@ class Board:
         return serialize_document(list(boards))
     
     @staticmethod
-    def board_in_workspace(workspace_identifier, user_id=None):
+    def issues_by_board(board_ids, counts_only=False):
+        """
+        Fetch the issues of several boards in a single round trip.
+
+        Args:
+            board_ids (list): Board ObjectIds to load issues for.
+            counts_only (bool): Return per-board issue counts instead of the issues.
+
+        Returns:
+            dict: Board ObjectId -> list of issue documents (or issue count).
+        """
+        if counts_only:
+            grouped = {board_id: 0 for board_id in board_ids}
+            pipeline = [
+                {'$match': {'board_id': {'$in': board_ids}}},
+                {'$group': {'_id': '$board_id', 'count': {'$sum': 1}}}
+            ]
+            for row in db.Issues.aggregate(pipeline):
+                grouped[row['_id']] = row['count']
+            return grouped
+
+        grouped = {board_id: [] for board_id in board_ids}
+        for issue in db.Issues.find({'board_id': {'$in': board_ids}}):
+            grouped.setdefault(issue['board_id'], []).append(issue)
+        return grouped
+
+    @staticmethod
+    def board_in_workspace(workspace_identifier, user_id=None, counts_only=False):
         # Accept either a workspace ObjectId string or a workspace slug
         try:
             if ObjectId.is_valid(workspace_identifier):
                 workspace_obj_id = ObjectId(workspace_identifier)
             else:
-                workspace = db.Workspace.find_one({'slug': workspace_identifier})
-                if not workspace:
+                workspace_obj_id = SlugResolver.resolve('Workspace', workspace_identifier)
+                if not workspace_obj_id:
                     return None
-                workspace_obj_id = workspace['_id']
 
             if user_id:
-                is_member = db.User_Workspace.find_one({'user_id': ObjectId(user_id), 'workspace_id': workspace_obj_id})
+                is_member = db.User_Workspace.find_one({'user_id': ObjectId(user_id), 'workspace_id': workspace_obj_id}, {'_id': 1})
                 if not is_member:
                     return None
 
-            boards = db.Board.find({'workspace': workspace_obj_id})
-            board_data = []
-            for board in boards:
-                board_json = serialize_document(board)
-                issues_cursor = db.Issues.find({'board_id': board['_id']})
-                issues = serialize_document(list(issues_cursor))
-                board_json['issues'] = issues
-                board_data.append(board_json)
-
-            if not board_data:
+            boards = list(db.Board.find({'workspace': workspace_obj_id}))
+            if not boards:
                 return []
-            return board_data
+
+            # One $in query for every board's issues, grouped in Python
+            issues = Board.issues_by_board([board['_id'] for board in boards], counts_only=counts_only)
+            for board in boards:
+                if counts_only:
+                    board['issue_count'] = issues.get(board['_id'], 0)
+                else:
+                    board['issues'] = issues.get(board['_id'], [])
+            return serialize_document(boards)
         except Exception as e:
             return None
     
@@ -245,8 +273,9 @@ class Board:
     @staticmethod
     def delete(board_id,user_id):
         print("this is board ID", board_id, "this is user_id", user_id)  
-        result = db.Board.delete_one({'_id': ObjectId(board_id), 'user_id' : ObjectId(user_id)})
-        if result.deleted_count == 1 :
+        deleted = db.Board.find_one_and_delete({'_id': ObjectId(board_id), 'user_id' : ObjectId(user_id)}, {'workspace': 1})
+        if deleted:
+            db.Workspace.update_one({'_id': deleted.get('workspace')}, {'$inc': {'board_count': -1}})
             taskcollection = db.get_collection('Issues')
             taskcollection.delete_many({'board_id': ObjectId(board_id)})
             return True
@@ -3,11 +3,11 @@ from typing import Optional, Dict
 from bson import ObjectId
 from package import db
 from dotenv import load_dotenv
-from package.config.slug import slugify
-from package.models.user_relationships import User_Activity
+from package.config.slug import slugify, SlugResolver
+from package.models.user_relationships import User_Activity, RecentlyAccessed
 import os
 from datetime import datetime , timezone
-from package.config.utility import serialize_document
+from package.config.utility import serialize_document, count_by, reconcile_counter
 from package.config.permission import PermissionService
 
 load_dotenv()
@@ -54,9 +54,13 @@ class Organisation:
             'slug' : self.slug,
             'updatedAt' : self.updatedAt,
             'description': self.description,
+            'workspace_count': 0,
+            'members_count': 0,
             'history': []
         })
 
+        # The slug may have been cached as unknown before this organisation existed
+        SlugResolver.invalidate('organisation', self.slug)
         new_organisation = db.organisation.find_one({'_id' : result.inserted_id})
         if new_organisation:
             return serialize_document(new_organisation)
@@ -79,7 +83,11 @@ class Organisation:
             if organisation_id:
                 conditions.append({"_id": ObjectId(organisation_id)})
             if slug:
-                conditions.append({"slug": slug})
+                slug_id = SlugResolver.resolve('organisation', slug)
+                if slug_id:
+                    conditions.append({"_id": slug_id})
+            if not conditions:
+                return None
             organisations = db.organisation.aggregate([
                 {  # Match the specific organisation
                     "$match": {
@@ -134,39 +142,43 @@ class Organisation:
             return user_org.get('role', '')
         return ''
     
-    @staticmethod
-    def get_last_Accessed(document, org_slug):
-        if document:
-            for doc in document:
-                if doc.get('title') == org_slug:
-                    return doc
-        return 
-    
     @staticmethod
     def organisation(user_id):
-        user_org = db.User_Organisation.find({'user_id': ObjectId(user_id)})
-        org_ids = [relation['organisation_id'] for relation in user_org]
-        organisations = db.organisation.find({'_id': {'$in': org_ids}})
-        total_orgs = db.organisation.count_documents({})
-        safe_limit = max(1, total_orgs)
-        last_accessed_document = User_Activity.get_last_accessed_entities(
-            user_id=user_id, 
-            entity_type='organisation', 
-            limit= safe_limit
-            )
-        organisations_list = []
+        """
+        The user's organisations for the dashboard, each with the user's role, its
+        workspace count and when the user last accessed it. A fixed number of
+        reads however many organisations there are: memberships, organisations,
+        the permission matrix and the recents index. workspace_count is stored on
+        the organisation; it is only counted here for organisations from before the
+        counter existed (until reconcile_counters has run).
+        """
+        user_id = ObjectId(user_id)
+        org_ids = [relation['organisation_id'] for relation in db.User_Organisation.find({'user_id': user_id}, {'organisation_id': 1})]
+        if not org_ids:
+            return []
+        organisations = list(db.organisation.find({'_id': {'$in': org_ids}}))
+
+        missing = [organisation['_id'] for organisation in organisations if 'workspace_count' not in organisation]
+        workspace_counts = count_by(db.Workspace, 'organisation_id', missing) if missing else {}
+        roles = PermissionService.effective_permissions(user_id)['organizations']
+        last_accessed = dict(User_Activity.last_accessed_times(user_id, 'organisation', RecentlyAccessed.MAX_ENTRIES))
+
         for organisation in organisations:
-            organisation_id = organisation.get('_id')
-            user_role = PermissionService.get_user_permissions(user_id, organisation_id) 
-            workspace_count = db.Workspace.count_documents({'organisation_id': organisation_id})
-            recent_document = Organisation.get_last_Accessed(document=last_accessed_document, org_slug=organisation.get('slug'))
-            organisation_data = serialize_document(organisation)
-            organisation_data['workspace_count'] = workspace_count
-            organisation_data['User_role'] = user_role
-            organisation_data['lastAccessed'] = recent_document
-            organisations_list.append(organisation_data)
-        return serialize_document(organisations_list)
+            organisation_id = organisation['_id']
+            accessed_at = last_accessed.get(organisation_id)
+            organisation.setdefault('workspace_count', workspace_counts.get(organisation_id, 0))
+            organisation['User_role'] = roles.get(str(organisation_id), {}).get('role')
+            organisation['lastAccessed'] = {'timestamp': accessed_at, 'title': organisation.get('title')} if accessed_at else None
+        return serialize_document(organisations)
     
+    @staticmethod
+    def reconcile_counters():
+        """Recount every organisation's workspace_count and members_count; returns the number of counters corrected."""
+        return (
+            reconcile_counter(db.organisation, 'workspace_count', db.Workspace, 'organisation_id')
+            + reconcile_counter(db.organisation, 'members_count', db.User_Organisation, 'organisation_id')
+        )
+
     @staticmethod
     def Update(organisation_id: str, user_id: str, title: Optional[str] = None, image : Optional[Dict] = None, description: Optional[str] = None, slug: Optional[str] = None, color: Optional[str] = None):
         # Do NOTE: That there is more we can do here such as updating the user_id we can even remove the add access user and revoke access and add it to this function
@@ -176,11 +188,14 @@ class Organisation:
                 data = db.organisation.find_one({'_id' : ObjectId(organisation_id)})
                 return serialize_document(data)
 
+            previous_slug = None
             if slug is not None:
                 if isinstance(slug, str) and slug.strip():
                     if db.organisation.find_one({'slug': slug.strip(), '_id': {'$ne': ObjectId(organisation_id)}}):
                         return None
                     update_fields['slug'] = slug.strip()
+                    previous = db.organisation.find_one({'_id': ObjectId(organisation_id)}, {'slug': 1})
+                    previous_slug = previous.get('slug') if previous else None
                 else:
                     return None
             if color is not None:
@@ -212,6 +227,8 @@ class Organisation:
                                 'changes': update_fields
                             }
                         }})
+            if 'slug' in update_fields:
+                SlugResolver.invalidate('organisation', previous_slug, update_fields['slug'])
             data = db.organisation.find_one({'_id' : ObjectId(organisation_id)})
             return serialize_document(data)
         except Exception as e:
@@ -219,7 +236,7 @@ class Organisation:
     @staticmethod
     def delete(organisation_id,user_id):
         print('trying to delete organisation')
-        workspaces = db.Workspace.find({'organisation_id': ObjectId(organisation_id)}, {'_id': 1})
+        workspaces = list(db.Workspace.find({'organisation_id': ObjectId(organisation_id)}, {'_id': 1, 'slug': 1}))
         workspace_ids = [workspace['_id'] for workspace in workspaces]
         
         if workspace_ids:
@@ -235,9 +252,11 @@ class Organisation:
             workspaces_result = db.Workspace.delete_many({'organisation_id': ObjectId(organisation_id)})
             if workspaces_result.acknowledged is False:
                 return {'message' : 'Failed to Delete'}, 400
+            SlugResolver.invalidate('Workspace', *[workspace.get('slug') for workspace in workspaces])
   
-        organisation_result = db.organisation.delete_one({'_id': ObjectId(organisation_id), 'created_By' : ObjectId(user_id)})
-        if organisation_result.deleted_count == 1 :   
+        deleted_organisation = db.organisation.find_one_and_delete({'_id': ObjectId(organisation_id), 'created_By' : ObjectId(user_id)}, {'slug': 1})
+        if deleted_organisation:
+            SlugResolver.invalidate('organisation', deleted_organisation.get('slug'))
             PermissionService.remove_user_from_organization(user_id, organisation_id)
             return True
         else : 
@@ -9,7 +9,9 @@ from package.config.utility import serialize_document
 import jwt
 from bson import json_util, ObjectId
 from package import db
-from package.middleware import check_password, hash_password
+from package.middleware import check_password, hash_password, PasswordHasher, PasswordHashingBusy
+from package.config.permission import PermissionClaims
+from package.config.redis import redis_client
 
 load_dotenv()
 
@@ -18,6 +20,9 @@ ALGORITHM = os.getenv('JWT_ALGORITHM')
 
 
 class User: 
+    CLAIMS_KEY_PREFIX = 'user_claims'
+    CLAIMS_TTL_SECONDS = 60
+
     def __init__(self, username, email, password, firstname, lastname, role, image, createdAt, updatedAt):
         self.username = username
         self.email = email
@@ -111,24 +116,65 @@ class User:
             'exp': int((datetime.now(timezone.utc) + SecurityConfig.JWT_ACCESS_TOKEN_EXPIRES).timestamp()),
             'iat': int(datetime.now(timezone.utc).timestamp()),
         }
+        if PermissionClaims.ENABLED:
+            claims = PermissionClaims.build(user_data['_id'])
+            if claims is not None:
+                payload['perms'] = claims
         return jwt.encode(payload, SecurityConfig.JWT_SECRET_KEY, ALGORITHM)
     
     @staticmethod
-    def create_refresh_token(user_data):
-        """Create refresh token with 7-days expiry"""
-        return jwt.encode({
+    def create_refresh_token(user_data, family_id=None, jti=None):
+        """
+        Create refresh token with 7-days expiry.
+        Without a family_id a new token family is started; rotation passes the
+        family and the jti it has already swapped in.
+        """
+        payload = {
             'user_id': user_data['_id'],
             'token_type': 'refresh',
-            'jti': str(uuid.uuid4()),
+            'jti': jti or str(uuid.uuid4()),
             'exp': int((datetime.now(timezone.utc) + SecurityConfig.JWT_REFRESH_TOKEN_EXPIRES).timestamp()),
             'iat': int(datetime.now(timezone.utc).timestamp()),
-        }, SecurityConfig.JWT_REFRESH_SECRET_KEY, ALGORITHM)
+        }
+        if family_id is None:
+            family_id = str(uuid.uuid4())
+            if not AuthManager.start_token_family(family_id, payload['jti']):
+                family_id = None  # Redis unavailable: the MongoDB blocklist covers this token
+        if family_id:
+            payload['fid'] = family_id
+        return jwt.encode(payload, SecurityConfig.JWT_REFRESH_SECRET_KEY, ALGORITHM)
+
+    @staticmethod
+    def token_claims(user_id):
+        """
+        User_Data for issuing access tokens, cached in Redis for CLAIMS_TTL_SECONDS
+        so that token refreshes don't rerun the aggregation every time.
+        """
+        key = f"{User.CLAIMS_KEY_PREFIX}:{user_id}"
+        try:
+            cached = redis_client.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        except Exception:
+            pass
+        data = User.User_Data(user_id)
+        if data:
+            try:
+                redis_client.set(key, json.dumps(data, default=str), ex=User.CLAIMS_TTL_SECONDS)
+            except Exception:
+                pass
+        return data
         
     @staticmethod
-    def User_Data(user_id):
-        """Fetch user data by ID"""
+    def _profile_pipeline(match, with_password=False):
+        """
+        Aggregation returning a user with the organisation and workspace claims
+        that go into their access token. Login also asks for the password hash,
+        so it needs no other read before issuing tokens.
+        """
         pipeline = [
-            { '$match': {'_id': ObjectId(user_id)} },
+            { '$match': match },
+            { '$limit': 1 },
             {
                 '$lookup': {
                     'from': 'User_Organisation',
@@ -167,17 +213,23 @@ class User:
                         }
                     }
                 }
-            },
-            {
-                '$project': {
-                    'password': 0,
-                    'createdAt': 0,
-                    'updatedAt': 0,
-                    'user_orgs': 0,
-                    'user_workspaces': 0
-                }
             }
         ]
+        projection = {
+            'createdAt': 0,
+            'updatedAt': 0,
+            'user_orgs': 0,
+            'user_workspaces': 0
+        }
+        if not with_password:
+            projection['password'] = 0
+        pipeline.append({ '$project': projection })
+        return pipeline
+
+    @staticmethod
+    def User_Data(user_id):
+        """Fetch user data by ID"""
+        pipeline = User._profile_pipeline({'_id': ObjectId(user_id)})
         user_data = list(db.Users.aggregate(pipeline))
         if not user_data:
             return None
@@ -186,21 +238,32 @@ class User:
     @staticmethod
     def login(username, password, ip_address):
             #check for brute force attempts
-        if AuthManager.check_brute_force(username, ip_address):
+        failed_attempts = AuthManager.failed_attempts(username, ip_address)
+        if failed_attempts >= AuthManager.MAX_LOGIN_ATTEMPTS:
             return {'success': False, 'error': 'Too many failed attempts. Try again later.', 'status_code': 429}
         try:
-            user = db.Users.find_one({'username': username})
+            #user, password hash and organisation/workspace claims in one round trip
+            users = list(db.Users.aggregate(User._profile_pipeline({'username': username}, with_password=True)))
+            user = users[0] if users else None
             if not user or not check_password(password, user['password']):
                 AuthManager.record_failed_attempt(username, ip_address)
                 return {'success': False, 'error': "Invalid credentials", 'status_code': 401}
-            
-            #clear failed attempts on successful login
-            AuthManager.clear_failed_attempts(username)
+
+            #upgrade hashes made with an old work factor, off the request path
+            password_hash = user.pop('password')
+            if PasswordHasher.needs_rehash(password_hash):
+                PasswordHasher.rehash_later(password, lambda hashed: db.Users.update_one(
+                    {'_id': user['_id'], 'password': password_hash},
+                    {'$set': {'password': hashed}}
+                ))
+
+            #clear failed attempts on successful login, only if there were any
+            if failed_attempts:
+                AuthManager.clear_failed_attempts_later(username, ip_address)
 
             #Generating tokens
             try:
-                user_data = serialize_document(user)
-                Data = User.User_Data(user_data['_id'])
+                Data = serialize_document(user)
                 access_token = User.create_access_token(Data)
                 refresh_token = User.create_refresh_token(Data)
             except Exception as e:
@@ -213,6 +276,8 @@ class User:
                 'access_token': access_token,
                 'refresh_token': refresh_token
             }
+        except PasswordHashingBusy:
+            return {'success': False, 'error': 'Too many sign-ins in progress. Try again shortly.', 'status_code': 503}
         except Exception as e:
             current_app.logger.error(f"Login error: {str(e)}")
             return {'success': False, 'error': 'An error occurred during login', 'status_code': 500}
@@ -229,11 +294,13 @@ class User:
                 return {'success': False, 'error': 'Token type invalid', 'status_code': 401}
 
             # Check if the token is already blacklisted
-            if AuthManager.BlockedToken.is_blocked(refresh_token):
+            if AuthManager.BlockedToken.is_blocked(payload.get('jti')):
                 return {'success': False, 'error': 'Token already revoked', 'status_code': 401}
 
-            # Blacklist the refresh token
-            AuthManager.block_token(refresh_token)
+            # End the token family and blacklist the refresh token
+            if payload.get('fid'):
+                AuthManager.end_token_family(payload['fid'])
+            AuthManager.block_token(payload)
             return {'success': True}
         except jwt.ExpiredSignatureError:
             return {'success': False, 'error': 'Token expired', 'status_code': 401}
@@ -251,21 +318,33 @@ class User:
         if payload['token_type'] != 'refresh':
             return {'success': False, 'error': 'Token type invalid', 'status_code': 401}
         try:
-            #check if token is blacklisted
-            if AuthManager.BlockedToken.is_blocked(token):
+            #rotate within the token family: one compare-and-swap in Redis
+            family_id = payload.get('fid')
+            new_jti = str(uuid.uuid4())
+            rotated = AuthManager.rotate_token_family(family_id, payload['jti'], new_jti) if family_id else None
+            if rotated == -1:
+                return {'success': False, 'error': 'Token reuse detected', 'status_code': 401}
+            if rotated == 0:
+                return {'success': False, 'error': 'Token revoked', 'status_code': 401}
+            #a family whose token was spent through the fallback below while Redis was down
+            if AuthManager.BlockedToken.is_blocked(payload.get('jti')):
+                if rotated == 1:
+                    AuthManager.end_token_family(family_id)
                 return {'success': False, 'error': 'Token revoked', 'status_code': 401}
+            if rotated is None:
+                #tokens from before families, or Redis unavailable: MongoDB blocklist
+                AuthManager.block_token(payload)
+                if family_id:
+                    AuthManager.end_token_family(family_id)
+                family_id, new_jti = None, None
 
-            user = db.Users.find_one({"_id": ObjectId(payload['user_id'])})
-            if not user:
+            Data = User.token_claims(payload['user_id'])
+            if not Data:
                 return {'success': False, 'error': 'User not found', 'status_code': 404}
-            
-            AuthManager.block_token(token)
 
             #Generate new tokens
-            user_data = serialize_document(user)
-            Data = User.User_Data(user_data['_id'])
             access_token = User.create_access_token(Data)
-            refresh_token = User.create_refresh_token(Data)
+            refresh_token = User.create_refresh_token(Data, family_id, new_jti)
             return {'success': True, 'access_token': access_token, 'refresh_token': refresh_token}
         except jwt.ExpiredSignatureError:
             return {'success': False, 'error': 'Token expired', 'status_code': 401}
@@ -282,18 +361,18 @@ class User:
         if payload['token_type'] != 'refresh':
             return {'success': False, 'error': 'Token type invalid', 'status_code': 401}
         try:
-            #check if token is blacklisted
-            if AuthManager.BlockedToken.is_blocked(token):
+            #check if token is still current in its family, or blacklisted
+            current = AuthManager.is_current_token(payload['fid'], payload.get('jti')) if payload.get('fid') else None
+            if current is not False:
+                current = not AuthManager.BlockedToken.is_blocked(payload.get('jti'))
+            if not current:
                 return {'success': False, 'error': 'Token revoked', 'status_code': 401}
 
-            user = db.Users.find_one({"_id": ObjectId(payload['user_id'])})
-            if not user:
+            Data = User.token_claims(payload['user_id'])
+            if not Data:
                 return {'success': False, 'error': 'User not found', 'status_code': 404}
-            
 
             #Generate new tokens
-            user_data = serialize_document(user)
-            Data = User.User_Data(user_data['_id'])
             access_token = User.create_access_token(Data)
             return {'success': True, 'access_token': access_token}
         except jwt.ExpiredSignatureError:
@@ -1,48 +1,26 @@
 from flask import Response,jsonify
 import json
 from bson import json_util, ObjectId
+from pymongo import UpdateOne, DESCENDING
+from pymongo.errors import BulkWriteError
 from package import db
 from package.config.utility import serialize_document
+from package.config.redis import redis_client
+from package.config.slug import SlugResolver
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
+import atexit
+import logging
 import os
+import queue
+import threading
+import time
 
 load_dotenv()
 
 SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 ALGORITHM = os.getenv('JWT_ALGORITHM')
 
-def log_recent_view(collection, user_id, ref_field, ref_id, max_entries=5):
-    now = datetime.utcnow()
-    filter_ = {'user_id': ObjectId(user_id), ref_field: ObjectId(ref_id)}
-    
-    db[collection].update_one(filter_, {'$set': {'viewed_at': now}}, upsert=True)
-    
-    count = db[collection].count_documents({'user_id': ObjectId(user_id)})
-
-    if count > max_entries:
-        excess = list(db[collection].find({'user_id': ObjectId(user_id)})
-                      .sort('viewed_at', 1)
-                      .skip(max_entries))
-        for view in excess:
-            db[collection].delete_one({'_id': view['_id']})
-
-def log_org_view(user_id, organisation_id, viewed_at):
-    db.Org_View.update_one(
-        {'user_id': ObjectId(user_id), 'organisation_id': ObjectId(organisation_id)},
-        {'$set': {'viewed_at': viewed_at}},
-        upsert=True 
-    )
-    log_recent_view('User_Organisation', user_id, 'organisation_id', organisation_id)
-
-def log_workspace_view(user_id, workspace_id, viewed_at):
-    db.Worpsace_View.update_one(
-        {'user_id': ObjectId(user_id), 'organisation_id': ObjectId(workspace_id)},
-        {'$set': {'viewed_at': viewed_at}},
-        upsert=True
-    )
-    log_recent_view('User_Organisation', user_id, 'organisation_id', workspace_id)
-
 
 class User_Workspace: 
     def __init__(self, user_id, workspace_id, organisation_id, role, joined_at):
@@ -69,12 +47,16 @@ class User_Workspace:
             'role': role,
             'joined_at': joined_at
         })
+        if result.acknowledged:
+            db.Workspace.update_one({'_id': ObjectId(workspace_id)}, {'$inc': {'members_count': 1}})
 
         return result.acknowledged
 
     @staticmethod
     def revoke_User_Workspace(workspace_id, user_id):
         result = db.User_Workspace.find_one_and_delete({'workspace_id': ObjectId(workspace_id), 'user_id': ObjectId(user_id)})
+        if result:
+            db.Workspace.update_one({'_id': ObjectId(workspace_id)}, {'$inc': {'members_count': -1}})
         return bool(result)
         
 
@@ -138,6 +120,7 @@ class User_Organisation:
         )
 
         if result.inserted_id:
+            db.organisation.update_one({'_id': ObjectId(organisation_id)}, {'$inc': {'members_count': 1}}, session=session)
             return {"success": True}
         
         return {
@@ -150,6 +133,7 @@ class User_Organisation:
     def revoke_User_Organisation(organisation_id, user_id):
         result = db.User_Organisation.find_one_and_delete({'organisation_id': ObjectId(organisation_id), 'user_id':ObjectId(user_id)})
         if result:
+            db.organisation.update_one({'_id': ObjectId(organisation_id)}, {'$inc': {'members_count': -1}})
             return {"success": True}
         else :
             return {"success": False, 
@@ -333,139 +317,725 @@ class User_Activity:
             self.metadata = metadata
             self.workspace_id = ObjectId(workspace_id) if workspace_id and ObjectId.is_valid(str(workspace_id)) else workspace_id
             self.organisation_id = ObjectId(organisation_id) if organisation_id and ObjectId.is_valid(str(organisation_id)) else organisation_id
+            self._id = ObjectId()
         
-        def Create_User_Activity_Log(self):
-            query = {
+        # Activity is stored in buckets: one document per (user, UTC day) holding an
+        # `events` array. A bucket takes at most MAX_BUCKET_EVENTS events, after which
+        # the same day continues in a new bucket, and MongoDB drops buckets via the
+        # TTL index on `expires_at`, RETENTION_DAYS after their day.
+        MAX_BUCKET_EVENTS = 500
+        RETENTION_DAYS = int(os.getenv('ACTIVITY_RETENTION_DAYS', 90))
+
+        # Workspace and organisation feeds read Activity_Feed instead: one document per
+        # scoped, non-view event, sharing the event's _id, paged newest first by
+        # (timestamp, _id) keyset. FEED_FIELDS are stored in the per-scope indexes, so a
+        # page without metadata is answered from the index alone.
+        FEED_SCOPES = ('workspace_id', 'organisation_id')
+        FEED_FIELDS = ('timestamp', 'user_id', 'action', 'entity_type', 'entity_id')
+        # Request details kept in the log but not shown to other members of the feed;
+        # device_info is the User-Agent again
+        FEED_PRIVATE_METADATA = ('ip_address', 'user_agent', 'device_info')
+        FEED_PAGE_SIZE = 20
+        FEED_MAX_PAGE_SIZE = 100
+
+        def _query(self):
+            return {
                 'user_id': self.user_id,
                 'entity_type': self.entity_type,
                 'entity_id': self.entity_id,
                 'action': self.action
             }
 
-            if self.action.lower().startswith('view'):
-                db.User_Activity.update_one(
-                    query,
-                    {
-                        '$inc': {'view_count': 1},
-                        '$set': {
-                            'timestamp': self.timestamp,
-                            'metadata': self.metadata,
-                            'workspace_id': self.workspace_id,
-                            'organisation_id': self.organisation_id
-                        }
-                    },
-                    upsert=True
-                )
-            elif 'delete' in self.action.lower() or 'create' in self.action.lower():
-                db.User_Activity.insert_one({
-                    **query,
-                    'timestamp': self.timestamp,
-                    'metadata': self.metadata,
-                    'workspace_id': self.workspace_id,
-                    'organisation_id': self.organisation_id
-                })
-            else:
-                db.User_Activity.update_one(
-                    query,
-                    {
-                        '$set': {
-                            'timestamp': self.timestamp,
-                            'metadata': self.metadata,
-                            'workspace_id': self.workspace_id,
-                            'organisation_id': self.organisation_id
-                        }
-                    },
-                    upsert=True
-                )
+        def _is_view(self):
+            return self.action.lower().startswith('view')
 
-            # Keep last 20 logs for this exact (user + entity + action)
-            count = db.User_Activity.count_documents(query)
-            if count > 20:
-                oldest = db.User_Activity.find(query).sort("timestamp", 1).skip(20)
-                for doc in oldest:
-                    db.User_Activity.delete_one({'_id': doc['_id']})
+        def _fields(self):
+            return {
+                'timestamp': self.timestamp,
+                'metadata': self.metadata,
+                'workspace_id': self.workspace_id,
+                'organisation_id': self.organisation_id
+            }
+
+        @staticmethod
+        def _bucket_operation(user_id, timestamp, event):
+            """Append `event` to the user's bucket for the day of `timestamp`, as a bulk_write operation."""
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            day = datetime(timestamp.year, timestamp.month, timestamp.day, tzinfo=timezone.utc)
+            return UpdateOne(
+                {'user_id': user_id, 'day': day, 'count': {'$lt': User_Activity.MAX_BUCKET_EVENTS}},
+                {
+                    '$push': {'events': {'_id': ObjectId(), **event}},
+                    '$inc': {'count': 1},
+                    '$setOnInsert': {'expires_at': day + timedelta(days=User_Activity.RETENTION_DAYS)}
+                },
+                upsert=True
+            )
 
+        def _event(self):
+            event = {'_id': self._id, **self._query(), **self._fields()}
+            del event['user_id']
+            return event
 
-        def get_logs_by_user(self, user_id):
+        def _operation(self, view_count=1):
+            """The write for this log entry, as a bulk_write operation."""
+            event = self._event()
+            if self._is_view():
+                event['view_count'] = view_count
+            return User_Activity._bucket_operation(self.user_id, self.timestamp, event)
+
+        @staticmethod
+        def _feed_document(user_id, event):
+            """The Activity_Feed document for a bucket event, or None if it belongs in no feed."""
+            scopes = {scope: event[scope] for scope in User_Activity.FEED_SCOPES if event.get(scope)}
+            if not scopes or 'view_count' in event:
+                return None
+            timestamp = event['timestamp']
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            # Stored at MongoDB's millisecond precision, so cursors compare exactly
+            timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+            return {
+                '_id': event['_id'],
+                **scopes,
+                'timestamp': timestamp,
+                'user_id': user_id,
+                'action': event.get('action'),
+                'entity_type': event.get('entity_type'),
+                'entity_id': event.get('entity_id'),
+                'metadata': event.get('metadata'),
+                'expires_at': timestamp + timedelta(days=User_Activity.RETENTION_DAYS)
+            }
+
+        def Create_User_Activity_Log(self):
+            """Queue this entry; ActivityLogWriter writes it in the background."""
+            return ActivityLogWriter.submit(self)
+
+        @staticmethod
+        def migrate_to_buckets(batch_size=1000):
+            """
+            One-off migration: move activity logs stored one document per entry into
+            day buckets. Each batch is deleted once written, so the migration can be
+            stopped and rerun; entries a previous run wrote but didn't get to delete are
+            found in the buckets and not written twice. Entries already past retention
+            are dropped.
+            """
+            legacy = {'day': {'$exists': False}}
+            cutoff = datetime.now(timezone.utc) - timedelta(days=User_Activity.RETENTION_DAYS)
+            moved = 0
+            while True:
+                logs = list(db.User_Activity.find(legacy).sort('_id', 1).limit(batch_size))
+                if not logs:
+                    return moved
+                # Checked up front rather than guarded in the upsert's filter: a filter
+                # excluding buckets that hold the event would upsert a second copy of it
+                migrated = {
+                    event['_id']
+                    for bucket in db.User_Activity.find(
+                        {'user_id': {'$in': list({log.get('user_id') for log in logs})},
+                         'events._id': {'$in': [log['_id'] for log in logs]}},
+                        {'events._id': 1}
+                    )
+                    for event in bucket['events']
+                }
+                operations, feed = [], []
+                for log in logs:
+                    timestamp = log.get('timestamp') or log['_id'].generation_time
+                    if timestamp.tzinfo is None:
+                        timestamp = timestamp.replace(tzinfo=timezone.utc)
+                    if timestamp < cutoff or not log.get('user_id'):
+                        continue
+                    event = {
+                        field: log.get(field)
+                        for field in ('entity_type', 'entity_id', 'action', 'metadata', 'workspace_id', 'organisation_id')
+                    }
+                    event['_id'] = log['_id']
+                    event['timestamp'] = timestamp
+                    if 'view_count' in log:
+                        event['view_count'] = log['view_count']
+                    if log['_id'] not in migrated:
+                        operations.append(User_Activity._bucket_operation(log['user_id'], timestamp, event))
+                    document = User_Activity._feed_document(log['user_id'], event)
+                    if document:
+                        feed.append(UpdateOne({'_id': document['_id']}, {'$setOnInsert': document}, upsert=True))
+                if operations:
+                    db.User_Activity.bulk_write(operations, ordered=True)
+                if feed:
+                    db.Activity_Feed.bulk_write(feed, ordered=False)
+                db.User_Activity.delete_many({'_id': {'$in': [log['_id'] for log in logs]}})
+                moved += len(operations)
+
+        @staticmethod
+        def _find_events(bucket_match, event_match):
+            """Events matching `event_match` in the buckets matching `bucket_match`, newest first, each with its user_id."""
+            events = {f"events.{field}": value for field, value in event_match.items()}
+            pipeline = [
+                {"$match": {**bucket_match, **events}},
+                {"$unwind": "$events"},
+                {"$match": events},
+                {"$addFields": {"events.user_id": "$user_id"}},
+                {"$replaceRoot": {"newRoot": "$events"}},
+                {"$sort": {"timestamp": -1, "_id": -1}}
+            ]
+            return list(db.User_Activity.aggregate(pipeline))
+
+        @staticmethod
+        def get_logs_by_user(user_id):
             """Filters logs by user ID."""
-            return list(self.collection.find({"user_id": user_id}))
+            return User_Activity._find_events({"user_id": ObjectId(user_id)}, {})
 
-        def get_logs_by_action(self, action):
+        @staticmethod
+        def get_logs_by_action(action):
             """Filters logs by action type."""
-            return list(self.collection.find({"action": action}))
+            return User_Activity._find_events({}, {"action": action})
 
-        def get_logs_by_entity(self, entity_type, entity_id):
+        @staticmethod
+        def get_logs_by_entity(entity_type, entity_id):
             """Filters logs by entity type and ID."""
-            return list(self.collection.find({"entity_type": entity_type, "entity_id": entity_id}))
+            return User_Activity._find_events({}, {"entity_type": entity_type, "entity_id": entity_id})
+
+        @staticmethod
+        def encode_cursor(timestamp, event_id):
+            """Opaque keyset cursor for the feed entry at (timestamp, _id)."""
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            return f"{int(timestamp.timestamp() * 1000)}-{event_id}"
+
+        @staticmethod
+        def decode_cursor(cursor):
+            """(timestamp, _id) from a cursor made by encode_cursor, or None if it is malformed."""
+            try:
+                milliseconds, event_id = str(cursor).split('-', 1)
+                timestamp = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=int(milliseconds))
+            except (TypeError, ValueError):
+                return None
+            if not ObjectId.is_valid(event_id):
+                return None
+            return timestamp, ObjectId(event_id)
 
-        def get_logs_by_workspace(self, workspace_id):
-            """Filters logs by workspace ID."""
-            return list(self.collection.find({"workspace_id": workspace_id}))
+        @staticmethod
+        def get_feed(scope, scope_id, limit=None, cursor=None, include_metadata=False):
+            """
+            One page of activity for a workspace or organisation (`scope` is one of
+            FEED_SCOPES), newest first. Pass the returned `next_cursor` back to get the
+            following page; it is None on the last page. Each page is a range scan of
+            at most limit + 1 index entries, however long the history is.
+            Raises ValueError for an unknown scope or a malformed cursor.
+            """
+            if scope not in User_Activity.FEED_SCOPES:
+                raise ValueError(f"Unknown activity feed scope: {scope}")
+            limit = min(max(int(limit or User_Activity.FEED_PAGE_SIZE), 1), User_Activity.FEED_MAX_PAGE_SIZE)
+            scope_id = ObjectId(scope_id) if ObjectId.is_valid(str(scope_id)) else scope_id
 
-        def get_logs_by_organisation(self, organisation_id):
-            """Filters logs by organisation ID."""
-            return list(self.collection.find({"organisation_id": organisation_id}))
+            query = {scope: scope_id}
+            if cursor:
+                position = User_Activity.decode_cursor(cursor)
+                if position is None:
+                    raise ValueError("Invalid cursor")
+                timestamp, event_id = position
+                query['$or'] = [
+                    {'timestamp': {'$lt': timestamp}},
+                    {'timestamp': timestamp, '_id': {'$lt': event_id}}
+                ]
 
-        def get_recent_logs(self, user_id, limit=10):
-            """Fetches the most recent logs for a user."""
-            return list(self.collection.find({"user_id": user_id}).sort("timestamp", -1).limit(limit))
+            projection = {field: 1 for field in User_Activity.FEED_FIELDS}
+            if include_metadata:
+                projection['metadata'] = 1
+            entries = list(
+                db.Activity_Feed.find(query, projection)
+                .sort([('timestamp', DESCENDING), ('_id', DESCENDING)])
+                .limit(limit + 1)
+            )
+            next_cursor = None
+            if len(entries) > limit:
+                entries = entries[:limit]
+                next_cursor = User_Activity.encode_cursor(entries[-1]['timestamp'], entries[-1]['_id'])
+            for entry in entries:
+                if isinstance(entry.get('metadata'), dict):
+                    entry['metadata'] = {
+                        key: value for key, value in entry['metadata'].items()
+                        if key not in User_Activity.FEED_PRIVATE_METADATA
+                    }
+            return {'data': serialize_document(entries), 'next_cursor': next_cursor}
 
-        def get_frequently_accessed_entities(self, user_id, entity_type, limit=5):
-            """Fetches the most frequently accessed entities by the user."""
+        @staticmethod
+        def get_logs_by_workspace(workspace_id, limit=None, cursor=None, include_metadata=False):
+            """Activity in a workspace, one page at a time (see get_feed)."""
+            return User_Activity.get_feed('workspace_id', workspace_id, limit, cursor, include_metadata)
+
+        @staticmethod
+        def get_logs_by_organisation(organisation_id, limit=None, cursor=None, include_metadata=False):
+            """Activity in an organisation, one page at a time (see get_feed)."""
+            return User_Activity.get_feed('organisation_id', organisation_id, limit, cursor, include_metadata)
+
+        @staticmethod
+        def get_recent_logs(user_id, limit=10):
+            """Fetches the most recent logs for a user, from their newest buckets only."""
+            limit = min(max(int(limit), 1), User_Activity.FEED_MAX_PAGE_SIZE)
+            pipeline = [
+                {"$match": {"user_id": ObjectId(user_id)}},
+                {"$sort": {"day": -1, "_id": -1}},
+                # Buckets are never empty, so `limit` buckets always hold `limit` events
+                {"$limit": limit},
+                {"$unwind": "$events"},
+                {"$replaceRoot": {"newRoot": "$events"}},
+                {"$sort": {"timestamp": -1, "_id": -1}},
+                {"$limit": limit}
+            ]
+            return serialize_document(list(db.User_Activity.aggregate(pipeline)))
+
+        @staticmethod
+        def get_frequently_accessed_entities(user_id, entity_type, limit=5):
+            """Fetches the most frequently accessed entities by the user; coalesced views count once per view."""
             pipeline = [
-                {"$match": {"user_id": user_id, "entity_type": entity_type}},
-                {"$group": {"_id": "$entity_id", "count": {"$sum": 1}}},
+                {"$match": {"user_id": ObjectId(user_id), "events.entity_type": entity_type}},
+                {"$unwind": "$events"},
+                {"$match": {"events.entity_type": entity_type}},
+                {"$group": {"_id": "$events.entity_id", "count": {"$sum": {"$ifNull": ["$events.view_count", 1]}}}},
                 {"$sort": {"count": -1}},
                 {"$limit": limit}
             ]
-            return serialize_document(list(self.collection.aggregate(pipeline)))
+            return serialize_document(list(db.User_Activity.aggregate(pipeline)))
 
         def get_last_accessed_entities(user_id, entity_type, limit):
-            """Fetches the last accessed entities by the user."""
+            """
+            Fetches the last accessed entities by the user, newest first, each with a
+            `lastAccessed` time. Ids come from the user's RecentlyAccessed sorted set
+            and the documents from one $in query; the activity log is only read
+            (and the set rebuilt from it) when the set hasn't been seeded yet.
+            """
+            entries = User_Activity.last_accessed_times(user_id, entity_type, limit + RecentlyAccessed.READ_SLACK)
+            documents = {doc['_id']: doc for doc in db[entity_type].find({'_id': {'$in': [entity_id for entity_id, _ in entries]}})}
+            data = [
+                {**documents[entity_id], 'lastAccessed': accessed_at}
+                for entity_id, accessed_at in entries if entity_id in documents
+            ]
+            return serialize_document(data[:limit])
+
+        @staticmethod
+        def last_accessed_times(user_id, entity_type, limit):
+            """
+            Up to `limit` (entity _id, last access) pairs, newest first, without fetching
+            the entities. Served from RecentlyAccessed, rebuilt from the log when unseeded.
+            """
+            entries = RecentlyAccessed.latest(user_id, entity_type, limit)
+            if entries is None:
+                logged = User_Activity._last_accessed_from_logs(user_id, entity_type)
+                RecentlyAccessed.seed(user_id, entity_type, logged)
+                # Re-read so views recorded before seeding are merged in
+                entries = RecentlyAccessed.latest(user_id, entity_type, limit)
+                if entries is None:
+                    entries = logged[:limit]
+            return entries
+
+        def _last_accessed_from_logs(user_id, entity_type):
+            """(entity _id, last access) pairs from the activity buckets, newest first."""
             pipeline = [
-                {"$match": {"user_id": ObjectId(user_id), "entity_type": entity_type}},
+                {"$match": {"user_id": ObjectId(user_id), "events.entity_type": entity_type}},
+                {"$unwind": "$events"},
+                {"$match": {"events.entity_type": entity_type}},
+                {"$group": {"_id": "$events.entity_id", "timestamp": {"$max": "$events.timestamp"}}},
                 {"$sort": {"timestamp": -1}},
-                {"$group": {  
-                    "_id": "$entity_id",
-                    "timestamp": {"$first" : "$timestamp"}
-                }},
-                {"$lookup": {
-                    "from": entity_type,
-                    "let": { "search_id": "$_id" }, # This is the ID from your 'Recent' list
-                    "pipeline": [
-                        { "$match": {
-                            "$expr": {
-                                "$or": [
-                                    { "$eq": ["$slug", "$$search_id"] },
-                                    { "$eq": ["$_id", "$$search_id"] }
-                                ]
-                            }
-                        }}
-                    ],
-                    "as": "data"
-                }},
-                {"$unwind": { "path": "$data", "preserveNullAndEmptyArrays": True }},
-                {"$limit": limit},
-                {
-                    # This specifically merges the timestamp INTO the workspace document
-                    "$replaceRoot": { 
-                        "newRoot": { "$mergeObjects": ["$data", { "lastAccessed": "$timestamp" }] } 
-                    }}
+                {"$limit": RecentlyAccessed.MAX_ENTRIES}
             ]
-            data = list(db.User_Activity.aggregate(pipeline))
-            return serialize_document(data)
+            entries = {}
+            for log in db.User_Activity.aggregate(pipeline):
+                # Views by slug are logged with the slug as entity_id
+                entity_id = log['_id'] if isinstance(log['_id'], ObjectId) else SlugResolver.resolve(entity_type, log['_id'])
+                if entity_id and entity_id not in entries:
+                    entries[entity_id] = log['timestamp']
+            return list(entries.items())
 
-        def clear_old_logs(self, days = 7):
+        @staticmethod
+        def clear_old_logs(days = 7):
             """Deletes logs older than the specified number of days."""
-            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days)
-            self.collection.delete_many({"timestamp": {"$lt": cutoff_date}})
-
-        def clear_logs_by_limit(self, limit):
-            """Deletes the oldest logs to keep the collection within a specified size."""
-            total_logs = self.collection.count_documents({})
-            if total_logs > limit:
-                excess_logs = total_logs - limit
-                oldest_logs = self.collection.find({}).sort("timestamp", 1).limit(excess_logs)
-                oldest_ids = [log["_id"] for log in oldest_logs]
-                self.collection.delete_many({"_id": {"$in": oldest_ids}})
-        
+            now = datetime.now(timezone.utc)
+            cutoff_day = datetime(now.year, now.month, now.day, tzinfo=timezone.utc) - timedelta(days=days)
+            return db.User_Activity.delete_many({"day": {"$lt": cutoff_day}}).deleted_count
+
+        @staticmethod
+        def clear_logs_by_limit(limit):
+            """
+            Deletes the oldest logs to keep the collection within a specified number of
+            events. Whole buckets are removed, so up to one bucket more may be kept.
+            """
+            kept = 0
+            for bucket in db.User_Activity.find({"day": {"$exists": True}}, {"day": 1, "count": 1}).sort([("day", -1), ("_id", -1)]):
+                kept += bucket.get("count", 0)
+                if kept > limit:
+                    return db.User_Activity.delete_many({
+                        "$or": [
+                            {"day": {"$lt": bucket["day"]}},
+                            {"day": bucket["day"], "_id": {"$lt": bucket["_id"]}}
+                        ]
+                    }).deleted_count
+            return 0
+
+
+class RecentlyAccessed:
+    """
+    Per-user "recently accessed" index: one Redis sorted set per (user, entity type)
+    mapping entity _id to the time it was last used, capped at MAX_ENTRIES and
+    expired after TTL_SECONDS without activity. ActivityLogWriter keeps it up to
+    date as activity is written; deletes take the entity out of the actor's set,
+    and entities deleted by others are dropped when reads find no document.
+
+    A set only holds the full history once it has been seeded from the activity
+    log. Seeding is tracked by a separate marker key with the same TTL, so a set
+    recreated by a view after expiry, eviction or a flush is still reseeded.
+    """
+
+    KEY_PREFIX = 'recent'
+    MAX_ENTRIES = 50
+    TTL_SECONDS = 30 * 86400
+    # Extra ids read beyond the requested limit, to cover entities that no longer exist
+    READ_SLACK = 5
+
+    @classmethod
+    def _key(cls, user_id, entity_type):
+        return f"{cls.KEY_PREFIX}:{user_id}:{entity_type}"
+
+    @classmethod
+    def _seeded_key(cls, user_id, entity_type):
+        return f"{cls._key(user_id, entity_type)}:seeded"
+
+    @staticmethod
+    def _timestamp(value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    @classmethod
+    def record(cls, activities):
+        """Apply a batch of User_Activity entries to their users' sets in one pipeline."""
+        pipe = redis_client.pipeline(transaction=False)
+        keys = set()
+        for activity in activities:
+            entity_id = activity.entity_id
+            if not isinstance(entity_id, ObjectId):
+                entity_id = SlugResolver.resolve(activity.entity_type, entity_id) if entity_id else None
+            if not entity_id:
+                continue
+            key = cls._key(activity.user_id, activity.entity_type)
+            if 'delete' in activity.action.lower():
+                pipe.zrem(key, str(entity_id))
+            else:
+                pipe.zadd(key, {str(entity_id): cls._timestamp(activity.timestamp)}, gt=True)
+                keys.add((activity.user_id, activity.entity_type))
+        for user_id, entity_type in keys:
+            key = cls._key(user_id, entity_type)
+            pipe.zremrangebyrank(key, 0, -(cls.MAX_ENTRIES + 1))
+            pipe.expire(key, cls.TTL_SECONDS)
+            pipe.expire(cls._seeded_key(user_id, entity_type), cls.TTL_SECONDS)
+        pipe.execute()
+
+    @classmethod
+    def seed(cls, user_id, entity_type, entries):
+        """
+        Merge (entity _id, last access) pairs from the log into a user's set and
+        mark it seeded, even when there is no history to load.
+        """
+        try:
+            key = cls._key(user_id, entity_type)
+            pipe = redis_client.pipeline(transaction=False)
+            if entries:
+                pipe.zadd(key, {str(entity_id): cls._timestamp(accessed_at) for entity_id, accessed_at in entries}, gt=True)
+                pipe.zremrangebyrank(key, 0, -(cls.MAX_ENTRIES + 1))
+                pipe.expire(key, cls.TTL_SECONDS)
+            pipe.set(cls._seeded_key(user_id, entity_type), 1, ex=cls.TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to seed recently accessed {entity_type}: {str(e)}")
+
+    @classmethod
+    def latest(cls, user_id, entity_type, limit):
+        """
+        Up to `limit` (entity _id, last access) pairs, newest first, or None when
+        the set hasn't been seeded or Redis can't be read.
+        """
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.exists(cls._seeded_key(user_id, entity_type))
+            pipe.zrevrange(cls._key(user_id, entity_type), 0, limit - 1, withscores=True)
+            seeded, members = pipe.execute()
+            if not seeded:
+                return None
+            return [
+                (ObjectId(member), datetime.fromtimestamp(float(score), tz=timezone.utc))
+                for member, score in members
+            ]
+        except Exception:
+            return None
+
+
+class ViewCounters:
+    """
+    Write-behind buffer for "View" activity. Views are coalesced in Redis, one hash
+    per (user + entity + action) holding the view count and the latest view, and
+    a set of pending hashes. Every worker's ActivityLogWriter thread periodically
+    takes pending hashes (SPOP, then HGETALL + DEL in one transaction, so each view
+    is taken exactly once) and appends them to the User_Activity buckets, one event
+    per counter carrying its view_count, with one bulk_write.
+    """
+
+    KEY_PREFIX = 'views'
+    PENDING_KEY = 'views:pending'
+    FLUSH_INTERVAL_SECONDS = float(os.getenv('VIEW_COUNTER_FLUSH_SECONDS', 10))
+    FLUSH_BATCH = 1000
+
+    _stats = {'buffered': 0, 'flushes': 0, 'documents_written': 0, 'errors': 0}
+
+    @classmethod
+    def _key(cls, activity):
+        return f"{cls.KEY_PREFIX}:{activity.user_id}:{activity.entity_type}:{activity.entity_id}:{activity.action}"
+
+    @classmethod
+    def buffer(cls, views) -> bool:
+        """Add views to their counters. False if Redis didn't take them."""
+        try:
+            # One transaction, so a flush never takes a counter without its view
+            pipe = redis_client.pipeline(transaction=True)
+            for activity in views:
+                key = cls._key(activity)
+                pipe.hincrby(key, 'count', 1)
+                pipe.hset(key, 'last', json_util.dumps({**activity._query(), **activity._fields()}))
+                pipe.sadd(cls.PENDING_KEY, key)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Failed to buffer views, writing them directly: {str(e)}")
+            return False
+        cls._stats['buffered'] += len(views)
+        return True
+
+    @classmethod
+    def flush(cls) -> int:
+        """Apply pending view counters to User_Activity. Returns the number of documents written."""
+        try:
+            keys = redis_client.spop(cls.PENDING_KEY, cls.FLUSH_BATCH)
+            if not keys:
+                return 0
+            pipe = redis_client.pipeline(transaction=True)
+            for key in keys:
+                pipe.hgetall(key)
+                pipe.delete(key)
+            counters = [fields for fields in pipe.execute()[::2] if fields]
+        except Exception as e:
+            cls._stats['errors'] += 1
+            logging.error(f"Failed to read view counters: {str(e)}")
+            return 0
+
+        operations, taken = [], []
+        for fields in counters:
+            try:
+                view = json_util.loads(fields['last'])
+                user_id = view.pop('user_id')
+                # A view without its count was still seen at least once
+                view['view_count'] = int(fields.get('count', 1))
+            except (KeyError, ValueError) as e:
+                cls._stats['errors'] += 1
+                logging.warning(f"Dropping malformed view counter {fields}: {str(e)}")
+                continue
+            operations.append(User_Activity._bucket_operation(user_id, view['timestamp'], view))
+            taken.append(fields)
+        if not operations:
+            return 0
+        applied = len(operations)
+        try:
+            db.User_Activity.bulk_write(operations, ordered=True)
+        except BulkWriteError as e:
+            # Ordered, so every write before the first failed one was applied
+            errors = e.details.get('writeErrors')
+            applied = errors[0]['index'] if errors else len(operations)
+            cls._stats['errors'] += 1
+            logging.error(f"Failed to write {len(operations) - applied} of {len(operations)} view counters: {str(e)}")
+            if applied < len(taken):
+                cls._restore(taken[applied:])
+        except Exception as e:
+            # No telling how far the write got; counting views twice beats losing them
+            cls._stats['errors'] += 1
+            logging.error(f"Failed to write {len(operations)} view counters: {str(e)}")
+            cls._restore(taken)
+            return 0
+        if applied:
+            cls._stats['flushes'] += 1
+            cls._stats['documents_written'] += applied
+        return applied
+
+    @classmethod
+    def _restore(cls, counters):
+        """Put counters back after a failed write, merging with views buffered since."""
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for fields in counters:
+                view = json_util.loads(fields['last'])
+                key = f"{cls.KEY_PREFIX}:{view['user_id']}:{view['entity_type']}:{view['entity_id']}:{view['action']}"
+                pipe.hincrby(key, 'count', int(fields.get('count', 1)))
+                pipe.hsetnx(key, 'last', fields['last'])
+                pipe.sadd(cls.PENDING_KEY, key)
+            pipe.execute()
+        except Exception as e:
+            logging.error(f"Lost {len(counters)} view counters: {str(e)}")
+
+    @classmethod
+    def stats(cls):
+        stats = dict(cls._stats)
+        try:
+            stats['pending'] = redis_client.scard(cls.PENDING_KEY)
+        except Exception:
+            stats['pending'] = None
+        return stats
+
+
+class ActivityLogWriter:
+    """
+    Buffers User_Activity writes in-process and applies them from a background
+    thread, one bulk_write per batch. A batch is written once BATCH_SIZE entries
+    are waiting or FLUSH_INTERVAL_SECONDS after its first entry arrived. When the
+    queue is full new entries are dropped (and counted) rather than blocking
+    requests. Whatever is queued is written before the process exits.
+
+    Views go to ViewCounters instead of User_Activity, and this thread also
+    flushes ViewCounters every ViewCounters.FLUSH_INTERVAL_SECONDS. Other
+    workspace and organisation activity is copied to Activity_Feed as well.
+    """
+
+    BATCH_SIZE = int(os.getenv('ACTIVITY_LOG_BATCH_SIZE', 200))
+    FLUSH_INTERVAL_SECONDS = float(os.getenv('ACTIVITY_LOG_FLUSH_SECONDS', 1.0))
+    MAX_QUEUE = int(os.getenv('ACTIVITY_LOG_MAX_QUEUE', 10000))
+    SHUTDOWN_TIMEOUT_SECONDS = 5
+
+    _STOP = object()
+    _queue = None
+    _thread = None
+    _pid = None
+    _lock = threading.Lock()
+    _stats = {'enqueued': 0, 'dropped': 0, 'written': 0, 'batches': 0, 'errors': 0}
+
+    @classmethod
+    def _start(cls):
+        # One queue and thread per process: neither survives gunicorn's fork
+        if cls._pid == os.getpid() and cls._thread.is_alive():
+            return
+        with cls._lock:
+            if cls._pid == os.getpid() and cls._thread.is_alive():
+                return
+            if cls._pid != os.getpid():
+                cls._queue = queue.Queue(maxsize=cls.MAX_QUEUE)
+                atexit.register(cls.stop)
+            cls._thread = threading.Thread(target=cls._run, name='activity-log-writer', daemon=True)
+            cls._pid = os.getpid()
+            cls._thread.start()
+
+    @classmethod
+    def submit(cls, activity) -> bool:
+        """Queue an activity entry without waiting for it to be written."""
+        cls._start()
+        try:
+            cls._queue.put_nowait(activity)
+        except queue.Full:
+            cls._stats['dropped'] += 1
+            return False
+        cls._stats['enqueued'] += 1
+        return True
+
+    @classmethod
+    def _run(cls):
+        q = cls._queue
+        next_view_flush = time.monotonic() + ViewCounters.FLUSH_INTERVAL_SECONDS
+        while True:
+            try:
+                item = q.get(timeout=max(0.0, next_view_flush - time.monotonic()))
+            except queue.Empty:
+                cls._flush_views()
+                next_view_flush = time.monotonic() + ViewCounters.FLUSH_INTERVAL_SECONDS
+                continue
+            if item is cls._STOP:
+                cls._flush_views()
+                q.task_done()
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + cls.FLUSH_INTERVAL_SECONDS
+            while len(batch) < cls.BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = q.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is cls._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            cls._write(batch)
+            for _ in batch:
+                q.task_done()
+            if stop or time.monotonic() >= next_view_flush:
+                cls._flush_views()
+                next_view_flush = time.monotonic() + ViewCounters.FLUSH_INTERVAL_SECONDS
+            if stop:
+                q.task_done()
+                return
+
+    @staticmethod
+    def _flush_views():
+        # The writer thread must outlive any failure here, or activity stops being logged
+        try:
+            ViewCounters.flush()
+        except Exception as e:
+            logging.error(f"View counter flush failed: {str(e)}")
+
+    @classmethod
+    def _write(cls, batch):
+        views = [activity for activity in batch if activity._is_view()]
+        direct = batch if views and not ViewCounters.buffer(views) else [activity for activity in batch if not activity._is_view()]
+        try:
+            if direct:
+                db.User_Activity.bulk_write([activity._operation() for activity in direct], ordered=True)
+            cls._stats['written'] += len(batch)
+            cls._stats['batches'] += 1
+        except Exception as e:
+            cls._stats['errors'] += 1
+            logging.error(f"Failed to write {len(batch)} activity logs: {str(e)}")
+            return
+
+        feed = [User_Activity._feed_document(activity.user_id, activity._event()) for activity in batch if not activity._is_view()]
+        feed = [document for document in feed if document]
+        try:
+            if feed:
+                db.Activity_Feed.insert_many(feed, ordered=False)
+        except Exception as e:
+            logging.warning(f"Failed to write {len(feed)} activity feed entries: {str(e)}")
+
+        try:
+            RecentlyAccessed.record(batch)
+        except Exception as e:
+            logging.warning(f"Failed to update recently accessed entities: {str(e)}")
+
+    @classmethod
+    def flush(cls):
+        """Block until everything queued so far has been written."""
+        if cls._pid == os.getpid():
+            cls._queue.join()
+
+    @classmethod
+    def stop(cls):
+        """Write out the queue and stop the writer thread."""
+        if cls._pid != os.getpid() or not cls._thread.is_alive():
+            return
+        try:
+            cls._queue.put(cls._STOP, timeout=cls.SHUTDOWN_TIMEOUT_SECONDS)
+        except queue.Full:
+            logging.error("Activity log queue still full at shutdown; entries were lost")
+            return
+        cls._thread.join(cls.SHUTDOWN_TIMEOUT_SECONDS)
+
+    @classmethod
+    def stats(cls):
+        stats = dict(cls._stats)
+        stats['queue_depth'] = cls._queue.qsize() if cls._queue is not None and cls._pid == os.getpid() else 0
+        stats['max_queue'] = cls.MAX_QUEUE
+        return stats
@@ -2,8 +2,8 @@ from flask import Response,jsonify
 import json
 from typing import Optional, Dict
 from bson import json_util, ObjectId
-from package.config.slug import slugify
-from package.config.utility import serialize_document
+from package.config.slug import slugify, SlugResolver
+from package.config.utility import serialize_document, count_by, reconcile_counter
 from package import db
 from dotenv import load_dotenv
 import os
@@ -49,9 +49,14 @@ class Workspace:
             'created_By': self.created_By,
             'description': self.description,
             'organisation_id': self.organisation_id,
+            'members_count': 0,
+            'board_count': 0,
             'history': []
         })
+        db.organisation.update_one({'_id': self.organisation_id}, {'$inc': {'workspace_count': 1}})
 
+        # The slug may have been cached as unknown before this workspace existed
+        SlugResolver.invalidate('Workspace', self.slug)
         new_Workspace = db.Workspace.find_one({'_id' : result.inserted_id})
         if new_Workspace:
             return serialize_document(new_Workspace)
@@ -76,7 +81,8 @@ class Workspace:
 
         # CASE B: SEARCH BY SLUG (Specific Resource)
         elif slug:
-            workspace = db.Workspace.find_one({"slug": slug})
+            ws_oid = SlugResolver.resolve('Workspace', slug)
+            workspace = db.Workspace.find_one({'_id': ws_oid}) if ws_oid else None
             if workspace and (not user_id or workspace['_id'] in authorized_workspace_ids):
                 return serialize_document(workspace)
             return None
@@ -96,19 +102,15 @@ class Workspace:
             match_query = { "organisation_id": ObjectId(organisation_id) }
             if user_id:
                 match_query["_id"] = {"$in": authorized_workspace_ids}
-            pipeline = [
-                {"$match": match_query},
-                {"$lookup": {
-                    "from": "User_Workspace",
-                    "localField": "_id",
-                    "foreignField": "workspace_id",
-                    "as": "members"
-                }},
-                {"$addFields": {"members_count": {"$size": "$members"}}},
-                {"$project": {"members": 0}}
-            ]
-            workspaces = db.Workspace.aggregate(pipeline)
-            return serialize_document(list(workspaces))
+            workspaces = list(db.Workspace.find(match_query))
+            # members_count is kept on the workspace; only workspaces from before the
+            # counter existed (until reconcile_counters has run) are counted here
+            missing = [workspace['_id'] for workspace in workspaces if 'members_count' not in workspace]
+            if missing:
+                counts = count_by(db.User_Workspace, 'workspace_id', missing)
+                for workspace in workspaces:
+                    workspace.setdefault('members_count', counts.get(workspace['_id'], 0))
+            return serialize_document(workspaces)
 
         return [] # Default fallback
     
@@ -145,12 +147,21 @@ class Workspace:
             return None
     @staticmethod
     def delete(Workspace_id,user_id):
-        result = db.Workspace.delete_one({'_id': ObjectId(Workspace_id), 'created_By' : ObjectId(user_id)})
-        if result.deleted_count == 1 :
+        deleted = db.Workspace.find_one_and_delete({'_id': ObjectId(Workspace_id), 'created_By' : ObjectId(user_id)}, {'slug': 1, 'organisation_id': 1})
+        if deleted:
+            SlugResolver.invalidate('Workspace', deleted.get('slug'))
+            db.organisation.update_one({'_id': deleted.get('organisation_id')}, {'$inc': {'workspace_count': -1}})
             boardcollection = db.get_collection('Board')
             issuecollection = db.get_collection('Issues')
             boardcollection.delete_many({'workspace': ObjectId(Workspace_id)})
             issuecollection.delete_many({'workspace_id': ObjectId(Workspace_id)})
             return True
         return False
-        
\ No newline at end of file
+
+    @staticmethod
+    def reconcile_counters():
+        """Recount every workspace's members_count and board_count; returns the number of counters corrected."""
+        return (
+            reconcile_counter(db.Workspace, 'members_count', db.User_Workspace, 'workspace_id')
+            + reconcile_counter(db.Workspace, 'board_count', db.Board, 'workspace')
+        )
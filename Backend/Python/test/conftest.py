@@ -0,0 +1,417 @@
+import sys
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from redis.exceptions import ConnectionError, ResponseError
+
+# ==========================================================
+# IN-MEMORY REDIS
+# ==========================================================
+# The test modules replace package.config.redis with a MagicMock before importing
+# the app. Tests that exercise Redis-backed code take the `fake_redis` fixture
+# instead, which swaps every module's `redis_client` for a FakeRedis for the
+# duration of the test.
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+class FakePubSub:
+    def __init__(self, server, ignore_subscribe_messages=False):
+        self.server = server
+        self.handlers = {}
+
+    def subscribe(self, *channels, **handlers):
+        self.server._check()
+        for channel in channels:
+            self.handlers[channel] = None
+        self.handlers.update(handlers)
+        self.server._subscribers.append(self)
+
+    def run_in_thread(self, sleep_time=0, daemon=False, exception_handler=None):
+        # Messages are delivered synchronously by publish(); nothing to poll
+        return MagicMock(name='pubsub-thread')
+
+    def close(self):
+        if self in self.server._subscribers:
+            self.server._subscribers.remove(self)
+
+    def _deliver(self, channel, message):
+        handler = self.handlers.get(channel)
+        if handler is not None:
+            handler({'type': 'message', 'pattern': None, 'channel': channel, 'data': message})
+            return 1
+        return int(channel in self.handlers)
+
+
+class FakePipeline:
+    """Queues commands and runs them at execute(); a transaction runs them under the server lock."""
+
+    def __init__(self, server, transaction=True):
+        self.server = server
+        self.transaction = transaction
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.server, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.commands = []
+
+    def execute(self):
+        self.server._check()
+        commands, self.commands = self.commands, []
+        if self.transaction:
+            with self.server._lock:
+                return [command(*args, **kwargs) for command, args, kwargs in commands]
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class FakeScript:
+    def __init__(self, server, source):
+        self.server = server
+        self.source = source
+
+    def __call__(self, keys=(), args=(), client=None):
+        server = client or self.server
+        server._check()
+        for name, implementation in SCRIPTS.items():
+            module_name, _, constant = name.rpartition('.')
+            module = sys.modules.get(module_name)
+            if module is not None and getattr(module, constant, None) == self.source:
+                with server._lock:
+                    return implementation(server, list(keys), [str(arg) for arg in args])
+        raise ResponseError("NOSCRIPT No matching script")
+
+
+class FakeRedis:
+    """
+    Just enough of a redis-py client (created with decode_responses=True) for the
+    app: strings, sets, hashes, sorted sets, expiry, pipelines, pub/sub and the
+    Lua scripts the app registers (ported to Python in SCRIPTS). Set `down` to
+    make every command raise ConnectionError, like an unreachable server.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.down = False
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+    # --- plumbing ---
+    def _check(self):
+        if self.down:
+            raise ConnectionError("Error 111 connecting to localhost:6379. Connection refused.")
+
+    def _get(self, key, kind):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[0] != kind:
+            raise ResponseError(WRONGTYPE)
+        return entry[1]
+
+    def _create(self, key, kind, empty):
+        value = self._get(key, kind)
+        if value is None:
+            value = empty
+            self.data[key] = (kind, value)
+        return value
+
+    def _drop_if_empty(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[0] != 'string' and not entry[1]:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def _exists(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self, transaction)
+
+    def register_script(self, source):
+        return FakeScript(self, source)
+
+    def ping(self):
+        self._check()
+        return True
+
+    # --- keys ---
+    def delete(self, *keys):
+        self._check()
+        removed = 0
+        for key in keys:
+            if self._exists(key):
+                removed += 1
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return removed
+
+    def exists(self, *keys):
+        self._check()
+        return sum(1 for key in keys if self._exists(key))
+
+    def expire(self, key, seconds):
+        self._check()
+        if not self._exists(key):
+            return False
+        self.expires[key] = time.time() + int(seconds)
+        return True
+
+    def pexpire(self, key, milliseconds):
+        self._check()
+        if not self._exists(key):
+            return False
+        self.expires[key] = time.time() + int(milliseconds) / 1000
+        return True
+
+    def ttl(self, key):
+        self._check()
+        if not self._exists(key):
+            return -2
+        deadline = self.expires.get(key)
+        return -1 if deadline is None else max(0, round(deadline - time.time()))
+
+    # --- strings ---
+    def get(self, key):
+        self._check()
+        return self._get(key, 'string')
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        self._check()
+        exists = self._exists(key)
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.data[key] = ('string', value if isinstance(value, str) else str(value))
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = time.time() + int(ex)
+        elif px is not None:
+            self.expires[key] = time.time() + int(px) / 1000
+        return True
+
+    def incr(self, key, amount=1):
+        self._check()
+        current = self._get(key, 'string')
+        try:
+            value = int(current or 0) + amount
+        except ValueError:
+            raise ResponseError("ERR value is not an integer or out of range")
+        self.data[key] = ('string', str(value))
+        return value
+
+    # --- sets ---
+    def sadd(self, key, *members):
+        self._check()
+        values = self._create(key, 'set', set())
+        added = {str(member) for member in members} - values
+        values.update(added)
+        return len(added)
+
+    def srem(self, key, *members):
+        self._check()
+        values = self._get(key, 'set') or set()
+        removed = {str(member) for member in members} & values
+        values.difference_update(removed)
+        self._drop_if_empty(key)
+        return len(removed)
+
+    def sismember(self, key, member):
+        self._check()
+        return str(member) in (self._get(key, 'set') or set())
+
+    def smembers(self, key):
+        self._check()
+        return set(self._get(key, 'set') or set())
+
+    def scard(self, key):
+        self._check()
+        return len(self._get(key, 'set') or set())
+
+    def spop(self, key, count=None):
+        self._check()
+        values = self._get(key, 'set') or set()
+        popped = [values.pop() for _ in range(min(1 if count is None else count, len(values)))]
+        self._drop_if_empty(key)
+        if count is None:
+            return popped[0] if popped else None
+        return popped
+
+    # --- hashes ---
+    def hset(self, key, field=None, value=None, mapping=None):
+        self._check()
+        fields = self._create(key, 'hash', {})
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(1 for name in items if name not in fields)
+        fields.update({name: item if isinstance(item, str) else str(item) for name, item in items.items()})
+        return added
+
+    def hsetnx(self, key, field, value):
+        self._check()
+        fields = self._create(key, 'hash', {})
+        if field in fields:
+            return False
+        fields[field] = value if isinstance(value, str) else str(value)
+        return True
+
+    def hget(self, key, field):
+        self._check()
+        return (self._get(key, 'hash') or {}).get(field)
+
+    def hgetall(self, key):
+        self._check()
+        return dict(self._get(key, 'hash') or {})
+
+    def hincrby(self, key, field, amount=1):
+        self._check()
+        fields = self._create(key, 'hash', {})
+        value = int(fields.get(field, 0)) + amount
+        fields[field] = str(value)
+        return value
+
+    # --- sorted sets ---
+    def zadd(self, key, mapping, nx=False, xx=False, gt=False, lt=False, ch=False):
+        self._check()
+        members = self._create(key, 'zset', {})
+        added = changed = 0
+        for member, score in mapping.items():
+            member, score = str(member), float(score)
+            if member not in members:
+                if xx:
+                    continue
+                members[member] = score
+                added += 1
+                continue
+            if nx or (gt and score <= members[member]) or (lt and score >= members[member]):
+                continue
+            if members[member] != score:
+                members[member] = score
+                changed += 1
+        self._drop_if_empty(key)
+        return added + changed if ch else added
+
+    def zrem(self, key, *members):
+        self._check()
+        values = self._get(key, 'zset') or {}
+        removed = sum(1 for member in members if values.pop(str(member), None) is not None)
+        self._drop_if_empty(key)
+        return removed
+
+    def _ordered(self, key, reverse=False):
+        values = self._get(key, 'zset') or {}
+        return sorted(values.items(), key=lambda item: (item[1], item[0]), reverse=reverse)
+
+    @staticmethod
+    def _slice(items, start, stop):
+        stop = len(items) + stop if stop < 0 else stop
+        start = max(0, len(items) + start if start < 0 else start)
+        if stop < start:
+            return []
+        return items[start:stop + 1]
+
+    def zrange(self, key, start, end, withscores=False):
+        self._check()
+        items = self._slice(self._ordered(key), start, end)
+        return items if withscores else [member for member, _ in items]
+
+    def zrevrange(self, key, start, end, withscores=False):
+        self._check()
+        items = self._slice(self._ordered(key, reverse=True), start, end)
+        return items if withscores else [member for member, _ in items]
+
+    def zremrangebyrank(self, key, start, end):
+        self._check()
+        items = self._slice(self._ordered(key), start, end)
+        return self.zrem(key, *[member for member, _ in items]) if items else 0
+
+    def zremrangebyscore(self, key, low, high):
+        self._check()
+        low, high = float(low), float(high)
+        items = [member for member, score in self._ordered(key) if low <= score <= high]
+        return self.zrem(key, *items) if items else 0
+
+    def zcount(self, key, low, high):
+        self._check()
+        low, high = float(low), float(high)
+        return sum(1 for _, score in self._ordered(key) if low <= score <= high)
+
+    def zcard(self, key):
+        self._check()
+        return len(self._get(key, 'zset') or {})
+
+    # --- pub/sub ---
+    def pubsub(self, ignore_subscribe_messages=False):
+        self._check()
+        return FakePubSub(self, ignore_subscribe_messages)
+
+    def publish(self, channel, message):
+        self._check()
+        message = message if isinstance(message, str) else str(message)
+        return sum(subscriber._deliver(channel, message) for subscriber in list(self._subscribers))
+
+
+# Python ports of the Lua scripts the app registers, keyed by "module.CONSTANT"
+# of the script source. Scripts run atomically, under the server lock.
+
+def _record_failure(server, keys, args):
+    now_ms, window_ms, cap, member = int(args[0]), int(args[1]), int(args[2]), args[3]
+    for key in keys:
+        server.zremrangebyscore(key, '-inf', now_ms - window_ms)
+        server.zadd(key, {member: now_ms})
+        server.zremrangebyrank(key, 0, -(cap + 1))
+        server.pexpire(key, window_ms)
+    return 1
+
+def _clear_failures(server, keys, args):
+    server.delete(keys[0])
+    for member in server.zrange(keys[1], 0, -1):
+        if member.endswith(args[0]):
+            server.zrem(keys[1], member)
+    return 1
+
+def _rotate_refresh(server, keys, args):
+    current = server.get(keys[0])
+    if current is None:
+        return 0
+    if current == args[0]:
+        server.set(keys[0], args[1], ex=int(args[2]))
+        return 1
+    server.delete(keys[0])
+    return -1
+
+SCRIPTS = {
+    'package.config.auth.RECORD_FAILURE_SCRIPT': _record_failure,
+    'package.config.auth.CLEAR_FAILURES_SCRIPT': _clear_failures,
+    'package.config.auth.ROTATE_REFRESH_SCRIPT': _rotate_refresh,
+}
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """A fresh FakeRedis standing in for `redis_client` in every app module."""
+    server = FakeRedis()
+    for name, module in list(sys.modules.items()):
+        if name.startswith('package.') and hasattr(module, 'redis_client') and not isinstance(module, MagicMock):
+            monkeypatch.setattr(module, 'redis_client', server)
+    return server
@@ -167,4 +167,24 @@ class TestBoardAPI:
         response = client.delete('/board/delete', json=payload, headers=headers)
         
         assert response.status_code == 200
-        assert response.get_json()['message'] == "Deleted Successfully"
\ No newline at end of file
+        assert response.get_json()['message'] == "Deleted Successfully"
+
+    # ----------------- 5. BOARDS IN WORKSPACE ----------------- #
+    def test_board_in_workspace_groups_issues(self):
+        from package.models.board import Board
+        workspace_id = db.Workspace.insert_one({'title': 'WS', 'slug': 'ws-batched'}).inserted_id
+        backlog = db.Board.insert_one({'title': 'Backlog', 'workspace': workspace_id}).inserted_id
+        sprint = db.Board.insert_one({'title': 'Sprint 1', 'workspace': workspace_id}).inserted_id
+        db.Issues.insert_many([
+            {'issueID': 'WS-1', 'title': 'A', 'board_id': backlog},
+            {'issueID': 'WS-2', 'title': 'B', 'board_id': backlog},
+            {'issueID': 'WS-3', 'title': 'C', 'board_id': sprint},
+        ])
+
+        boards = Board.board_in_workspace('ws-batched')
+        issues = {board['title']: [issue['title'] for issue in board['issues']] for board in boards}
+        assert issues == {'Backlog': ['A', 'B'], 'Sprint 1': ['C']}
+
+        counts = Board.board_in_workspace(str(workspace_id), counts_only=True)
+        assert {board['title']: board['issue_count'] for board in counts} == {'Backlog': 2, 'Sprint 1': 1}
+        assert all('issues' not in board for board in counts)
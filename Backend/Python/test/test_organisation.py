@@ -277,4 +277,647 @@ def test_delete_org(mock_perm, mock_org, mock_user_org, mock_publish, client):
 
     response = client.delete('/organisation/delete', json=payload, headers=headers)
 
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+#================================ PERMISSION RESOLVER ====================
+def test_stacked_permission_checks_read_once():
+    from package import db
+    from package.config.permission import PermissionService
+
+    user_id, org_id, ws_id = ObjectId(), ObjectId(), ObjectId()
+    db.Workspace.insert_one({'_id': ws_id, 'slug': 'resolver-ws', 'organisation_id': org_id})
+    db.user_permissions.insert_one({
+        'userId': user_id,
+        'organizations': [{
+            'organizationId': org_id,
+            'role': 'admin',
+            'workspaces': [{'workspaceId': ws_id, 'role': 'viewer'}]
+        }]
+    })
+
+    with app.test_request_context(), \
+        patch.object(db.user_permissions, 'find_one', wraps=db.user_permissions.find_one) as perm_reads, \
+        patch.object(db.Workspace, 'find_one', wraps=db.Workspace.find_one) as slug_reads:
+        assert PermissionService.has_organization_permission(user_id, org_id, 'manage_workspaces')
+        assert PermissionService.has_workspace_permission(user_id, workspace_slug='resolver-ws', permission='view_tasks')
+        assert not PermissionService.has_workspace_permission(user_id, workspace_slug='resolver-ws', permission='delete_tasks')
+        assert PermissionService.get_user_permissions(user_id, organisation_id=org_id, workspace_id=ws_id) == 'admin'
+
+    assert perm_reads.call_count == 1
+    assert slug_reads.call_count == 1
+    
+#================================ EITHER PERMISSION =======================
+@patch('package.flask_CRUD.Workspace.search')
+@patch('package.flask_CRUD.PermissionService.has_workspace_permission')
+@patch('package.flask_CRUD.PermissionService.has_organization_permission')
+def test_either_permission_runs_view_once(mock_org_perm, mock_ws_perm, mock_search, client):
+    mock_org_perm.return_value = False
+    mock_ws_perm.return_value = True
+    mock_search.return_value = {"title": "Workspace"}
+
+    headers = generate_test_token(fake_object_id(), "user")
+    response = client.post('/workspace/search', json={"workspace_id": fake_object_id()}, headers=headers)
+
+    assert response.status_code == 200
+    assert mock_search.call_count == 1
+
+@patch('package.flask_CRUD.Workspace.search')
+@patch('package.flask_CRUD.PermissionService.has_workspace_permission')
+@patch('package.flask_CRUD.PermissionService.has_organization_permission')
+def test_either_permission_denied(mock_org_perm, mock_ws_perm, mock_search, client):
+    mock_org_perm.return_value = False
+    mock_ws_perm.return_value = False
+
+    headers = generate_test_token(fake_object_id(), "user")
+    response = client.post('/workspace/search', json={"slug": "some-workspace"}, headers=headers)
+
+    assert response.status_code == 403
+    mock_search.assert_not_called()
+
+@patch('package.flask_CRUD.Workspace.search')
+@patch('package.flask_CRUD.PermissionService.has_workspace_permission')
+@patch('package.flask_CRUD.PermissionService.has_organization_permission')
+def test_either_permission_workspace_slug_shared_with_an_organisation(mock_org_perm, mock_ws_perm, mock_search, client, fake_redis):
+    from package import db
+    # Anyone can name an organisation after someone else's workspace
+    db.organisation.insert_one({'title': 'Shared', 'slug': 'shared-slug'})
+    db.Workspace.insert_one({'title': 'Shared', 'slug': 'shared-slug', 'organisation_id': ObjectId()})
+    mock_org_perm.return_value = False
+    mock_ws_perm.return_value = True
+    mock_search.return_value = {"title": "Workspace"}
+
+    headers = generate_test_token(fake_object_id(), "user")
+    response = client.post('/workspace/search', json={"slug": "shared-slug"}, headers=headers)
+    assert response.status_code == 200
+    assert mock_ws_perm.call_args.args[3] == 'shared-slug'
+    mock_search.assert_called_once()
+    
+#================================ PERMISSION CACHE ========================
+def test_permission_cache_invalidated_on_role_update(fake_redis):
+    from package import db
+    from package.config.permission import PermissionService, PermissionCache
+
+    user_id, org_id = ObjectId(), ObjectId()
+    db.user_permissions.insert_one({
+        'userId': user_id,
+        'organizations': [{'organizationId': org_id, 'role': 'member', 'workspaces': []}]
+    })
+
+    hits = PermissionCache.stats()['hits']
+    with app.test_request_context():
+        assert PermissionService.get_user_permissions(user_id, organisation_id=org_id) == 'member'
+    with app.test_request_context():
+        assert PermissionService.get_user_permissions(user_id, organisation_id=org_id) == 'member'
+    assert PermissionCache.stats()['hits'] == hits + 1
+
+    with app.test_request_context():
+        assert PermissionService.update_user_role(user_id, org_id, new_role='admin')
+        assert PermissionService.get_user_permissions(user_id, organisation_id=org_id) == 'admin'
+    
+#================================ PERMISSION MASKS ========================
+def test_role_masks_match_permission_tables():
+    from package.config.permission import (
+        ORGANIZATION_PERMISSIONS, WORKSPACE_PERMISSIONS,
+        ORGANIZATION_ROLE_MASKS, WORKSPACE_ROLE_MASKS,
+        permission_mask, permission_names
+    )
+
+    for table, masks in ((ORGANIZATION_PERMISSIONS, ORGANIZATION_ROLE_MASKS), (WORKSPACE_PERMISSIONS, WORKSPACE_ROLE_MASKS)):
+        for role, permissions in table.items():
+            assert set(permission_names(masks[role])) == set(permissions)
+
+    required = permission_mask(['create_tasks', 'delete_tasks'])
+    assert WORKSPACE_ROLE_MASKS['developer'] & required == required
+    assert WORKSPACE_ROLE_MASKS['viewer'] & required != required
+    unknown = permission_mask('not_a_permission')
+    assert WORKSPACE_ROLE_MASKS['admin'] & unknown != unknown
+    
+#================================ PERMISSION GRANTS =======================
+def test_permission_grants_migrate_and_dual_write():
+    from package import db
+    from package.config.permission import PermissionService, PermissionGrants
+
+    user_id, org_id, ws_id = ObjectId(), ObjectId(), ObjectId()
+    db.user_permissions.insert_one({
+        'userId': user_id,
+        'organizations': [{
+            'organizationId': org_id,
+            'role': 'admin',
+            'workspaces': [{'workspaceId': ws_id, 'role': 'developer'}]
+        }]
+    })
+
+    assert PermissionGrants.migrate() >= 2
+    for scope in ({'organisation_id': org_id}, {'workspace_id': ws_id}, {'organisation_id': org_id, 'workspace_id': ws_id}):
+        assert PermissionGrants.lookup(user_id, **scope) == PermissionService._resolve_role(user_id, **scope)
+
+    assert PermissionService.update_user_role(user_id, org_id, new_role='member')
+    assert PermissionGrants.lookup(user_id, organisation_id=org_id) == 'member'
+
+    PermissionService.remove_user_from_organization(user_id, org_id)
+    assert db.permission_grants.count_documents({'userId': user_id}) == 0
+    
+#================================ PERMISSION CLAIMS =======================
+def test_permission_claims_trusted_until_revoked(fake_redis):
+    from flask import g
+    from package import db
+    from package.config.permission import PermissionService, PermissionClaims
+
+    user_id, org_id, ws_id = ObjectId(), ObjectId(), ObjectId()
+    db.user_permissions.insert_one({
+        'userId': user_id,
+        'organizations': [{
+            'organizationId': org_id,
+            'role': 'member',
+            'workspaces': [{'workspaceId': ws_id, 'role': 'viewer'}]
+        }]
+    })
+
+    with patch.object(PermissionClaims, 'ENABLED', True):
+        claims = PermissionClaims.build(user_id)
+        assert claims['w'] == {str(ws_id): 'viewer'}
+
+        with app.test_request_context(), \
+            patch.object(db.user_permissions, 'find_one', wraps=db.user_permissions.find_one) as perm_reads:
+            g.user_id, g.permission_claims = str(user_id), claims
+            assert PermissionService.has_workspace_permission(str(user_id), str(ws_id), 'view_tasks')
+            assert not PermissionService.has_workspace_permission(str(user_id), str(ws_id), 'delete_tasks')
+            assert perm_reads.call_count == 1  # only the write permission went to Mongo
+
+        PermissionService.remove_user_from_organization(user_id, org_id)
+
+        with app.test_request_context():
+            g.user_id, g.permission_claims = str(user_id), claims
+            assert not PermissionService.has_workspace_permission(str(user_id), str(ws_id), 'view_tasks')
+    
+def test_permission_claims_fail_secure_without_redis(fake_redis):
+    from flask import g
+    from package import db
+    from package.config.permission import PermissionService, PermissionClaims, PermissionsUnavailable
+
+    user_id, org_id, ws_id = ObjectId(), ObjectId(), ObjectId()
+    db.user_permissions.insert_one({
+        'userId': user_id,
+        'organizations': [{'organizationId': org_id, 'role': 'member', 'workspaces': [{'workspaceId': ws_id, 'role': 'viewer'}]}]
+    })
+
+    with patch.object(PermissionClaims, 'ENABLED', True):
+        fake_redis.down = True
+        assert PermissionClaims.build(user_id) is None
+        # Old claims can't be invalidated, so the write doesn't happen
+        with pytest.raises(PermissionsUnavailable):
+            PermissionService.remove_user_from_organization(user_id, org_id)
+        assert db.user_permissions.find_one({'userId': user_id})['organizations']
+
+        fake_redis.down = False
+        claims = PermissionClaims.build(user_id)
+        assert fake_redis.ttl(f"permissions:version:{user_id}") > 0
+        # Revoked behind Redis' back, then the version is evicted: nothing confirms the claims any more
+        db.user_permissions.update_one({'userId': user_id}, {'$set': {'organizations.0.workspaces': []}})
+        fake_redis.delete(f"permissions:version:{user_id}")
+
+        with app.test_request_context():
+            g.user_id, g.permission_claims = str(user_id), claims
+            assert not PermissionService.has_workspace_permission(str(user_id), str(ws_id), 'view_tasks')
+        assert PermissionClaims.build(user_id)['v'] != claims['v']
+
+        fake_redis.down = True
+        with app.test_request_context():
+            g.user_id, g.permission_claims = str(user_id), claims
+            assert not PermissionService.has_workspace_permission(str(user_id), str(ws_id), 'view_tasks')
+
+#================================ SLUG RESOLVER ===========================
+def test_slug_resolver_caches_misses_until_invalidated(fake_redis):
+    from package import db
+    from package.config.slug import SlugResolver
+
+    with patch.object(db.organisation, 'find_one', wraps=db.organisation.find_one) as slug_reads:
+        assert SlugResolver.resolve('organisation', 'resolver-org') is None
+        assert SlugResolver.resolve('organisation', 'resolver-org') is None
+        assert slug_reads.call_count == 1
+
+        org_id = db.organisation.insert_one({'title': 'Resolver', 'slug': 'resolver-org'}).inserted_id
+        SlugResolver.invalidate('organisation', 'resolver-org')
+        assert SlugResolver.resolve('organisation', 'resolver-org') == org_id
+        assert SlugResolver.resolve('organisation', 'resolver-org') == org_id
+        assert slug_reads.call_count == 2
+
+    db.organisation.insert_one({'title': 'No slug'})
+    assert SlugResolver.resolve('organisation', None) is None
+    assert SlugResolver.resolve('organisation', '') is None
+    assert not [key for key in fake_redis.data if key.endswith((':None', ':'))]
+    
+#================================ METRICS =================================
+def test_metrics_require_operator(client, fake_redis):
+    from package.config.security import SecurityConfig
+
+    operator, user = fake_object_id(), fake_object_id()
+    assert client.get('/metrics').status_code == 401
+    with patch.object(SecurityConfig, 'OPERATOR_USER_IDS', frozenset({operator})):
+        assert client.get('/metrics', headers=generate_test_token(user)).status_code == 403
+        response = client.get('/metrics', headers=generate_test_token(operator))
+    assert response.status_code == 200
+    assert 'activity_log' in response.get_json()
+
+@pytest.mark.parametrize('route', ['/backfill_permission_grants', '/backfill_activity_history', '/reconcile_counters'])
+def test_maintenance_routes_require_operator(route, client):
+    from package.config.security import SecurityConfig
+
+    with patch.object(SecurityConfig, 'OPERATOR_USER_IDS', frozenset()):
+        assert client.post(route, headers=generate_test_token(fake_object_id())).status_code == 403
+
+#================================ BATCH PERMISSIONS =======================
+def test_batch_permissions(client):
+    from package import db
+
+    user_id, org_id, ws_id = ObjectId(), ObjectId(), ObjectId()
+    db.user_permissions.insert_one({
+        'userId': user_id,
+        'organizations': [{
+            'organizationId': org_id,
+            'role': 'member',
+            'workspaces': [{'workspaceId': ws_id, 'role': 'developer'}]
+        }]
+    })
+    headers = generate_test_token(user_id, "user")
+
+    response = client.post('/permissions/batch', json={}, headers=headers)
+    assert response.status_code == 200
+    matrix = response.get_json()
+    assert matrix['organizations'][str(org_id)]['role'] == 'member'
+    assert matrix['workspaces'][str(ws_id)]['organisation_id'] == str(org_id)
+
+    checks = [
+        {'permission': 'edit_tasks', 'workspace_id': str(ws_id)},
+        {'permission': 'manage_workspace', 'workspace_id': str(ws_id)},
+        {'permission': 'view_tasks', 'workspace_id': fake_object_id()},
+    ]
+    with patch.object(db.user_permissions, 'find_one', wraps=db.user_permissions.find_one) as perm_reads:
+        response = client.post('/permissions/batch', json={'checks': checks}, headers=headers)
+    assert response.status_code == 200
+    assert [result['granted'] for result in response.get_json()['results']] == [True, False, False]
+    assert perm_reads.call_count == 1
+
+#================================ ACTIVITY LOG ============================
+def test_activity_log_writer_batches_in_background(fake_redis):
+    from package import db
+    from package.models.user_relationships import User_Activity, ActivityLogWriter, ViewCounters
+
+    user_id, ws_id = ObjectId(), ObjectId()
+    with patch.object(ActivityLogWriter, 'FLUSH_INTERVAL_SECONDS', 0.05), \
+        patch.object(User_Activity, 'MAX_BUCKET_EVENTS', 10):
+        batches = ActivityLogWriter.stats()['batches']
+        for _ in range(3):
+            assert User_Activity(user_id, "View Workspace", "Workspace", ws_id).Create_User_Activity_Log()
+        for _ in range(25):
+            User_Activity(user_id, "Create Board", "Board", ws_id, workspace_id=ws_id).Create_User_Activity_Log()
+        ActivityLogWriter.flush()
+        # Views are coalesced in Redis and written with the next counter flush
+        ViewCounters.flush()
+
+    assert ActivityLogWriter.stats()['batches'] - batches <= 2
+    assert ActivityLogWriter.stats()['queue_depth'] == 0
+    buckets = list(db.User_Activity.find({'user_id': user_id}).sort('_id', 1))
+    assert [bucket['count'] for bucket in buckets] == [10, 10, 6]
+    assert len({bucket['day'] for bucket in buckets}) == 1
+    events = [event for bucket in buckets for event in bucket['events']]
+    assert sum(event.get('view_count', 0) for event in events if event['action'] == "View Workspace") == 3
+    assert all(bucket['expires_at'] > bucket['day'] for bucket in buckets)
+
+def test_activity_log_rules_by_endpoint(client):
+    import json
+    headers = generate_test_token(fake_object_id(), "user")
+
+    # Unregistered endpoints return before the response body is parsed
+    with patch('package.flask_CRUD.User_Activity') as activity, \
+        patch.object(app.response_class, 'get_json', side_effect=AssertionError("parsed response")):
+        response = client.get('/permissions/schema', headers=headers)
+    assert response.status_code == 200 and json.loads(response.data)['bits']
+    activity.assert_not_called()
+
+    with patch('package.flask_CRUD.User_Activity') as activity, \
+        patch('package.flask_CRUD.Workspace.search', return_value={'title': 'Docs'}), \
+        patch('package.config.utility.PermissionService.has_organization_permission', return_value=True):
+        response = client.post('/workspace/search', json={'slug': 'docs'}, headers=headers)
+    assert response.status_code == 200
+    kwargs = activity.call_args.kwargs
+    assert (kwargs['action'], kwargs['entity_type'], kwargs['entity_id']) == ("View Workspace", "Workspace", 'docs')
+    activity.return_value.Create_User_Activity_Log.assert_called_once()
+
+def test_bounded_histories():
+    from package import db
+    from package.models.user_relationships import User_Activity
+
+    user_id, board_id = ObjectId(), ObjectId()
+    query = {'user_id': user_id, 'entity_type': 'Board', 'entity_id': board_id, 'action': 'Create Board'}
+    now = datetime.now(timezone.utc)
+    db.User_Activity.insert_many([{**query, 'timestamp': now - timedelta(days=i)} for i in range(25)])
+    db.User_Activity.insert_one({**query, 'timestamp': now - timedelta(days=User_Activity.RETENTION_DAYS + 1)})
+    assert User_Activity.migrate_to_buckets(batch_size=10) >= 25
+    assert db.User_Activity.count_documents({'user_id': user_id, 'day': {'$exists': False}}) == 0
+    assert db.User_Activity.count_documents({'user_id': user_id}) == 25
+
+    assert User_Activity.clear_old_logs(days=20) == 4
+    assert db.User_Activity.count_documents({'user_id': user_id}) == 21
+    oldest = db.User_Activity.find_one({'user_id': user_id}, sort=[('day', 1)])
+    newer = db.User_Activity.find({'$or': [{'day': {'$gt': oldest['day']}}, {'day': oldest['day'], '_id': {'$gt': oldest['_id']}}]})
+    User_Activity.clear_logs_by_limit(sum(bucket['count'] for bucket in newer) - 1)
+    assert db.User_Activity.count_documents({'user_id': user_id}) == 20
+
+def test_migrate_to_buckets_reruns_after_a_crash():
+    from package import db
+    from package.models.user_relationships import User_Activity
+
+    user_id, board_id = ObjectId(), ObjectId()
+    now = datetime.now(timezone.utc)
+    db.User_Activity.insert_many([
+        {'user_id': user_id, 'entity_type': 'Board', 'entity_id': board_id, 'action': action, 'timestamp': now - timedelta(minutes=i)}
+        for i, action in enumerate(['Create Board', 'View Board', 'View Board'])
+    ])
+
+    # Written, then stopped before the legacy entries were deleted
+    with patch.object(db.User_Activity, 'delete_many', side_effect=RuntimeError("stopped")):
+        with pytest.raises(RuntimeError):
+            User_Activity.migrate_to_buckets()
+    User_Activity.migrate_to_buckets()
+
+    assert db.User_Activity.count_documents({'user_id': user_id, 'day': {'$exists': False}}) == 0
+    assert sum(bucket['count'] for bucket in db.User_Activity.find({'user_id': user_id})) == 3
+
+    # Run again, with one entry come back from a restored backup
+    bucket = db.User_Activity.find_one({'user_id': user_id})
+    restored = bucket['events'][0]
+    db.User_Activity.insert_one({'_id': restored['_id'], 'user_id': user_id, 'entity_type': 'Board', 'entity_id': board_id,
+                                 'action': restored['action'], 'timestamp': restored['timestamp']})
+    assert User_Activity.migrate_to_buckets() == 0
+    assert User_Activity.migrate_to_buckets() == 0
+    assert db.User_Activity.count_documents({'user_id': user_id}) == 1
+    assert sum(bucket['count'] for bucket in db.User_Activity.find({'user_id': user_id})) == 3
+    assert [log['action'] for log in User_Activity.get_logs_by_user(user_id)] == ['Create Board', 'View Board', 'View Board']
+    assert all(log['user_id'] == user_id for log in User_Activity.get_logs_by_entity('Board', board_id))
+    assert User_Activity.get_frequently_accessed_entities(user_id, 'Board') == [{'_id': str(board_id), 'count': 3}]
+
+def test_request_capture_is_lazy_and_capped():
+    from flask import request
+    from package.config.utility import RequestCapture
+
+    with app.test_request_context('/workspace/search?page=2', method='POST', json={'slug': 'docs'},
+                                  headers={'User-Agent': 'pytest'}):
+        with patch.object(type(request._get_current_object()), 'get_json') as get_json:
+            captured = RequestCapture(request)
+            assert captured['path'] == '/workspace/search'
+            assert captured['args'] == {'page': '2'}
+            get_json.assert_not_called()
+        assert captured['json'] == {'slug': 'docs'}
+        assert captured['headers'].get('User-Agent') == 'pytest'
+
+    big = {'attachment': 'x' * (RequestCapture.MAX_JSON_BYTES + 1)}
+    with app.test_request_context('/issue/import', method='POST', json=big):
+        assert RequestCapture(request).get('json') == {}
+
+def test_recently_accessed_index(fake_redis):
+    from package import db
+    from package.models.user_relationships import User_Activity, RecentlyAccessed
+
+    user_id = ObjectId()
+    orgs = [db.organisation.insert_one({'title': f'Recent {i}', 'slug': f'recent-{i}'}).inserted_id for i in range(3)]
+    now = datetime.now(timezone.utc)
+    db.User_Activity.insert_many([
+        {'user_id': user_id, 'entity_type': 'organisation', 'entity_id': orgs[0], 'action': 'View Organisation', 'timestamp': now - timedelta(hours=2)},
+        {'user_id': user_id, 'entity_type': 'organisation', 'entity_id': 'recent-1', 'action': 'View Organisation', 'timestamp': now - timedelta(hours=1)},
+    ])
+    User_Activity.migrate_to_buckets()
+
+    # Cold: rebuilt from the activity log
+    recent = User_Activity.get_last_accessed_entities(user_id, 'organisation', 5)
+    assert [doc['_id'] for doc in recent] == [str(orgs[1]), str(orgs[0])]
+    assert recent[0]['lastAccessed']
+
+    # Warm: only the sorted set and one $in fetch
+    RecentlyAccessed.record([User_Activity(user_id, 'View Organisation', 'organisation', orgs[2])])
+    with patch.object(db.User_Activity, 'aggregate', side_effect=AssertionError("read the log")):
+        recent = User_Activity.get_last_accessed_entities(user_id, 'organisation', 2)
+    assert [doc['_id'] for doc in recent] == [str(orgs[2]), str(orgs[1])]
+
+    # Set and marker expired: a new view alone doesn't pass for the full history
+    fake_redis.delete(f"recent:{user_id}:organisation", f"recent:{user_id}:organisation:seeded")
+    RecentlyAccessed.record([User_Activity(user_id, 'View Organisation', 'organisation', orgs[2])])
+    recent = User_Activity.get_last_accessed_entities(user_id, 'organisation', 5)
+    assert [doc['_id'] for doc in recent] == [str(orgs[2]), str(orgs[1]), str(orgs[0])]
+
+def test_view_counters_coalesce_views(fake_redis):
+    from package import db
+    from package.models.user_relationships import User_Activity, ViewCounters, ActivityLogWriter
+
+    user_id, ws_id = ObjectId(), ObjectId()
+    assert ViewCounters.buffer([User_Activity(user_id, "View Workspace", "Workspace", ws_id) for _ in range(3)])
+    assert ViewCounters.buffer([User_Activity(user_id, "View Workspace", "Workspace", 'docs-slug')])
+    assert ViewCounters.stats()['pending'] == 2
+    assert db.User_Activity.count_documents({'user_id': user_id}) == 0
+
+    with patch.object(db.User_Activity, 'bulk_write', wraps=db.User_Activity.bulk_write) as bulk_write:
+        assert ViewCounters.flush() == 2
+    assert bulk_write.call_count == 1
+    assert ViewCounters.flush() == 0
+
+    bucket = db.User_Activity.find_one({'user_id': user_id})
+    assert bucket['count'] == 2
+    assert {event['entity_id']: event['view_count'] for event in bucket['events']} == {ws_id: 3, 'docs-slug': 1}
+
+    # A counter missing its view is dropped, one missing its count still counts once
+    other = ObjectId()
+    ViewCounters.buffer([User_Activity(user_id, "View Workspace", "Workspace", other)])
+    key = f"views:{user_id}:Workspace:{other}:View Workspace"
+    fake_redis.data[key][1].pop('count')
+    fake_redis.hset('views:broken', 'count', 4)
+    fake_redis.sadd(ViewCounters.PENDING_KEY, 'views:broken')
+    assert ViewCounters.flush() == 1
+    assert ViewCounters.stats()['pending'] == 0
+    bucket = db.User_Activity.find_one({'user_id': user_id})
+    assert {event['entity_id']: event['view_count'] for event in bucket['events']}[other] == 1
+
+    # A write failing partway puts back only the counters it didn't apply
+    from pymongo.errors import BulkWriteError
+    ws_ids = [ObjectId() for _ in range(3)]
+    for i, ws in enumerate(ws_ids):
+        ViewCounters.buffer([User_Activity(user_id, "View Workspace", "Workspace", ws)] * (i + 1))
+    real_bulk_write = db.User_Activity.bulk_write
+
+    def fail_at_second(operations, ordered=True):
+        real_bulk_write(operations[:1], ordered=True)
+        raise BulkWriteError({'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}], 'nModified': 1})
+
+    with patch.object(db.User_Activity, 'bulk_write', side_effect=fail_at_second):
+        assert ViewCounters.flush() == 1
+    assert ViewCounters.stats()['pending'] == 2
+    assert ViewCounters.flush() == 2
+
+    counts = {}
+    for bucket in db.User_Activity.find({'user_id': user_id}):
+        for event in bucket['events']:
+            if event['entity_id'] in ws_ids:
+                counts[event['entity_id']] = counts.get(event['entity_id'], 0) + event['view_count']
+    assert counts == {ws: i + 1 for i, ws in enumerate(ws_ids)}
+
+    # A flush that blows up doesn't take the writer thread with it
+    with patch.object(ViewCounters, 'flush', side_effect=RuntimeError("boom")):
+        ActivityLogWriter._flush_views()
+
+@patch('package.flask_CRUD.PermissionService.has_workspace_permission', return_value=True)
+def test_workspace_activity_feed_pages_by_keyset(mock_ws_perm, client):
+    from package import db
+    from package.models.user_relationships import User_Activity, ActivityLogWriter
+
+    user_id, ws_id, org_id = ObjectId(), ObjectId(), ObjectId()
+    start = datetime.now(timezone.utc).replace(microsecond=0)
+    # Pairs share a timestamp, so pages must also break ties on _id
+    for i in range(10):
+        User_Activity(user_id, "Create Board", "Board", ObjectId(), timestamp=start - timedelta(seconds=i // 2),
+                      metadata={'title': f'Board {i}'}, workspace_id=ws_id, organisation_id=org_id).Create_User_Activity_Log()
+    User_Activity(user_id, "View Workspace", "Workspace", ws_id, workspace_id=ws_id).Create_User_Activity_Log()
+    ActivityLogWriter.flush()
+    assert db.Activity_Feed.count_documents({'workspace_id': ws_id}) == 10
+
+    headers = generate_test_token(user_id)
+    seen, cursor = [], None
+    while True:
+        response = client.post('/workspace/activity', json={'workspace_id': str(ws_id), 'limit': 4, 'cursor': cursor}, headers=headers)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page['data']) <= 4
+        assert all('metadata' not in entry for entry in page['data'])
+        seen += page['data']
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert len(seen) == 10
+    assert len({entry['_id'] for entry in seen}) == 10
+    assert [entry['timestamp'] for entry in seen] == sorted((entry['timestamp'] for entry in seen), reverse=True)
+
+    page = User_Activity.get_logs_by_organisation(org_id, limit=2, include_metadata=True)
+    # Board 0 and Board 1 tie on timestamp; the later _id comes first
+    assert page['data'][0]['metadata'] == {'title': 'Board 1'}
+    assert page['next_cursor']
+
+    response = client.post('/workspace/activity', json={'workspace_id': str(ws_id), 'cursor': 'not-a-cursor'}, headers=headers)
+    assert response.status_code == 400
+
+def test_activity_feed_scopes_from_logged_requests(client):
+    from package import db
+    from package.models.user_relationships import User_Activity, ActivityLogWriter
+
+    user_id, org_id, ws_id, board_id = fake_object_id(), ObjectId(), ObjectId(), fake_object_id()
+    headers = {**generate_test_token(user_id), 'User-Agent': 'secret-agent'}
+    with patch('package.flask_CRUD.Board.Update', return_value={'title': 'Renamed'}), \
+        patch('package.flask_CRUD.Board.delete', return_value=True), \
+        patch('package.flask_CRUD.Workspace.Update', return_value={'title': 'Docs'}), \
+        patch('package.flask_CRUD.Organisation') as organisation, \
+        patch('package.flask_CRUD.User_Organisation.Users_in_Organisation', return_value={'results': []}), \
+        patch('package.flask_CRUD.publish_event'), \
+        patch('package.config.utility.PermissionService.has_workspace_permission', return_value=True), \
+        patch('package.config.utility.PermissionService.get_user_permissions', return_value='admin'):
+        assert client.patch('/board/update', json={'user_id': user_id, 'board_id': board_id, 'workspace_id': str(ws_id), 'title': 'Renamed'}, headers=headers).status_code == 200
+        assert client.delete('/board/delete', json={'user_id': user_id, 'board_id': board_id, 'workspace': str(ws_id)}, headers=headers).status_code == 200
+        assert client.patch('/workspace/update', json={'workspace_id': str(ws_id), 'title': 'Docs'}, headers=headers).status_code == 200
+        organisation.delete.return_value = True
+        assert client.delete('/organisation/delete', json={'organisation_id': str(org_id)}, headers=headers).status_code == 200
+    ActivityLogWriter.flush()
+
+    page = User_Activity.get_logs_by_workspace(ws_id, include_metadata=True)
+    assert [entry['action'] for entry in page['data']] == ["Update Workspace", "Delete Board", "Update Board"]
+    assert page['data'][2]['metadata']['update_fields'] == {'title': 'Renamed'}
+    # Other members see what was done, not where from
+    assert not {'ip_address', 'user_agent', 'device_info'} & {key for entry in page['data'] for key in entry['metadata']}
+    assert db.Activity_Feed.find_one({'workspace_id': ws_id, 'action': "Update Board"})['metadata']['user_agent'] == 'secret-agent'
+
+    page = User_Activity.get_logs_by_organisation(org_id)
+    assert [(entry['action'], entry['entity_id']) for entry in page['data']] == [("Delete Organisation", str(org_id))]
+
+def test_organisation_activity_reads_the_checked_organisation(client):
+    from package.models.user_relationships import User_Activity, ActivityLogWriter
+
+    user_id, own_org, other_org = ObjectId(), ObjectId(), ObjectId()
+    workspaces = {own_org: ObjectId(), other_org: ObjectId()}
+    for org_id, ws_id in workspaces.items():
+        User_Activity(user_id, "Create Workspace", "Workspace", ws_id, organisation_id=org_id).Create_User_Activity_Log()
+    ActivityLogWriter.flush()
+
+    def allowed(user, org_id, permission, org_slug):
+        return org_id == str(own_org)
+
+    with patch('package.config.utility.PermissionService.has_organization_permission', side_effect=allowed):
+        response = client.post('/organisation/activity', json={'org_id': str(own_org), 'organisation_id': str(other_org)},
+                               headers=generate_test_token(user_id))
+    assert response.status_code == 200
+    assert [entry['entity_id'] for entry in response.get_json()['data']] == [str(workspaces[own_org])]
+
+def test_dashboard_organisations_in_fixed_reads():
+    from package import db
+    from package.models.organisation import Organisation
+    from package.models.user_relationships import RecentlyAccessed
+
+    user_id = ObjectId()
+    orgs = [db.organisation.insert_one({'title': f'Dashboard {i}', 'slug': f'dashboard-{i}'}).inserted_id for i in range(3)]
+    db.User_Organisation.insert_many([{'user_id': user_id, 'organisation_id': org_id} for org_id in orgs])
+    db.Workspace.insert_many([{'title': f'WS {i}', 'slug': f'dashboard-ws-{i}', 'organisation_id': orgs[0]} for i in range(2)])
+    db.user_permissions.insert_one({'userId': user_id, 'organizations': [
+        {'organizationId': orgs[0], 'role': 'admin', 'workspaces': []},
+        {'organizationId': orgs[1], 'role': 'member', 'workspaces': []}
+    ]})
+    accessed_at = datetime.now(timezone.utc)
+
+    with patch.object(RecentlyAccessed, 'latest', return_value=[(orgs[1], accessed_at)]), \
+        patch.object(db.Workspace, 'count_documents', side_effect=AssertionError("counted per organisation")), \
+        patch('package.models.organisation.PermissionService.get_user_permissions', side_effect=AssertionError("role read per organisation")):
+        result = {org['_id']: org for org in Organisation.organisation(user_id)}
+
+    assert set(result) == {str(org_id) for org_id in orgs}
+    assert [result[str(org_id)]['workspace_count'] for org_id in orgs] == [2, 0, 0]
+    assert [result[str(org_id)]['User_role'] for org_id in orgs] == ['admin', 'member', None]
+    assert result[str(orgs[1])]['lastAccessed'] == {'timestamp': accessed_at.isoformat(), 'title': 'Dashboard 1'}
+    assert result[str(orgs[0])]['lastAccessed'] is None
+    assert Organisation.organisation(ObjectId()) == []
+
+def test_stored_counters_follow_writes_and_reconcile():
+    from package import db
+    from package.models.organisation import Organisation
+    from package.models.workspace import Workspace
+    from package.models.board import Board
+    from package.models.user_relationships import User_Workspace, User_Organisation
+
+    owner, member = ObjectId(), ObjectId()
+    now = datetime.now(timezone.utc)
+    org = Organisation('Counted', now, now, {}, '', owner, None, '#fff').create_organisation()
+    org_id = ObjectId(org['_id'])
+    assert User_Organisation.create_User_Organisation(owner, org_id, now)['success']
+    assert User_Organisation.create_User_Organisation(member, org_id, now)['success']
+    workspace = Workspace('Counted WS', now, {}, '', org_id, owner, None).create_Workspace()
+    ws_id = ObjectId(workspace['_id'])
+    Workspace('Counted WS 2', now, {}, '', org_id, owner, None).create_Workspace()
+    assert User_Workspace.create_User_Workspace(ws_id, owner, 'admin', now)
+    assert User_Workspace.create_User_Workspace(ws_id, member, 'member', now)
+    board = Board('Backlog', 'Backlog', ObjectId(owner), now, ws_id).create_board()
+    Board('Sprint', 'Backlog', ObjectId(owner), now, ws_id).create_board()
+
+    assert User_Workspace.revoke_User_Workspace(ws_id, member)
+    assert User_Organisation.revoke_User_Organisation(org_id, member)['success']
+    assert Board.delete(board['_id'], owner)
+
+    stored_org = db.organisation.find_one({'_id': org_id})
+    assert (stored_org['workspace_count'], stored_org['members_count']) == (2, 1)
+    stored_ws = db.Workspace.find_one({'_id': ws_id})
+    assert (stored_ws['members_count'], stored_ws['board_count']) == (1, 1)
+
+    # Listings read the stored count instead of joining User_Workspace
+    with patch.object(db.User_Workspace, 'aggregate', side_effect=AssertionError("counted members")):
+        listed = {ws['_id']: ws for ws in Workspace.search(organisation_id=org_id)}
+    assert listed[str(ws_id)]['members_count'] == 1
+
+    db.organisation.update_one({'_id': org_id}, {'$set': {'workspace_count': 7}, '$unset': {'members_count': ''}})
+    db.Workspace.update_one({'_id': ws_id}, {'$inc': {'board_count': 3}})
+    assert Organisation.reconcile_counters() >= 2
+    assert Workspace.reconcile_counters() >= 1
+    stored_org = db.organisation.find_one({'_id': org_id})
+    assert (stored_org['workspace_count'], stored_org['members_count']) == (2, 1)
+    assert db.Workspace.find_one({'_id': ws_id})['board_count'] == 1
+    assert Organisation.reconcile_counters() == 0
@@ -177,4 +177,271 @@ class TestUserAPI:
         response = client.post('/auth/refresh')
 
         assert response.status_code == 200
-        assert response.get_json()['token'] == "new_access_token"
\ No newline at end of file
+        assert response.get_json()['token'] == "new_access_token"
+
+    def test_brute_force_falls_back_to_mongo(self, fake_redis):
+        from package.config.auth import AuthManager
+
+        with app.app_context():
+            for _ in range(AuthManager.MAX_LOGIN_ATTEMPTS):
+                assert not AuthManager.check_brute_force("window_user", "10.0.1.1")
+                assert AuthManager.record_failed_attempt("window_user", "10.0.1.1")
+            assert AuthManager.check_brute_force("window_user", "10.0.1.2")
+            assert fake_redis.zcard("failed_logins:user:window_user") == AuthManager.MAX_LOGIN_ATTEMPTS
+            assert AuthManager.clear_failed_attempts("window_user", "10.0.1.1")
+            assert not AuthManager.check_brute_force("window_user", "10.0.1.2")
+
+            fake_redis.down = True
+            for _ in range(AuthManager.MAX_LOGIN_ATTEMPTS):
+                assert not AuthManager.check_brute_force("locked_user", "10.0.0.1")
+                assert AuthManager.record_failed_attempt("locked_user", "10.0.0.1")
+            assert AuthManager.check_brute_force("locked_user", "10.0.0.2")
+
+            assert AuthManager.clear_failed_attempts("locked_user", "10.0.0.1")
+            assert AuthManager.check_brute_force("other_user", "10.0.0.1") is False
+
+    def test_login_success_clears_its_failures_from_the_ip_window(self, fake_redis):
+        from package.config.auth import AuthManager
+        from package.models.user import User
+
+        ip = "10.0.2.1"
+        with app.app_context():
+            AuthManager.record_failed_attempt("nat_neighbour", ip)
+            for _ in range(AuthManager.MAX_LOGIN_ATTEMPTS - 2):
+                AuthManager.record_failed_attempt("nat_user", ip)
+            assert AuthManager.failed_attempts("other_user", ip) == AuthManager.MAX_LOGIN_ATTEMPTS - 1
+
+            user = {'_id': ObjectId(), 'username': 'nat_user', 'password': 'hash'}
+            with patch('package.models.user.db.Users.aggregate', return_value=[user]), \
+                patch('package.models.user.check_password', return_value=True), \
+                patch('package.models.user.PasswordHasher.needs_rehash', return_value=False), \
+                patch.object(User, 'create_access_token', return_value='access'), \
+                patch.object(User, 'create_refresh_token', return_value='refresh'):
+                assert User.login('nat_user', 'right', ip)['success']
+            AuthManager._background.submit(lambda: None).result()
+
+            # One more failure behind the same IP doesn't lock everyone out
+            AuthManager.record_failed_attempt("nat_user", ip)
+            assert not AuthManager.check_brute_force("other_user", ip)
+            assert AuthManager.failed_attempts("other_user", ip) == 2
+
+    def test_revoked_tokens_keyed_by_jti(self, fake_redis):
+        from package import db
+        from package.config.auth import AuthManager
+
+        now = datetime.now(timezone.utc)
+        legacy = jwt.encode({'jti': 'legacy-jti', 'exp': int((now + timedelta(days=3)).timestamp())}, 'secret')
+        db.BlockedTokens.insert_one({'token': legacy, 'created_at': now - timedelta(days=4)})
+
+        with app.app_context(), \
+            patch.object(AuthManager.BlockedToken, '_filter', None), \
+            patch.object(AuthManager.BlockedToken, '_filter_ready', False), \
+            patch.object(AuthManager.BlockedToken, '_listener', None):
+            assert AuthManager.block_token({'jti': 'revoked-jti', 'exp': int((now + timedelta(days=7)).timestamp())})
+            assert AuthManager.BlockedToken.is_blocked('revoked-jti')
+            assert AuthManager.BlockedToken.is_blocked('legacy-jti')
+            assert not AuthManager.BlockedToken.is_blocked('live-jti')
+            assert fake_redis.exists('revoked_token:legacy-jti')
+            assert db.BlockedTokens.find_one({'jti': 'legacy-jti', 'token': {'$exists': False}})
+
+            # Redis gone and no trusted filter: MongoDB still answers
+            AuthManager.BlockedToken._filter_ready = False
+            fake_redis.down = True
+            assert AuthManager.BlockedToken.is_blocked('revoked-jti')
+            assert not AuthManager.BlockedToken.is_blocked('live-jti')
+
+    def test_revocations_replayed_once_redis_is_back(self, fake_redis):
+        from package.config.auth import AuthManager
+
+        exp = int((datetime.now(timezone.utc) + timedelta(days=1)).timestamp())
+        with app.app_context(), \
+            patch.object(AuthManager.BlockedToken, '_filter', None), \
+            patch.object(AuthManager.BlockedToken, '_filter_ready', False), \
+            patch.object(AuthManager.BlockedToken, '_listener', None), \
+            patch.object(AuthManager.BlockedToken, '_unpublished', {}), \
+            patch.object(AuthManager.BlockedToken, '_replay_at', 0.0), \
+            patch.object(AuthManager.BlockedToken, 'REPLAY_SECONDS', 0):
+            assert not AuthManager.BlockedToken.is_blocked('other-jti')
+            # Stands in for another worker's filter
+            broadcast = []
+            fake_redis.pubsub().subscribe(revoked_tokens=lambda message: broadcast.append(message['data']))
+
+            fake_redis.down = True
+            assert AuthManager.block_token({'jti': 'offline-jti', 'exp': exp})
+            assert AuthManager.BlockedToken.is_blocked('offline-jti')
+            assert broadcast == []
+
+            fake_redis.down = False
+            assert not AuthManager.BlockedToken.is_blocked('other-jti')
+            assert broadcast == ['offline-jti']
+            assert fake_redis.ttl('revoked_token:offline-jti') > 0
+            assert AuthManager.BlockedToken._unpublished == {}
+
+    def test_revocation_filter_rebuilt_when_full(self, fake_redis):
+        from package import db
+        from package.config.auth import AuthManager
+
+        now = datetime.now(timezone.utc)
+        db.BlockedTokens.insert_one({'jti': 'expired-jti', 'expires_at': now - timedelta(hours=1)})
+
+        with app.app_context(), \
+            patch.object(AuthManager.BlockedToken, 'FILTER_CAPACITY', 1), \
+            patch.object(AuthManager.BlockedToken, '_filter', None), \
+            patch.object(AuthManager.BlockedToken, '_filter_ready', False), \
+            patch.object(AuthManager.BlockedToken, '_built_at', 0.0), \
+            patch.object(AuthManager.BlockedToken, '_listener', None):
+            assert not AuthManager.BlockedToken.is_blocked('live-jti')
+            old = AuthManager.BlockedToken._filter
+            old.add('expired-jti')  # revoked while this worker was running, since expired
+            for i in range(old.capacity + 1):
+                assert AuthManager.block_token({'jti': f'full-{i}', 'exp': int((now + timedelta(days=1)).timestamp())})
+            assert old.count > old.capacity
+
+            AuthManager.BlockedToken.is_blocked('live-jti')
+            AuthManager._background.submit(lambda: None).result()
+
+            rebuilt = AuthManager.BlockedToken._filter
+            assert rebuilt is not old
+            assert AuthManager.BlockedToken._filter_ready
+            assert rebuilt.capacity >= 2 * db.BlockedTokens.count_documents({'expires_at': {'$gt': now}})
+            assert 'expired-jti' not in rebuilt
+            assert all(f'full-{i}' in rebuilt for i in range(old.capacity + 1))
+
+            # Nothing to do until the filter is full or stale again
+            AuthManager.BlockedToken.is_blocked('live-jti')
+            AuthManager._background.submit(lambda: None).result()
+            assert AuthManager.BlockedToken._filter is rebuilt
+
+    def test_password_hasher_rehash_and_backpressure(self):
+        import threading
+        import bcrypt
+        from package.middleware import PasswordHasher, PasswordHashingBusy, hash_password, check_password
+
+        with patch.object(PasswordHasher, 'ROUNDS', 4):
+            old_hash = hash_password("s3cret")
+            assert check_password("s3cret", old_hash)
+            assert not PasswordHasher.needs_rehash(old_hash)
+
+        with patch.object(PasswordHasher, 'ROUNDS', 5):
+            assert PasswordHasher.needs_rehash(old_hash)
+            upgraded = []
+            PasswordHasher.rehash_later("s3cret", upgraded.append).result(timeout=5)
+            assert bcrypt.checkpw(b"s3cret", upgraded[0])
+            assert not PasswordHasher.needs_rehash(upgraded[0])
+
+        full = threading.BoundedSemaphore(1)
+        full.acquire()
+        with patch.object(PasswordHasher, '_slots', full), patch.object(PasswordHasher, 'WAIT_SECONDS', 0):
+            rejected = PasswordHasher.stats()['rejected']
+            with pytest.raises(PasswordHashingBusy):
+                check_password("s3cret", old_hash)
+            assert PasswordHasher.rehash_later("s3cret", upgraded.append) is None
+            assert PasswordHasher.stats()['rejected'] == rejected + 2
+
+    def test_verified_token_cache_skips_repeat_decode(self, client):
+        from package.config.utility import VerifiedTokenCache
+        headers = generate_test_token(ObjectId(), "cached_dev")
+
+        with patch('package.models.user.User.User_Data', return_value={"username": "cached_dev"}), \
+            patch('package.config.utility.jwt.decode', wraps=jwt.decode) as decode:
+            for _ in range(3):
+                assert client.post('/User/me', headers=headers).status_code == 200
+        assert decode.call_count == 1
+
+        # Past the token's exp the cached entry is dropped and the token verified again
+        expired = VerifiedTokenCache.stats()['expired']
+        with patch('package.models.user.User.User_Data', return_value={"username": "cached_dev"}), \
+            patch('package.config.utility.time.time', return_value=datetime.now(timezone.utc).timestamp() + 3600), \
+            patch('package.config.utility.jwt.decode', wraps=jwt.decode) as decode:
+            client.post('/User/me', headers=headers)
+        assert decode.call_count == 1
+        assert VerifiedTokenCache.stats()['expired'] == expired + 1
+
+    def test_login_single_aggregation(self, client):
+        from package.models.user import User
+        from package.config.auth import AuthManager
+        from package.middleware import PasswordHasher, hash_password
+
+        with patch.object(PasswordHasher, 'ROUNDS', 4):
+            user_id = db.Users.insert_one({
+                'username': 'single_trip', 'email': 'st@example.com', 'password': hash_password('pw123'),
+                'firstname': 'Single', 'lastname': 'Trip', 'image': {}, 'role': 'defualt'
+            }).inserted_id
+            org_id = ObjectId()
+            db.User_Organisation.insert_one({'user_id': user_id, 'organisation_id': org_id})
+
+            with patch.object(User, 'User_Data', side_effect=AssertionError("extra round trip")), \
+                patch.object(AuthManager, 'failed_attempts', return_value=0), \
+                patch.object(AuthManager, 'clear_failed_attempts_later') as clear_later, \
+                patch('package.models.user.ALGORITHM', 'HS256'), \
+                patch.object(SecurityConfig, 'JWT_REFRESH_SECRET_KEY', 'test_refresh_key'):
+                response = client.post('/login', json={'username': 'single_trip', 'password': 'pw123'})
+
+        assert response.status_code == 200
+        data = response.get_json()['data']
+        assert 'password' not in data
+        assert data['organisations'] == [{'organisation_id': str(org_id)}]
+        clear_later.assert_not_called()
+
+    def test_refresh_token_family_rotation_and_reuse(self, fake_redis):
+        from package.models.user import User
+        from package.config.auth import AuthManager
+
+        user_id = ObjectId()
+        claims = {'_id': str(user_id), 'username': 'fam', 'email': 'f@example.com', 'image': {},
+                  'firstname': 'Fam', 'lastname': 'Ily', 'organisations': [], 'workspaces': []}
+
+        with app.app_context(), \
+            patch.object(User, 'User_Data', return_value=claims) as user_data, \
+            patch.object(AuthManager.BlockedToken, '_filter', None), \
+            patch.object(AuthManager.BlockedToken, '_filter_ready', False), \
+            patch.object(AuthManager.BlockedToken, '_listener', None), \
+            patch('package.models.user.ALGORITHM', 'HS256'), \
+            patch.object(SecurityConfig, 'JWT_REFRESH_SECRET_KEY', 'test_refresh_key'), \
+            patch.dict(app.config, {'JWT_REFRESH_SECRET_KEY': 'test_refresh_key'}):
+            first = User.create_refresh_token(claims)
+            family = jwt.decode(first, 'test_refresh_key', 'HS256')['fid']
+
+            rotated = User.refresh(first)
+            assert rotated['success']
+            second = jwt.decode(rotated['refresh_token'], 'test_refresh_key', 'HS256')
+            assert second['fid'] == family
+            assert fake_redis.get(f"refresh_family:{family}") == second['jti']
+            assert User.server_Refresh(rotated['refresh_token'])['success']
+            assert user_data.call_count == 1  # second lookup served from the claims cache
+
+            # Replaying the superseded token revokes the whole family
+            assert User.refresh(first)['error'] == 'Token reuse detected'
+            assert User.refresh(rotated['refresh_token'])['error'] == 'Token revoked'
+
+    def test_refresh_fallback_spends_the_family(self, fake_redis):
+        from package.models.user import User
+        from package.config.auth import AuthManager
+
+        claims = {'_id': str(ObjectId()), 'username': 'fall', 'email': 'fb@example.com', 'image': {},
+                  'firstname': 'Fall', 'lastname': 'Back', 'organisations': [], 'workspaces': []}
+
+        with app.app_context(), \
+            patch.object(User, 'User_Data', return_value=claims), \
+            patch.object(AuthManager.BlockedToken, '_filter', None), \
+            patch.object(AuthManager.BlockedToken, '_filter_ready', False), \
+            patch.object(AuthManager.BlockedToken, '_listener', None), \
+            patch('package.models.user.ALGORITHM', 'HS256'), \
+            patch.object(SecurityConfig, 'JWT_REFRESH_SECRET_KEY', 'test_refresh_key'), \
+            patch.dict(app.config, {'JWT_REFRESH_SECRET_KEY': 'test_refresh_key'}):
+            token = User.create_refresh_token(claims)
+            family = jwt.decode(token, 'test_refresh_key', 'HS256')['fid']
+
+            # Redis down: rotation falls back to the MongoDB blocklist
+            fake_redis.down = True
+            fallback = User.refresh(token)
+            assert fallback['success']
+            assert 'fid' not in jwt.decode(fallback['refresh_token'], 'test_refresh_key', 'HS256')
+
+            # Back up with the family still pointing at the spent token: no replay
+            fake_redis.down = False
+            assert fake_redis.get(f"refresh_family:{family}") is not None
+            assert User.server_Refresh(token)['error'] == 'Token revoked'
+            assert User.refresh(token)['error'] == 'Token revoked'
+            assert not fake_redis.exists(f"refresh_family:{family}")
+            assert User.refresh(fallback['refresh_token'])['success']